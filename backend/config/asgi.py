@@ -9,8 +9,43 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+
+class ThreadedASGIHandler(ASGIHandler):
+    """
+    Django runs sync views through thread-sensitive sync_to_async, so every
+    sync view of a worker process shares one thread and they run one at a
+    time. Run each sync request on a pool thread of its own instead, as a
+    threaded WSGI worker would; async views are unchanged.
+    """
+
+    def make_view_atomic(self, view):
+        view = super().make_view_atomic(view)
+        if iscoroutinefunction(view):
+            return view
+
+        def run(request, *args, **kwargs):
+            try:
+                response = view(request, *args, **kwargs)
+                # Render here too (the project has no template response
+                # middleware), not on the shared thread afterwards
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                return response
+            finally:
+                close_old_connections()
+
+        async def threaded(request, *args, **kwargs):
+            return await sync_to_async(run, thread_sensitive=False)(request, *args, **kwargs)
+
+        return threaded
+
+
+django.setup(set_prefix=False)
+application = ThreadedASGIHandler()
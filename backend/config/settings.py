@@ -16,6 +16,103 @@ if not ALLOWED_HOSTS:
 
 MAP_API_KEY = os.environ.get('MAP_API_KEY', '').strip()
 
+# OpenRouteService HTTP client (one pooled keep-alive session per process)
+ORS_BASE_URL = os.environ.get('ORS_BASE_URL', 'https://api.openrouteservice.org').rstrip('/')
+ORS_POOL_SIZE = int(os.environ.get('ORS_POOL_SIZE', 10))
+ORS_CONNECT_TIMEOUT = float(os.environ.get('ORS_CONNECT_TIMEOUT', 3.05))
+ORS_GEOCODE_TIMEOUT = float(os.environ.get('ORS_GEOCODE_TIMEOUT', 5))
+ORS_DIRECTIONS_TIMEOUT = float(os.environ.get('ORS_DIRECTIONS_TIMEOUT', 10))
+ORS_MAX_RETRIES = int(os.environ.get('ORS_MAX_RETRIES', 2))
+ORS_RETRY_BACKOFF = float(os.environ.get('ORS_RETRY_BACKOFF', 0.3))
+
+# Per-endpoint ORS circuit breaker, shared across workers via the database.
+# After ORS_BREAKER_FAILURES consecutive failures calls fail fast for
+# ORS_BREAKER_RESET_SECONDS, then one probe decides whether to close again.
+ORS_BREAKER_FAILURES = int(os.environ.get('ORS_BREAKER_FAILURES', 5))
+ORS_BREAKER_RESET_SECONDS = float(os.environ.get('ORS_BREAKER_RESET_SECONDS', 30))
+ORS_BREAKER_SYNC_SECONDS = float(os.environ.get('ORS_BREAKER_SYNC_SECONDS', 2))  # Per-process state cache
+ORS_HEDGE_DELAY = float(os.environ.get('ORS_HEDGE_DELAY', 0.75))  # Duplicate slow GETs after this long; 0 disables
+
+# Routing backend: 'ors' (OpenRouteService, falling back to the local road
+# graph when one is configured) or 'offline' (local road graph only).
+# Build the graph with `manage.py build_road_graph extract.osm graph.npz`.
+ROUTING_BACKEND = os.environ.get('ROUTING_BACKEND', 'ors')
+ROAD_GRAPH_PATH = os.environ.get('ROAD_GRAPH_PATH', '')
+ROAD_GRAPH_MAX_SNAP_MILES = float(os.environ.get('ROAD_GRAPH_MAX_SNAP_MILES', 25))
+
+# Fuel stations / truck stops / rest areas that planned stops snap to.
+# Build with `manage.py build_poi_index pois.csv pois.npz`. A stop moves to
+# the last POI within POI_CORRIDOR_MILES of the route, at most
+# POI_SNAP_LOOKBACK_MILES before the point its HOS / fuel limit is hit.
+POI_INDEX_PATH = os.environ.get('POI_INDEX_PATH', '')
+POI_CORRIDOR_MILES = float(os.environ.get('POI_CORRIDOR_MILES', 2))
+POI_SNAP_LOOKBACK_MILES = float(os.environ.get('POI_SNAP_LOOKBACK_MILES', 60))
+
+# Geocoding / autocomplete cache (in-process LRU in front of a DB table)
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 24 * 3600))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', 50000))
+GEOCODE_CACHE_LOCAL_SIZE = int(os.environ.get('GEOCODE_CACHE_LOCAL_SIZE', 1024))
+
+# Directions cache keyed on rounded waypoints, with cross-worker request coalescing
+ROUTE_CACHE_TTL = int(os.environ.get('ROUTE_CACHE_TTL', 7 * 24 * 3600))
+ROUTE_CACHE_PRECISION = int(os.environ.get('ROUTE_CACHE_PRECISION', 4))  # decimal places (~11 m)
+ROUTE_CACHE_LEASE_SECONDS = float(os.environ.get('ROUTE_CACHE_LEASE_SECONDS', 30))
+ROUTE_CACHE_POLL_INTERVAL = float(os.environ.get('ROUTE_CACHE_POLL_INTERVAL', 0.1))
+
+# Multi-stop planning (POST /api/trips/plan/multi/): one ORS matrix call
+# orders the stops, one directions call routes them
+MULTI_STOP_MAX_STOPS = int(os.environ.get('MULTI_STOP_MAX_STOPS', 25))
+
+# Departure-time sweep (POST /api/trips/sweep/)
+SWEEP_MAX_SCENARIOS = int(os.environ.get('SWEEP_MAX_SCENARIOS', 10000))
+
+# Bulk planning (POST /api/trips/plan/batch/)
+PLAN_BATCH_MAX_ITEMS = int(os.environ.get('PLAN_BATCH_MAX_ITEMS', 1000))
+PLAN_BATCH_WORKERS = int(os.environ.get('PLAN_BATCH_WORKERS', 8))
+PLAN_BATCH_INSERT_SIZE = int(os.environ.get('PLAN_BATCH_INSERT_SIZE', 200))
+
+# Trip detail responses are immutable; browsers/CDNs may cache them this long
+TRIP_CACHE_MAX_AGE = int(os.environ.get('TRIP_CACHE_MAX_AGE', 365 * 24 * 3600))
+# ?detail= levels pre-rendered when a trip is saved (the frontend asks for
+# 'high'); other levels are rendered on their first request
+TRIP_SNAPSHOT_LEVELS = [l.strip() for l in os.environ.get('TRIP_SNAPSHOT_LEVELS', 'full,high').split(',') if l.strip()]
+
+# Trip listing (GET /api/trips/)
+TRIP_LIST_PAGE_SIZE = int(os.environ.get('TRIP_LIST_PAGE_SIZE', 50))
+TRIP_LIST_MAX_PAGE_SIZE = int(os.environ.get('TRIP_LIST_MAX_PAGE_SIZE', 200))
+
+# Spatial trip queries (GET /api/trips/near/ and /api/trips/within/). Route
+# cells are written when a trip is saved; index older trips with
+# `manage.py index_route_cells`.
+ROUTE_CELL_INSERT_SIZE = int(os.environ.get('ROUTE_CELL_INSERT_SIZE', 1000))
+SPATIAL_MAX_RADIUS_MILES = float(os.environ.get('SPATIAL_MAX_RADIUS_MILES', 500))
+SPATIAL_MAX_BOX_DEGREES = float(os.environ.get('SPATIAL_MAX_BOX_DEGREES', 20))
+
+# Server-rendered log sheets (GET /api/trips/export/): pages cached per
+# trip-day in each process, trips read from the database in chunks
+LOG_SHEET_CACHE_SIZE = int(os.environ.get('LOG_SHEET_CACHE_SIZE', 2048))
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 100))
+
+# Deduplicated route geometries (trips.RouteGeometry): decoded lines kept per
+# process for hot lanes, the insert batch size for new ones, and how long a
+# row no trip references must have gone unused before store_route_geometries
+# --prune drops it
+ROUTE_GEOMETRY_CACHE_SIZE = int(os.environ.get('ROUTE_GEOMETRY_CACHE_SIZE', 256))
+ROUTE_GEOMETRY_INSERT_SIZE = int(os.environ.get('ROUTE_GEOMETRY_INSERT_SIZE', 200))
+ROUTE_GEOMETRY_PRUNE_AGE = int(os.environ.get('ROUTE_GEOMETRY_PRUNE_AGE', 3600))
+
+# Metrics (/metrics). Set METRICS_MULTIPROC_DIR to a shared writable directory
+# when running several gunicorn workers so any worker can serve the totals.
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Asynchronous planning jobs (drained by `manage.py plan_worker`)
+PLAN_JOB_CONCURRENCY = int(os.environ.get('PLAN_JOB_CONCURRENCY', 4))
+PLAN_JOB_POLL_INTERVAL = float(os.environ.get('PLAN_JOB_POLL_INTERVAL', 1.0))
+PLAN_JOB_STALE_SECONDS = int(os.environ.get('PLAN_JOB_STALE_SECONDS', 600))
+PLAN_JOB_MAX_ATTEMPTS = int(os.environ.get('PLAN_JOB_MAX_ATTEMPTS', 3))
+PLAN_JOB_REQUEUE_INTERVAL = float(os.environ.get('PLAN_JOB_REQUEUE_INTERVAL', 60))  # stale-job sweep while running
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -31,6 +128,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'trips.middleware.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
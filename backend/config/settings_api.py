@@ -0,0 +1,36 @@
+"""
+Slim settings for the serverless API entry point (index.py).
+
+Everything in config.settings, minus what the JSON API never touches: no
+admin, auth, sessions, messages or static files, no CSRF or clickjacking
+middleware (every API view is unauthenticated), and JSON-only DRF
+rendering. Run migrations and the admin with config.settings.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'rest_framework',
+    'corsheaders',
+    'trips',
+]
+
+MIDDLEWARE = [
+    'trips.middleware.ServerTimingMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'config.urls_api'
+
+TEMPLATES = []
+AUTH_PASSWORD_VALIDATORS = []
+USE_I18N = False
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'UNAUTHENTICATED_USER': None,  # AnonymousUser lives in django.contrib.auth
+}
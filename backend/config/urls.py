@@ -1,13 +1,7 @@
-
 from django.contrib import admin
-from django.urls import path, include
-from django.http import JsonResponse
-
-def health_check(request):
-    return JsonResponse({"status": "ok"})
+from django.urls import path
+from .urls_api import urlpatterns as api_urlpatterns
 
-urlpatterns = [
-    path('', health_check),
+urlpatterns = api_urlpatterns + [
     path('admin/', admin.site.urls),
-    path('api/trips/', include('trips.urls')),
 ]
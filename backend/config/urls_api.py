@@ -0,0 +1,18 @@
+# The API's URLs on their own: what config.settings_api serves. config.urls
+# adds the admin site on top.
+
+from django.urls import path, include
+from django.http import HttpResponse, JsonResponse
+from trips.services import metrics
+
+def health_check(request):
+    return JsonResponse({"status": "ok"})
+
+def metrics_view(request):
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+urlpatterns = [
+    path('', health_check),
+    path('metrics', metrics_view),
+    path('api/trips/', include('trips.urls')),
+]
@@ -1,5 +1,10 @@
 
 workers = 2
+# ASGI workers: async views (/api/trips/async/...) keep many plans in flight
+# per process. Django alone would run every sync view of a worker on one
+# shared thread, one request at a time; config.asgi's handler gives each
+# sync request a pool thread of its own instead.
+worker_class = "uvicorn_worker.UvicornWorker"
 bind = "0.0.0.0:8000"
 timeout = 120
 forwarded_allow_ips = '*'
@@ -1,4 +1,3 @@
-
 import os
 import sys
 
@@ -9,7 +8,15 @@ import sys
 current_dir = os.path.dirname(__file__)
 sys.path.append(current_dir)
 
+# API-only profile (no admin, sessions or static files) unless overridden
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_api')
+
+from django.urls import get_resolver
 from config.wsgi import application
 
+# Import the URLconf and compile every pattern while the function
+# initialises, instead of on its first request
+get_resolver().reverse_dict
+
 # Vercel looks for 'app'
 app = application
@@ -0,0 +1,99 @@
+
+# Cold-start measurement for the serverless entry point: each run is a fresh
+# interpreter that imports the entry module and serves one request, as a new
+# Vercel function instance would. One extra run under `python -X importtime`
+# gives the per-module breakdown.
+
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from django.conf import settings
+
+# Worth keeping off the cold-start path; reported so that a new eager import
+# shows up. (rest_framework itself imports requests and the admin package.)
+HEAVY_MODULES = ('numpy', 'requests', 'httpx', 'django.contrib.admin', 'trips.services.planner')
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import importlib
+entry = importlib.import_module({module!r})
+imported = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {{}}
+setup_testing_defaults(environ)
+environ.update(PATH_INFO={path!r}, QUERY_STRING={query!r}, HTTP_HOST='localhost')
+response = {{}}
+app = getattr(entry, 'application', None) or getattr(entry, 'app')
+b''.join(app(environ, lambda status, headers, exc_info=None: response.setdefault('status', status)))
+done = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'request_ms': (done - imported) * 1000,
+    'status': response.get('status'),
+    'modules': len(sys.modules),
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+def _child(profile, module, path, importtime=False):
+    path, _, query = path.partition('?')
+    code = CHILD.format(module=module, path=path, query=query, heavy=HEAVY_MODULES)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+    result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start of {module} with {profile} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+def parse_importtime(stderr):
+    """
+    [(module, self_us, cumulative_us, depth), ...] from `-X importtime`
+    output, in import order.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            own, cumulative, name = line[len('import time:'):].split('|')
+            own, cumulative = int(own), int(cumulative)
+        except ValueError:
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), own, cumulative, depth))
+    return rows
+
+def by_package(rows):
+    """
+    Self time per top-level package in microseconds, largest first.
+    """
+    totals = defaultdict(int)
+    for name, own, _, _ in rows:
+        totals[name.split('.')[0]] += own
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+def measure(profile, module='index', path='/', repeat=3):
+    """
+    Best-of-repeat cold start (import + first request) for the entry module
+    under a settings profile, plus the importtime breakdown of one more run.
+    """
+    runs = [_child(profile, module, path)[0] for _ in range(max(repeat, 1))]
+    best = min(runs, key=lambda run: run['import_ms'] + run['request_ms'])
+    _, stderr = _child(profile, module, path, importtime=True)
+    rows = parse_importtime(stderr)
+    return {
+        'profile': profile,
+        'module': module,
+        'path': path,
+        'import_ms': round(best['import_ms'], 1),
+        'request_ms': round(best['request_ms'], 1),
+        'total_ms': round(best['import_ms'] + best['request_ms'], 1),
+        'status': best['status'],
+        'modules_loaded': best['modules'],
+        'heavy_modules': best['heavy'],
+        'imports': rows,
+        'packages': by_package(rows),
+    }
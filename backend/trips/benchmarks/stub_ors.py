@@ -0,0 +1,124 @@
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from ..services.routing import RouteIndex
+
+def fake_coords(text):
+    # Deterministic point in the continental US for any address string
+    digest = hashlib.sha256(text.strip().lower().encode('utf-8')).digest()
+    lon = -122.0 + digest[0] / 255.0 * 50.0
+    lat = 27.0 + digest[1] / 255.0 * 20.0
+    return [round(lon, 6), round(lat, 6)]
+
+def synthetic_line(waypoints, points_per_leg):
+    """
+    Wiggly LineString through the waypoints with points_per_leg vertices per leg.
+    """
+    legs = []
+    rng = np.random.default_rng(len(waypoints) * points_per_leg)
+    for start, end in zip(waypoints, waypoints[1:]):
+        t = np.linspace(0.0, 1.0, max(points_per_leg, 2))
+        lon = start[0] + (end[0] - start[0]) * t
+        lat = start[1] + (end[1] - start[1]) * t
+        jitter = rng.normal(0, 0.002, size=(2, len(t)))
+        jitter[:, 0] = jitter[:, -1] = 0
+        legs.append(np.column_stack([lon + jitter[0], lat + jitter[1]])[:-1])
+    legs.append(np.asarray([waypoints[-1][:2]]))
+    return np.vstack(legs)
+
+class StubORSServer:
+    """
+    Local stand-in for the OpenRouteService endpoints used by the app, with
+    a configurable per-request latency. Use as a context manager; .url is
+    suitable for settings.ORS_BASE_URL.
+    """
+    def __init__(self, latency_ms=0, points_per_leg=500):
+        self.latency = latency_ms / 1000.0
+        self.points_per_leg = points_per_leg
+        self.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real service
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                url = urlparse(self.path)
+                text = parse_qs(url.query).get('text', [''])[0]
+                if url.path in ('/geocode/search', '/geocode/autocomplete'):
+                    coords = fake_coords(text)
+                    self._reply({'features': [{
+                        'geometry': {'type': 'Point', 'coordinates': coords},
+                        'properties': {'label': text},
+                    }]})
+                else:
+                    self._reply({'error': 'not found'}, status=404)
+
+            def do_POST(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                path = urlparse(self.path).path
+                if path.startswith('/v2/matrix/'):
+                    locations = body['locations']
+                    miles = [[RouteIndex([a, b]).total_miles for b in locations] for a in locations]
+                    self._reply({
+                        'distances': miles,
+                        'durations': [[m / 60.0 * 3600 for m in row] for row in miles],
+                    })
+                    return
+                if not path.startswith('/v2/directions/'):
+                    self._reply({'error': 'not found'}, status=404)
+                    return
+                waypoints = body['coordinates']
+                line = synthetic_line(waypoints, stub.points_per_leg)
+                segments = []
+                for start, end in zip(waypoints, waypoints[1:]):
+                    meters = RouteIndex([start, end]).total_miles / 0.000621371
+                    segments.append({'distance': meters, 'duration': meters / 26.8})
+                total = sum(s['distance'] for s in segments)
+                self._reply({'features': [{
+                    'geometry': {'type': 'LineString', 'coordinates': line.tolist()},
+                    'properties': {
+                        'summary': {'distance': total, 'duration': total / 26.8},
+                        'segments': segments,
+                    },
+                }]})
+
+        return Handler
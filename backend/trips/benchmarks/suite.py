@@ -0,0 +1,217 @@
+
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+import django
+import numpy as np
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from ..models import Trip
+from ..serializers import TripSerializer
+from ..services import geocache, poi, routestore, sweep
+from ..services.eld_engine import generate_eld_logs
+from ..services.geometry import build_lod
+from ..services.routing import RouteIndex
+from .stub_ors import StubORSServer, synthetic_line
+
+ROUTE_SIZES = [10, 1_000, 100_000, 1_000_000]
+TRIP_MILES = [50, 500, 2_000, 10_000]
+SERIALIZER_SIZES = [1_000, 100_000]
+QUICK_ROUTE_SIZES = [10, 1_000, 10_000]
+QUICK_SERIALIZER_SIZES = [1_000]
+POI_COUNTS = [10_000, 300_000]
+QUICK_POI_COUNTS = [10_000]
+STOPS_PER_ROUTE = 50
+
+def synthetic_route(n_points, miles=2_000.0):
+    """
+    Roughly west-east LineString with n_points vertices and about `miles` length.
+    """
+    degrees = miles / 57.0  # ~miles per degree of longitude around 35N
+    return {
+        'type': 'LineString',
+        'coordinates': synthetic_line([[-120.0, 35.0], [-120.0 + degrees, 36.0]], n_points).tolist(),
+    }
+
+def measure(fn, repeat):
+    """
+    Run fn() `repeat` times; returns timing stats in milliseconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+    }
+
+def bench_eld(repeat):
+    results = {}
+    for miles in TRIP_MILES:
+        route = {'segment1_miles': miles * 0.4, 'segment2_miles': miles * 0.6}
+        results[f'eld_simulate/{miles}mi'] = measure(lambda: generate_eld_logs(route, 0.0), repeat)
+    return results
+
+def bench_sweep(repeat):
+    # 15-minute departures x 8 cycle values against a single scalar plan
+    legs = [(1_500, 60), (1_300, 60)]
+    hours, cycles = np.meshgrid(np.arange(0, 24, 0.25), np.arange(0, 70, 9), indexing='ij')
+    return {
+        f'sweep/{hours.size}scenarios': measure(lambda: sweep.sweep(legs, hours, cycles), repeat),
+        'sweep/scalar_single': measure(lambda: generate_eld_logs({'segment1_miles': 1_500, 'segment2_miles': 1_300}, 0.0), repeat),
+    }
+
+def bench_interpolation(repeat, sizes):
+    results = {}
+    for size in sizes:
+        geometry = synthetic_route(size)
+        distances = np.linspace(0, RouteIndex(geometry).total_miles, STOPS_PER_ROUTE).tolist()
+
+        def run():
+            RouteIndex(geometry).locate_many(distances)
+
+        results[f'interpolate/{size}pts'] = measure(run, repeat)
+    return results
+
+def bench_poi(repeat, counts):
+    """
+    One corridor query (the last POI in a 60-mile stretch) per run, with POIs
+    spread uniformly over the continental US.
+    """
+    results = {}
+    rng = np.random.default_rng(0)
+    route = synthetic_route(100_000)
+    corridor_route = RouteIndex(build_lod(route)[poi.CORRIDOR_LOD]['coordinates'])
+    ends = iter(np.resize(np.linspace(100, corridor_route.total_miles, 97), 10 ** 6).tolist())
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            path = os.path.join(tmp, f'{count}.npz')
+            pois = zip(rng.uniform(-124, -67, count), rng.uniform(25, 49, count), rng.choice(poi.KINDS, count), [''] * count)
+            poi.write_index(list(pois), path, log=lambda *_: None)
+            corridor = poi.Corridor(poi.POIIndex(path), corridor_route, 2.0, 60.0)
+
+            def run():
+                end = next(ends)
+                corridor.last_before('REST', end - 60, end)
+
+            results[f'poi_corridor/{count}pois'] = measure(run, repeat * 20)
+    return results
+
+def bench_serializer(repeat, sizes):
+    results = {}
+    for size in sizes:
+        geometry = synthetic_route(size)
+        eld = generate_eld_logs({'segment1_miles': 1_000, 'segment2_miles': 1_000}, 0.0)
+        trip = Trip(
+            id=1, start_location='A', pickup_location='B', dropoff_location='C',
+            distance_miles=2_000, duration_hours=33, route_geometry=geometry,
+            eld_logs=eld['logs'], markers=[], created_at=datetime.now(timezone.utc),
+        )
+        results[f'serialize/{size}pts'] = measure(lambda: JSONRenderer().render(TripSerializer(trip).data), repeat)
+    return results
+
+def bench_routestore(repeat, sizes):
+    results = {}
+    for size in sizes:
+        coords = np.round(synthetic_line([[-120.0, 35.0], [-85.0, 36.0]], size), 5).tolist()  # ORS precision
+        geometry = {'type': 'LineString', 'coordinates': coords}
+        _, data, _ = routestore.encode(geometry)
+        results[f'route_encode/{size}pts'] = measure(lambda: routestore.encode(geometry), repeat)
+        results[f'route_decode/{size}pts'] = measure(lambda: routestore.decode(data), repeat)
+        results[f'route_decode/{size}pts']['bytes_per_point'] = round(len(data) / size, 2)
+    return results
+
+def bench_plan_endpoint(repeat, latency_ms, points_per_leg):
+    """
+    Full POST /api/trips/plan/ through Django against the stub ORS server.
+    'cold' uses fresh addresses (every cache misses); 'warm' re-plans one lane
+    with different cycle hours (caches hit, no trip reuse).
+    """
+    results = {}
+    client = Client()
+    url = reverse('trip-plan')
+
+    with StubORSServer(latency_ms=latency_ms, points_per_leg=points_per_leg) as stub, \
+            override_settings(ORS_BASE_URL=stub.url, MAP_API_KEY='benchmark'):
+        counter = iter(range(10 ** 9))
+
+        def cold():
+            n = next(counter)
+            response = client.post(url, {
+                'start_location': f'Cold start {n}',
+                'pickup_location': f'Cold pickup {n}',
+                'dropoff_location': f'Cold dropoff {n}',
+            }, content_type='application/json')
+            assert response.status_code == 201, response.content
+
+        def warm():
+            response = client.post(url, {
+                'start_location': 'Warm start',
+                'pickup_location': 'Warm pickup',
+                'dropoff_location': 'Warm dropoff',
+                'current_cycle_used': next(counter) % 7000 / 100.0,
+            }, content_type='application/json')
+            assert response.status_code == 201, response.content
+
+        geocache.clear_local()
+        results[f'plan_endpoint/cold/{latency_ms}ms'] = measure(cold, repeat)
+        warm()
+        results[f'plan_endpoint/warm/{latency_ms}ms'] = measure(warm, repeat)
+        results[f'plan_endpoint/cold/{latency_ms}ms']['upstream_requests'] = stub.requests
+    return results
+
+def run_suite(repeat=5, quick=False, latency_ms=20, points_per_leg=2_000, only=None):
+    groups = {
+        'eld': lambda: bench_eld(repeat),
+        'sweep': lambda: bench_sweep(repeat),
+        'interpolate': lambda: bench_interpolation(repeat, QUICK_ROUTE_SIZES if quick else ROUTE_SIZES),
+        'poi': lambda: bench_poi(repeat, QUICK_POI_COUNTS if quick else POI_COUNTS),
+        'serialize': lambda: bench_serializer(repeat, QUICK_SERIALIZER_SIZES if quick else SERIALIZER_SIZES),
+        'routestore': lambda: bench_routestore(repeat, QUICK_SERIALIZER_SIZES if quick else SERIALIZER_SIZES),
+        'plan': lambda: bench_plan_endpoint(repeat, latency_ms, points_per_leg),
+    }
+    results = {}
+    for name, run in groups.items():
+        if only and name not in only:
+            continue
+        results.update(run())
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'numpy': np.__version__,
+            'repeat': repeat,
+            'quick': quick,
+            'stub_latency_ms': latency_ms,
+        },
+        'results': results,
+    }
+
+def compare(current, baseline, threshold):
+    """
+    Compare median timings against a baseline run. Returns a list of
+    (case, baseline_ms, current_ms, ratio, regressed) for cases in both.
+    """
+    rows = []
+    for case, stats in current['results'].items():
+        base = baseline['results'].get(case)
+        if not base or not base['median_ms']:
+            continue
+        ratio = stats['median_ms'] / base['median_ms']
+        rows.append((case, base['median_ms'], stats['median_ms'], round(ratio, 3), ratio > 1 + threshold))
+    return rows
+
+def load(path):
+    with open(path) as fh:
+        return json.load(fh)
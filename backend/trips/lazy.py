@@ -0,0 +1,28 @@
+
+# Deferred imports for the request path. Modules that pull in numpy,
+# requests or httpx are only needed by the endpoints that plan or route, so
+# cold starts serving anything else (health checks, trip lookups) skip them.
+
+import importlib
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+    Attributes are looked up on the real module every time, so
+    mock.patch('trips.services.x.name') still takes effect.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            # import_module holds the import lock, so concurrent first uses are safe
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{'' if self._module is None else ' (loaded)'}>"
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,55 @@
+
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from trips.benchmarks import suite
+
+class Command(BaseCommand):
+    help = "Benchmark the ELD engine, route interpolation, serialization and the plan endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write results as JSON to this file")
+        parser.add_argument('--baseline', help="Earlier --output file to compare against")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed median slowdown vs. baseline before failing (0.25 = 25%%)")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--quick', action='store_true', help="Skip the largest routes (for CI)")
+        parser.add_argument('--latency-ms', type=int, default=20, help="Stub ORS latency per request")
+        parser.add_argument('--points-per-leg', type=int, default=2000, help="Stub ORS route density")
+        parser.add_argument('--only', help="Comma-separated groups: eld,sweep,interpolate,poi,serialize,routestore,plan")
+
+    def handle(self, *args, **options):
+        only = set(options['only'].split(',')) if options['only'] else None
+
+        # The plan endpoint writes trips; keep them out of the real database.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = suite.run_suite(
+                repeat=options['repeat'],
+                quick=options['quick'],
+                latency_ms=options['latency_ms'],
+                points_per_leg=options['points_per_leg'],
+                only=only,
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for case, stats in report['results'].items():
+            self.stdout.write(f"{case:<40} median {stats['median_ms']:>10.3f} ms   min {stats['min_ms']:>10.3f} ms")
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if options['baseline']:
+            rows = suite.compare(report, suite.load(options['baseline']), options['threshold'])
+            regressions = [row for row in rows if row[4]]
+            for case, base, current, ratio, regressed in rows:
+                flag = 'REGRESSION' if regressed else 'ok'
+                self.stdout.write(f"{case:<40} {base:>10.3f} -> {current:>10.3f} ms  x{ratio:<6} {flag}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed more than {options['threshold']:.0%}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from trips.services import poi
+
+class Command(BaseCommand):
+    help = "Build the fuel / truck stop / rest area index (.npz) from a CSV or GeoJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="CSV (lat, lon, kind, name columns) or GeoJSON Points (kind/amenity, name)")
+        parser.add_argument('output', help="Where to write the index, e.g. data/pois.npz")
+
+    def handle(self, *args, **options):
+        try:
+            poi.build_index(options['input'], options['output'], log=self.stdout.write)
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot build POI index: {e}")
+        self.stdout.write("Set POI_INDEX_PATH to the output file to snap planned stops to these POIs.")
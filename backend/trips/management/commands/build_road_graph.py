@@ -0,0 +1,23 @@
+
+from django.core.management.base import BaseCommand, CommandError
+from trips.services import roadgraph
+
+class Command(BaseCommand):
+    help = "Build the offline routing graph (.npz) from an OSM XML extract."
+
+    def add_arguments(self, parser):
+        parser.add_argument('osm_file', help="OSM XML extract (e.g. from osmium extract / Overpass)")
+        parser.add_argument('output', help="Where to write the graph, e.g. data/road_graph.npz")
+        parser.add_argument('--landmarks', type=int, default=8, help="ALT landmarks to precompute")
+
+    def handle(self, *args, **options):
+        if options['landmarks'] < 1:
+            raise CommandError("--landmarks must be at least 1")
+        try:
+            roadgraph.build_graph(
+                options['osm_file'], options['output'],
+                landmarks=options['landmarks'], log=self.stdout.write,
+            )
+        except (OSError, ValueError, SyntaxError) as e:
+            raise CommandError(f"Cannot build road graph: {e}")
+        self.stdout.write("Set ROAD_GRAPH_PATH to the output file to enable offline routing.")
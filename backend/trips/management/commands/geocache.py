@@ -0,0 +1,41 @@
+
+from django.core.management.base import BaseCommand, CommandError
+from trips.services import geocache
+from trips.services.routing import get_coords
+
+class Command(BaseCommand):
+    help = "Warm, purge or inspect the geocoding cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['warm', 'purge', 'stats'])
+        parser.add_argument('queries', nargs='*', help="Addresses to warm (in addition to --file)")
+        parser.add_argument('--file', help="Text file with one address per line to warm")
+        parser.add_argument('--all', action='store_true', help="Purge every entry, not only expired ones")
+
+    def handle(self, *args, **options):
+        action = options['action']
+
+        if action == 'warm':
+            queries = list(options['queries'])
+            if options['file']:
+                try:
+                    with open(options['file'], encoding='utf-8') as fh:
+                        queries.extend(line.strip() for line in fh)
+                except OSError as e:
+                    raise CommandError(f"Cannot read {options['file']}: {e}")
+            queries = [q for q in queries if q]
+            if not queries:
+                raise CommandError("Nothing to warm: pass addresses or --file")
+
+            for query in queries:
+                coords = get_coords(query)
+                self.stdout.write(f"{query} -> {coords}")
+
+        elif action == 'purge':
+            removed = geocache.purge(expired_only=not options['all'])
+            self.stdout.write(f"Removed {removed} cached entries")
+
+        table = geocache.table_stats()
+        self.stdout.write(', '.join(f"{k}={v or 0}" for k, v in table.items()))
+        snapshot = geocache.stats()
+        self.stdout.write('this process: ' + ', '.join(f"{k}={v}" for k, v in snapshot.items()))
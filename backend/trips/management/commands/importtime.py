@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from trips.benchmarks import coldstart
+
+class Command(BaseCommand):
+    help = "Measure the serverless cold start (import + first request) with a -X importtime breakdown."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', default='config.settings_api', help="Settings module the entry point runs with")
+        parser.add_argument('--module', default='index', help="Entry module exposing `app` or `application`")
+        parser.add_argument('--path', default='/', help="Path of the first request")
+        parser.add_argument('--repeat', type=int, default=3, help="Cold starts to time (best is reported)")
+        parser.add_argument('--top', type=int, default=15, help="Rows per table")
+        parser.add_argument('--budget-ms', type=float, help="Fail when the cold start takes longer than this")
+
+    def handle(self, *args, **options):
+        try:
+            report = coldstart.measure(options['profile'], options['module'], options['path'], options['repeat'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"{report['module']} with {report['profile']}: import {report['import_ms']:.1f} ms + "
+            f"first request {report['request_ms']:.1f} ms ({report['status']}) = {report['total_ms']:.1f} ms, "
+            f"{report['modules_loaded']} modules"
+        )
+        self.stdout.write(f"Heavy modules loaded: {', '.join(report['heavy_modules']) or 'none'}")
+
+        self.stdout.write("\nSelf time by package (under -X importtime)")
+        for package, own in report['packages'][:options['top']]:
+            self.stdout.write(f"  {package:<30} {own / 1000:>8.1f} ms")
+
+        self.stdout.write("\nSlowest imports (cumulative)")
+        # The entry module's own row is the whole import; leave it out
+        rows = [row for row in report['imports'] if row[0] != report['module']]
+        for name, own, cumulative, depth in sorted(rows, key=lambda row: -row[2])[:options['top']]:
+            self.stdout.write(f"  {name:<50} {cumulative / 1000:>8.1f} ms  (self {own / 1000:.1f} ms)")
+
+        if options['budget_ms'] is not None and report['total_ms'] > options['budget_ms']:
+            raise CommandError(f"Cold start took {report['total_ms']:.1f} ms, over the {options['budget_ms']:.0f} ms budget")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from trips.models import TripRouteCell
+from trips.services import spatial
+
+class Command(BaseCommand):
+    help = "Write route cells for trips saved before the spatial index existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Drop every route cell first (e.g. after changing the cell size)")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            removed, _ = TripRouteCell.objects.all().delete()
+            self.stdout.write(f"Removed {removed} route cells")
+        indexed = spatial.backfill(batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(f"Indexed {indexed} trips")
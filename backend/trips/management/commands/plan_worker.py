@@ -0,0 +1,65 @@
+
+import os
+import signal
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from trips.services import jobs
+
+class Command(BaseCommand):
+    help = "Drain the asynchronous trip planning queue (PlanJob table)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.PLAN_JOB_CONCURRENCY)
+        parser.add_argument('--poll-interval', type=float, default=settings.PLAN_JOB_POLL_INTERVAL)
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+
+        self.recover()
+
+        base_id = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(target=self.work, args=(f"{base_id}:{n}", options), daemon=True)
+            for n in range(max(1, options['concurrency']))
+        ]
+        self.stdout.write(f"Plan worker {base_id} started with {len(threads)} thread(s)")
+        for t in threads:
+            t.start()
+        # Join with a timeout so the main thread keeps handling signals, and
+        # keeps recovering jobs of other workers that died meanwhile.
+        next_recovery = time.monotonic() + settings.PLAN_JOB_REQUEUE_INTERVAL
+        try:
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(0.5)
+                if time.monotonic() >= next_recovery:
+                    self.recover()
+                    next_recovery = time.monotonic() + settings.PLAN_JOB_REQUEUE_INTERVAL
+        finally:
+            connection.close()
+        self.stdout.write("Plan worker stopped")
+
+    def recover(self):
+        requeued, failed = jobs.requeue_stale()
+        if requeued or failed:
+            self.stdout.write(f"Recovered stale jobs: {requeued} requeued, {failed} failed")
+
+    def work(self, worker_id, options):
+        try:
+            while not self.stop.is_set():
+                job = jobs.process_next(worker_id)
+                if job is None:
+                    if options['once']:
+                        return
+                    self.stop.wait(options['poll_interval'])
+                    continue
+                self.stdout.write(f"[{worker_id}] job {job.id} {job.status}")
+        finally:
+            connection.close()
@@ -0,0 +1,18 @@
+
+from django.core.management.base import BaseCommand
+from trips.services import routecache
+
+class Command(BaseCommand):
+    help = "Report or purge the directions cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['stats', 'purge'])
+        parser.add_argument('--all', action='store_true', help="Purge every entry, not only expired ones")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'purge':
+            removed = routecache.purge(expired_only=not options['all'])
+            self.stdout.write(f"Removed {removed} cached routes")
+
+        table = routecache.table_stats()
+        self.stdout.write(', '.join(f"{k}={v}" for k, v in table.items()))
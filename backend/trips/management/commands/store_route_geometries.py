@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from trips.models import RouteGeometry, Trip
+from trips.services import routestore
+
+class Command(BaseCommand):
+    help = (
+        "Move route geometries of trips saved before the deduplicated store existed into it; "
+        "with --prune, also delete stored geometries no trip references any more."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--prune', action='store_true', help="Delete geometries of deleted trips")
+
+    def handle(self, *args, **options):
+        moved = routestore.backfill(batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(f"Moved {moved} trips")
+        if options['prune']:
+            pruned = routestore.prune(batch_size=options['batch_size'])
+            self.stdout.write(f"Pruned {pruned} unreferenced geometries")
+
+        stats = RouteGeometry.objects.aggregate(rows=Count('digest'), points=Sum('points'), size=Sum(Length('data')))
+        trips = Trip.objects.filter(geometry__isnull=False).count()
+        self.stdout.write(
+            f"{stats['rows']} geometries for {trips} trips, "
+            f"{stats['points'] or 0} points in {stats['size'] or 0} bytes"
+        )
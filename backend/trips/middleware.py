@@ -0,0 +1,40 @@
+
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .services import metrics
+
+class ServerTimingMiddleware:
+    """
+    Collect the stages timed with metrics.timed() during a request and
+    report them in a Server-Timing response header.
+    Works in both the WSGI and the ASGI handler chain.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.end_request(token)
+        response['Server-Timing'] = metrics.server_timing_header(timings, total=time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.end_request(token)
+        response['Server-Timing'] = metrics.server_timing_header(timings, total=time.perf_counter() - started)
+        return response
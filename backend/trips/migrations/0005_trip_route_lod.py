@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_plan_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='route_lod',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
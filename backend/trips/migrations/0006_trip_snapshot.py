@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_trip_route_lod'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripSnapshot',
+            fields=[
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='trips.trip')),
+                ('etag', models.CharField(max_length=64)),
+                ('gzip_body', models.BinaryField()),
+                ('brotli_body', models.BinaryField(blank=True, null=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
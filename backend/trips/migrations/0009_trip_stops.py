@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_trip_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='stops',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
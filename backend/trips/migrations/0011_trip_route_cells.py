@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0010_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripRouteCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.BigIntegerField()),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_cells', to='trips.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cell', 'trip'], name='triproutecell_cell_trip_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='triproutecell',
+            constraint=models.UniqueConstraint(fields=('trip', 'cell'), name='triproutecell_trip_cell_uniq'),
+        ),
+    ]
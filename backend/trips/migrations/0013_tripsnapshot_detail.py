@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Snapshots become one row per (trip, ?detail= level). They are a cache
+    # rebuilt on demand, so the table is recreated rather than migrated.
+
+    dependencies = [
+        ('trips', '0012_route_geometry_store'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='TripSnapshot',
+        ),
+        migrations.CreateModel(
+            name='TripSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('detail', models.CharField(default='full', max_length=16)),
+                ('etag', models.CharField(max_length=64)),
+                ('gzip_body', models.BinaryField()),
+                ('brotli_body', models.BinaryField(blank=True, null=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='trips.trip')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trip', 'detail'), name='tripsnapshot_trip_detail_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+def drop_full_snapshots(apps, schema_editor):
+    # Full-detail snapshots of stored lanes embed the whole line; they are
+    # rebuilt on their next request without it.
+    TripSnapshot = apps.get_model('trips', 'TripSnapshot')
+    TripSnapshot.objects.filter(detail='full', trip__geometry__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0013_tripsnapshot_detail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routegeometry',
+            name='rendered',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tripsnapshot',
+            name='shared_geometry',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(drop_full_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_to_route_geometry(apps, schema_editor):
+    # LOD levels and rendered lines belong to the lane, not the trip: keep
+    # the ones already built. Unshared snapshots of stored lanes embed their
+    # line; they are rebuilt on their next request without it.
+    RouteGeometry = apps.get_model('trips', 'RouteGeometry')
+    RenderedRoute = apps.get_model('trips', 'RenderedRoute')
+    Trip = apps.get_model('trips', 'Trip')
+    TripSnapshot = apps.get_model('trips', 'TripSnapshot')
+
+    built = Trip.objects.filter(geometry__lod__isnull=True, route_lod__isnull=False)
+    for digest, lod in built.values_list('geometry_id', 'route_lod').iterator():
+        RouteGeometry.objects.filter(pk=digest, lod__isnull=True).update(lod=lod)
+
+    rendered = RouteGeometry.objects.filter(rendered__isnull=False).values_list('digest', 'rendered')
+    RenderedRoute.objects.bulk_create(
+        [RenderedRoute(geometry_id=digest, detail='full', body=body) for digest, body in rendered.iterator()],
+        batch_size=500,
+    )
+    TripSnapshot.objects.filter(shared_geometry=False, trip__geometry__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0014_shared_snapshot_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routegeometry',
+            name='lod',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RenderedRoute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('detail', models.CharField(max_length=16)),
+                ('body', models.BinaryField()),
+                ('geometry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renderings', to='trips.routegeometry')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='renderedroute',
+            constraint=models.UniqueConstraint(fields=('geometry', 'detail'), name='renderedroute_geometry_detail_uniq'),
+        ),
+        migrations.RunPython(move_to_route_geometry, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='routegeometry',
+            name='rendered',
+        ),
+        migrations.RemoveField(
+            model_name='trip',
+            name='route_lod',
+        ),
+    ]
@@ -1,5 +1,12 @@
 
 from django.db import models
+from django.utils import timezone
+from .lazy import lazy_import
+
+routestore = lazy_import('trips.services.routestore')
+
+# Columns behind Trip.route_geometry, for .only()
+ROUTE_GEOMETRY_COLUMNS = ('geometry', 'legacy_geometry')
 
 class Trip(models.Model):
     start_location = models.CharField(max_length=255)
@@ -10,11 +17,244 @@ class Trip(models.Model):
     distance_miles = models.FloatField(null=True, blank=True)
     duration_hours = models.FloatField(null=True, blank=True)
     
-    route_geometry = models.JSONField(null=True, blank=True)  # GeoJSON or encoded polyline
+    # The route line lives in the shared RouteGeometry store; rows saved
+    # before it existed keep their JSON in legacy_geometry until
+    # `manage.py store_route_geometries` moves it. Use route_geometry.
+    geometry = models.ForeignKey('RouteGeometry', null=True, blank=True, on_delete=models.PROTECT, related_name='trips')
+    legacy_geometry = models.JSONField(null=True, blank=True)
     eld_logs = models.JSONField(null=True, blank=True)  # The generated logs
     markers = models.JSONField(null=True, blank=True)  # Fuel stops, rest stops, etc.
+    stops = models.JSONField(null=True, blank=True)  # Ordered pickups/dropoffs of a multi-stop plan
+
+    # Where the route came from ('ors', 'offline' road graph or straight-line
+    # 'mock') and every degraded step taken while planning (null on old rows)
+    route_source = models.CharField(max_length=10, null=True, blank=True)
+    fallbacks = models.JSONField(null=True, blank=True)
+
+    # Identical plans (same normalized request + engine version) reuse one row
+    fingerprint = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Keyset pagination for GET /api/trips/ walks (created_at, id) descending,
+        # optionally narrowed by one location first.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='trip_created_id_idx'),
+            models.Index(fields=['start_location', '-created_at', '-id'], name='trip_start_created_idx'),
+            models.Index(fields=['pickup_location', '-created_at', '-id'], name='trip_pickup_created_idx'),
+            models.Index(fields=['dropoff_location', '-created_at', '-id'], name='trip_dropoff_created_idx'),
+            models.Index(fields=['distance_miles'], name='trip_distance_idx'),
+        ]
     
     def __str__(self):
         return f"Trip {self.id}: {self.start_location} -> {self.dropoff_location}"
+
+    @property
+    def route_geometry(self):
+        """
+        The route as GeoJSON, decoded from the store (and shared with other
+        trips on the same lane through its cache: treat it as read-only).
+        """
+        if '_route_geometry' not in self.__dict__:
+            self.__dict__['_route_geometry'] = (
+                routestore.get(self.geometry_id) if self.geometry_id else self.legacy_geometry
+            )
+        return self.__dict__['_route_geometry']
+
+    @route_geometry.setter
+    def route_geometry(self, value):
+        self.__dict__['_route_geometry'] = value
+        self.__dict__['_geometry_pending'] = True
+
+    @property
+    def route_lod(self):
+        """
+        The simplified levels of the route (services/geometry.py), kept with
+        the line on its RouteGeometry row; None until built.
+        """
+        if '_route_lod' not in self.__dict__:
+            if not self.geometry_id:
+                self.__dict__['_route_lod'] = None
+            elif Trip.geometry.is_cached(self):  # select_related('geometry')
+                self.__dict__['_route_lod'] = self.geometry.lod
+            else:
+                self.__dict__['_route_lod'] = routestore.get_lod(self.geometry_id)
+        return self.__dict__['_route_lod']
+
+    @route_lod.setter
+    def route_lod(self, value):
+        # Stored with the line when the trip's geometry is (routestore.store_trips)
+        self.__dict__['_route_lod'] = value
+
+    @property
+    def geometry_pending(self):
+        # Set but not yet written to the store
+        return self.__dict__.get('_geometry_pending', False)
+
+    def geometry_stored(self, digest):
+        self.geometry_id = digest
+        self.legacy_geometry = None
+        self.__dict__.pop('_geometry_pending', None)
+
+    def save(self, *args, **kwargs):
+        if self.geometry_pending:
+            routestore.store_trips([self])
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], *ROUTE_GEOMETRY_COLUMNS}
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is None or {'geometry', 'geometry_id', 'legacy_geometry'} & set(fields):
+            self.__dict__.pop('_route_geometry', None)
+            self.__dict__.pop('_route_lod', None)
+            self.__dict__.pop('_geometry_pending', None)
+        super().refresh_from_db(using=using, fields=fields)
+
+class RouteGeometry(models.Model):
+    # Content-addressed route lines: sha256 of the encoding, which is a
+    # fixed-point delta / varint stream, zlib-compressed (services/routestore.py).
+    # Every trip on an identical lane references one row.
+    digest = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    points = models.PositiveIntegerField()
+    lod = models.JSONField(null=True, blank=True)  # Simplified levels of the line (services/geometry.py)
+    created_at = models.DateTimeField(auto_now_add=True)
+    used_at = models.DateTimeField(default=timezone.now)  # Last stored or reused by a plan (routestore.prune)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.points} points)"
+
+class RenderedRoute(models.Model):
+    # gzip of a lane's line at one ?detail= level as rendered in trip detail
+    # bodies, shared by the snapshots of every trip on the lane
+    # (services/snapshots.py)
+    geometry = models.ForeignKey(RouteGeometry, on_delete=models.CASCADE, related_name='renderings')
+    detail = models.CharField(max_length=16)
+    body = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['geometry', 'detail'], name='renderedroute_geometry_detail_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.geometry_id[:12]} rendered ({self.detail})"
+
+class GeocodeCacheEntry(models.Model):
+    # sha256 of kind + normalized query text (see services/geocache.py)
+    key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=20)  # 'search' or 'autocomplete'
+    query = models.CharField(max_length=255)
+    payload = models.JSONField()
+
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.kind}: {self.query}"
+
+class RouteCacheEntry(models.Model):
+    # sha256 of the rounded waypoint list (see services/routecache.py)
+    key = models.CharField(max_length=64, unique=True)
+    coordinates = models.JSONField()
+    status = models.CharField(max_length=10, default='pending')  # 'pending' lease or 'ready'
+    payload = models.JSONField(null=True, blank=True)  # distance, duration, segment miles, geometry
+
+    upstream_ms = models.FloatField(default=0.0)  # Latency of the call that filled the entry
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    lease_expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Route {self.key[:12]} ({self.status})"
+
+class PlanJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    payload = models.JSONField()  # Validated TripPlanSerializer data
+    trip = models.ForeignKey(Trip, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    error = models.TextField(blank=True, default='')
+
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='planjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"PlanJob {self.id} ({self.status})"
+
+class CircuitState(models.Model):
+    # One circuit breaker per ORS endpoint, shared by every worker (services/breaker.py)
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    endpoint = models.CharField(max_length=100, unique=True)
+    state = models.CharField(max_length=10, default=CLOSED)
+    failures = models.PositiveIntegerField(default=0)  # Consecutive failed calls
+    opened_at = models.DateTimeField(null=True, blank=True)
+    retry_at = models.DateTimeField(null=True, blank=True)  # When an open circuit lets one probe through
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.endpoint}: {self.state}"
+
+class TripSnapshot(models.Model):
+    # Pre-rendered, pre-compressed TripDetailView body per ?detail= level
+    # (trips are immutable)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='snapshots')
+    detail = models.CharField(max_length=16, default='full')
+    etag = models.CharField(max_length=64)  # sha256 of the uncompressed JSON
+    gzip_body = models.BinaryField()
+    brotli_body = models.BinaryField(null=True, blank=True)  # Only when the brotli package is installed
+    size = models.PositiveIntegerField(default=0)  # Uncompressed length in bytes
+    # The body leaves out the route line, which comes from the lane's
+    # RenderedRoute at this level when served
+    shared_geometry = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'detail'], name='tripsnapshot_trip_detail_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Snapshot of trip {self.trip_id} ({self.detail})"
+
+class TripRouteCell(models.Model):
+    # Grid cells a trip's route passes through (services/spatial.py); narrows
+    # "trips near a point / through a box" before any geometry is loaded
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='route_cells')
+    cell = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'cell'], name='triproutecell_trip_cell_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['cell', 'trip'], name='triproutecell_cell_trip_idx'),
+        ]
+
+    def __str__(self):
+        return f"Trip {self.trip_id} in cell {self.cell}"
@@ -0,0 +1,17 @@
+import json
+from rest_framework.renderers import BaseRenderer
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON. Streamed plans bypass renderers entirely; this
+    lets a view accept `Accept: application/x-ndjson` and still render its
+    ordinary (error) responses as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode('utf-8') + b'\n'
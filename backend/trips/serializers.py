@@ -1,15 +1,127 @@
 
 from rest_framework import serializers
-from .models import Trip
+from django.conf import settings
+from django.urls import reverse
+from .models import Trip, PlanJob
+from .services.eld_engine import LOAD_UNLOAD
+from .services.sequencing import is_feasible, stop_precedence
 
 class TripSerializer(serializers.ModelSerializer):
+    # Decoded from the shared RouteGeometry store (Trip.route_geometry)
+    route_geometry = serializers.JSONField(read_only=True)
+
+    class Meta:
+        model = Trip
+        exclude = ('fingerprint', 'idempotency_key', 'geometry', 'legacy_geometry')
+        read_only_fields = ('distance_miles', 'duration_hours', 'eld_logs', 'created_at')
+
+    def __init__(self, *args, fields=None, **kwargs):
+        # Optional sparse fieldset, e.g. TripSerializer(trip, fields=['id', 'markers'])
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class TripSummarySerializer(serializers.ModelSerializer):
+    # Listing projection: never touches the geometry / log JSON columns
     class Meta:
         model = Trip
-        fields = '__all__'
-        read_only_fields = ('distance_miles', 'duration_hours', 'route_geometry', 'eld_logs', 'created_at')
+        fields = ('id', 'start_location', 'pickup_location', 'dropoff_location', 'current_cycle_used',
+                  'distance_miles', 'duration_hours', 'route_source', 'created_at')
 
 class TripPlanSerializer(serializers.Serializer):
     start_location = serializers.CharField(max_length=255)
     pickup_location = serializers.CharField(max_length=255)
     dropoff_location = serializers.CharField(max_length=255)
     current_cycle_used = serializers.FloatField(required=False, default=0.0)
+    start_hour = serializers.FloatField(required=False, min_value=0.0, max_value=23.99)  # Departure on Day 1 (default 08:00)
+
+class PlanStopSerializer(serializers.Serializer):
+    location = serializers.CharField(max_length=255)
+    type = serializers.ChoiceField(choices=['pickup', 'dropoff'])
+    shipment = serializers.CharField(max_length=64, required=False)  # Pairs a dropoff with its pickup
+    dwell_minutes = serializers.IntegerField(required=False, default=LOAD_UNLOAD, min_value=0, max_value=24 * 60)
+
+class MultiStopPlanSerializer(serializers.Serializer):
+    start_location = serializers.CharField(max_length=255)
+    stops = PlanStopSerializer(many=True)
+    current_cycle_used = serializers.FloatField(required=False, default=0.0)
+    optimize = serializers.BooleanField(required=False, default=True)
+    start_hour = serializers.FloatField(required=False, min_value=0.0, max_value=23.99)
+
+    def validate_stops(self, stops):
+        if not 1 <= len(stops) <= settings.MULTI_STOP_MAX_STOPS:
+            raise serializers.ValidationError(f"Expected 1 to {settings.MULTI_STOP_MAX_STOPS} stops")
+        seen = set()
+        for stop in stops:
+            if 'shipment' not in stop:
+                continue
+            key = (stop['shipment'], stop['type'])
+            if key in seen:
+                raise serializers.ValidationError(f"Shipment {stop['shipment']} has more than one {stop['type']}")
+            seen.add(key)
+        for shipment, kind in seen:
+            if kind == 'dropoff' and (shipment, 'pickup') not in seen:
+                raise serializers.ValidationError(f"Shipment {shipment} has a dropoff but no pickup")
+        return stops
+
+    def validate(self, data):
+        if not data['optimize'] and not is_feasible(range(len(data['stops']) + 1), stop_precedence(data['stops'])):
+            raise serializers.ValidationError("Every dropoff must come after its shipment's pickup")
+        return data
+
+class SweepLegSerializer(serializers.Serializer):
+    miles = serializers.FloatField(min_value=0.0)
+    dwell_minutes = serializers.IntegerField(required=False, default=LOAD_UNLOAD, min_value=0, max_value=24 * 60)
+
+class DepartureSweepSerializer(serializers.Serializer):
+    # The route: either locations (routed like a plan) or explicit legs
+    start_location = serializers.CharField(max_length=255, required=False)
+    pickup_location = serializers.CharField(max_length=255, required=False)
+    dropoff_location = serializers.CharField(max_length=255, required=False)
+    legs = SweepLegSerializer(many=True, required=False)
+
+    # Scenario grid: every departure hour is combined with every cycle value
+    departure_hours = serializers.ListField(
+        child=serializers.FloatField(min_value=0.0, max_value=23.99), required=False, allow_empty=False
+    )
+    departure_step = serializers.FloatField(required=False, default=1.0, min_value=0.05, max_value=24.0)
+    cycle_used = serializers.ListField(
+        child=serializers.FloatField(min_value=0.0, max_value=70.0), required=False, default=[0.0], allow_empty=False
+    )
+
+    def validate(self, data):
+        locations = [data.get(f) for f in ('start_location', 'pickup_location', 'dropoff_location')]
+        if 'legs' in data:
+            if any(locations):
+                raise serializers.ValidationError("Pass either legs or locations, not both")
+            if not data['legs']:
+                raise serializers.ValidationError("legs must not be empty")
+        elif not all(locations):
+            raise serializers.ValidationError("Pass start/pickup/dropoff locations or legs")
+
+        if 'departure_hours' not in data:
+            step = data['departure_step']
+            data['departure_hours'] = [round(i * step, 4) for i in range(int(24 / step)) if i * step < 24]
+        count = len(data['departure_hours']) * len(data['cycle_used'])
+        if count > settings.SWEEP_MAX_SCENARIOS:
+            raise serializers.ValidationError(f"{count} scenarios requested (max {settings.SWEEP_MAX_SCENARIOS})")
+        return data
+
+class PlanJobSerializer(serializers.ModelSerializer):
+    status_url = serializers.SerializerMethodField()
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PlanJob
+        fields = ('id', 'status', 'status_url', 'error', 'attempts', 'created_at', 'started_at', 'finished_at', 'result')
+
+    def get_status_url(self, obj):
+        url = reverse('plan-job-detail', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_result(self, obj):
+        if obj.status != PlanJob.SUCCEEDED or obj.trip is None:
+            return None
+        return TripSerializer(obj.trip).data
@@ -0,0 +1,125 @@
+
+# Async counterpart of ors.py for the ASGI views: one pooled httpx client per
+# event loop, the same timeouts, retry policy and metrics as the sync Session.
+
+import asyncio
+import time
+import weakref
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import breaker, metrics
+from .ors import FAILURE_STATUSES, _headers
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+_clients = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+
+def _build_client():
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.ORS_POOL_SIZE,
+            max_keepalive_connections=settings.ORS_POOL_SIZE,
+        ),
+        # Connection errors are retried by the transport, bad statuses below
+        transport=httpx.AsyncHTTPTransport(retries=settings.ORS_MAX_RETRIES),
+    )
+
+def get_client():
+    """
+    Keep-alive client for the running event loop (clients can't be shared
+    across loops).
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = _build_client()
+    return client
+
+async def reset_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+        return float(retry_after)
+    return settings.ORS_RETRY_BACKOFF * (2 ** attempt)
+
+async def _attempt(method, path, **kwargs):
+    for attempt in range(settings.ORS_MAX_RETRIES + 1):
+        response = await get_client().request(method, f"{settings.ORS_BASE_URL}{path}", **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == settings.ORS_MAX_RETRIES:
+            return response
+        await asyncio.sleep(_retry_delay(response, attempt))
+
+async def _hedged(call, path):
+    # Same policy as ors._hedged: a second GET after ORS_HEDGE_DELAY, first good answer wins
+    delay = settings.ORS_HEDGE_DELAY
+    if delay <= 0:
+        return await call()
+
+    pending = {asyncio.ensure_future(call())}
+    done, _ = await asyncio.wait(pending, timeout=delay)
+    if not done:
+        metrics.inc('ors_hedged_requests_total', endpoint=path)
+        pending.add(asyncio.ensure_future(call()))
+
+    outcome = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    outcome = outcome or task.exception()
+                    continue
+                if task.result().status_code not in FAILURE_STATUSES:
+                    return task.result()
+                outcome = task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+async def _send(method, path, **kwargs):
+    if not await sync_to_async(breaker.allow)(path):
+        metrics.inc('ors_responses_total', endpoint=path, status='circuit_open')
+        raise breaker.CircuitOpen(f"ORS circuit open for {path}")
+
+    started = time.perf_counter()
+    outcome = 'error'
+    call = lambda: _attempt(method, path, **kwargs)
+    try:
+        response = await (_hedged(call, path) if method == 'GET' else call())
+        outcome = response.status_code
+    except httpx.HTTPError:
+        await sync_to_async(breaker.record_failure)(path)
+        raise
+    finally:
+        metrics.observe('ors_request_seconds', time.perf_counter() - started, endpoint=path)
+        metrics.inc('ors_responses_total', endpoint=path, status=outcome)
+
+    if response.status_code in FAILURE_STATUSES:
+        await sync_to_async(breaker.record_failure)(path)
+    else:
+        await sync_to_async(breaker.record_success)(path)
+    return response
+
+def _timeout(read):
+    return httpx.Timeout(read, connect=settings.ORS_CONNECT_TIMEOUT)
+
+async def get(path, params=None, timeout=None):
+    timeout = timeout if timeout is not None else settings.ORS_GEOCODE_TIMEOUT
+    return await _send('GET', path, params=params, headers=_headers(), timeout=_timeout(timeout))
+
+async def post(path, json=None, timeout=None):
+    timeout = timeout if timeout is not None else settings.ORS_DIRECTIONS_TIMEOUT
+    return await _send(
+        'POST', path,
+        json=json,
+        headers=_headers({'Content-Type': 'application/json'}),
+        timeout=_timeout(timeout),
+    )
@@ -0,0 +1,142 @@
+
+# Circuit breaker per ORS endpoint. State lives in the CircuitState table so
+# every gunicorn worker sees the same circuit; each process keeps a short-
+# lived copy so a closed circuit costs no query per call.
+#
+# closed    -> calls go through; ORS_BREAKER_FAILURES consecutive failures open it
+# open      -> calls fail fast with CircuitOpen until retry_at
+# half_open -> one worker wins the probe; success closes, failure re-opens
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from . import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpen(Exception):
+    """The ORS endpoint's circuit is open; the call was not attempted."""
+
+@dataclass
+class _Cached:
+    state: str
+    failures: int
+    retry_at: object
+    checked: float
+
+_local = {}
+_local_lock = threading.Lock()
+
+def _remember(endpoint, state, failures=0, retry_at=None):
+    with _local_lock:
+        _local[endpoint] = _Cached(state, failures, retry_at, time.monotonic())
+
+def _transition(endpoint, state):
+    metrics.inc('ors_circuit_transitions_total', endpoint=endpoint, state=state)
+    print(f"ORS circuit for {endpoint} is now {state}")
+
+def allow(endpoint):
+    """
+    True when a call to endpoint may go out. An open circuit past its
+    retry_at lets exactly one caller (across workers) through as the probe.
+    """
+    from ..models import CircuitState
+
+    now = timezone.now()
+    cached = _local.get(endpoint)
+    if cached is not None:
+        fresh = time.monotonic() - cached.checked < settings.ORS_BREAKER_SYNC_SECONDS
+        if cached.state == CLOSED and fresh:
+            return True
+        if cached.state == OPEN and cached.retry_at and now < cached.retry_at:
+            return False
+
+    try:
+        row = CircuitState.objects.filter(endpoint=endpoint).values('state', 'failures', 'retry_at').first()
+        if row is None or row['state'] == CLOSED:
+            _remember(endpoint, CLOSED, row['failures'] if row else 0)
+            return True
+        if row['retry_at'] and now < row['retry_at']:
+            _remember(endpoint, OPEN, row['failures'], row['retry_at'])
+            return False
+
+        # Open (or a half-open probe that never reported back): claim the probe
+        retry_at = now + timedelta(seconds=settings.ORS_BREAKER_RESET_SECONDS)
+        claimed = CircuitState.objects.filter(
+            endpoint=endpoint, state=row['state'], retry_at=row['retry_at']
+        ).update(state=HALF_OPEN, retry_at=retry_at, updated_at=now)
+    except DatabaseError as e:
+        print(f"Circuit state read failed: {e}")
+        return True
+
+    _remember(endpoint, OPEN, row['failures'], retry_at)
+    if claimed:
+        _transition(endpoint, HALF_OPEN)
+    return bool(claimed)
+
+def record_success(endpoint):
+    from ..models import CircuitState
+
+    cached = _local.get(endpoint)
+    if cached is not None and cached.state == CLOSED and cached.failures == 0:
+        return
+    try:
+        closed = CircuitState.objects.filter(endpoint=endpoint).exclude(state=CLOSED, failures=0).update(
+            state=CLOSED, failures=0, retry_at=None, updated_at=timezone.now()
+        )
+    except DatabaseError as e:
+        print(f"Circuit state write failed: {e}")
+        return
+    _remember(endpoint, CLOSED)
+    if closed and cached is not None and cached.state != CLOSED:
+        _transition(endpoint, CLOSED)
+
+def record_failure(endpoint):
+    from ..models import CircuitState
+
+    now = timezone.now()
+    try:
+        CircuitState.objects.get_or_create(endpoint=endpoint)
+        CircuitState.objects.filter(endpoint=endpoint).update(failures=F('failures') + 1, updated_at=now)
+        row = CircuitState.objects.filter(endpoint=endpoint).values('state', 'failures', 'retry_at').get()
+
+        tripped = row['state'] == HALF_OPEN or (row['state'] == CLOSED and row['failures'] >= settings.ORS_BREAKER_FAILURES)
+        if not tripped:
+            _remember(endpoint, row['state'], row['failures'], row['retry_at'])
+            return
+        retry_at = now + timedelta(seconds=settings.ORS_BREAKER_RESET_SECONDS)
+        opened = CircuitState.objects.filter(endpoint=endpoint, state=row['state']).update(
+            state=OPEN, opened_at=now, retry_at=retry_at, updated_at=now
+        )
+    except DatabaseError as e:
+        print(f"Circuit state write failed: {e}")
+        return
+
+    _remember(endpoint, OPEN, row['failures'], retry_at)
+    if opened:
+        _transition(endpoint, OPEN)
+
+def states():
+    from ..models import CircuitState
+
+    return list(CircuitState.objects.order_by('endpoint').values('endpoint', 'state', 'failures', 'opened_at', 'retry_at'))
+
+def reset(endpoint=None):
+    from ..models import CircuitState
+
+    qs = CircuitState.objects.all()
+    if endpoint:
+        qs = qs.filter(endpoint=endpoint)
+    qs.delete()
+    with _local_lock:
+        if endpoint:
+            _local.pop(endpoint, None)
+        else:
+            _local.clear()
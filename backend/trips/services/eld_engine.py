@@ -1,155 +1,287 @@
 
-import math
+# Event-driven HOS simulation. All clock values are integer minutes from
+# Day 1 00:00; each loop iteration jumps straight to the next duty event
+# (drive limit, 14h window, fuel interval, cycle limit or end of leg).
+
+ENGINE_VERSION = 3
+
+SPEED_MPH = 60.0
+MINUTES_PER_DAY = 24 * 60
+START_MINUTE = 8 * 60               # Default departure: Day 1 at 08:00
+
+MAX_DRIVING = 11 * 60               # 11h driving per shift
+DUTY_WINDOW = 14 * 60               # 14h on-duty window
+REST_BREAK = 10 * 60                # 10h off (sleeper berth) resets the shift
+CYCLE_LIMIT = 70 * 60               # 70h on duty in 8 days
+CYCLE_RESTART = 34 * 60             # 34h off resets the cycle
+
+FUEL_INTERVAL_MILES = 1000.0
+FUEL_STOP = 30                      # 30 min ON duty
+LOAD_UNLOAD = 60                    # 1h ON duty at pickup / dropoff
+
+def miles_to_minutes(miles):
+    return int(round(miles * 60.0 / SPEED_MPH))
+
+def start_minute(start_hour):
+    minute = int(round(float(start_hour) * 60))
+    if not 0 <= minute < MINUTES_PER_DAY:
+        raise ValueError(f"start_hour must be in [0, 24), got {start_hour}")
+    return minute
 
 class ELDSimulator:
-    def __init__(self, cycle_used=0.0):
-        self.logs = [] # List of {day, logs: []}
-        self.stops = [] # List of {type, distance_miles}
-        
-        self.current_time = 8.0 # Start 8 AM
-        self.day = 1
-        
-        self.driving_today = 0.0
-        self.duty_window_start = 8.0
-        
+    def __init__(self, cycle_used=0.0, start_hour=None, places=None):
+        self.days = [] # Index = day - 1; each a list of [status, start_min, end_min]
+        self.stops = [] # List of {type, distance_miles[, poi]}
+
+        # Optional POIs along the route (poi.Corridor): fuel and rest stops
+        # are pulled back to the last suitable one before the limit
+        self.places = places
+
+        start = START_MINUTE if start_hour is None else start_minute(start_hour)
+        self.now = start
+        self.window_start = start
+        self.arrival = None  # Minute the last stop is finished
+        self.driving_in_shift = 0
+        self.driving_since_fuel = 0
+        self.fuel_interval = miles_to_minutes(FUEL_INTERVAL_MILES)
+
+        # On-duty minutes counted against the 70h cycle. Hours already used
+        # before the trip count until a 34h restart.
+        self.cycle_used = min(max(int(round((cycle_used or 0.0) * 60)), 0), CYCLE_LIMIT)
+
         # We track cumulative distance on the TRIP route (not total lifetime)
         self.trip_dist = 0.0
-        
-        self.miles_since_fuel = 0.0
-        
-        # Initial OFF duty 0-8
-        self.get_day_logs(1).append({"status": "OFF", "start": 0.0, "end": 8.0})
-
-    def get_day_logs(self, day):
-        # Check existing
-        for d in self.logs:
-            if d['day'] == day:
-                return d['logs']
-        # Create new
-        entry = {"day": day, "date": f"Day {day}", "logs": []}
-        self.logs.append(entry)
-        return entry['logs']
-
-    def add_log(self, status, duration):
-        remaining = duration
-        while remaining > 0.001: # Float epsilon
-            day_idx = self.day
-            logs = self.get_day_logs(day_idx)
-            
-            # Local time of day (0-24)
-            # current_time is absolute hours from Day 1 00:00
-            # E.g. 26.5 = Day 2, 02:30
-            
-            current_absolute_day = int(self.current_time / 24) + 1
-            if current_absolute_day > self.day:
-                self.day = current_absolute_day
-                logs = self.get_day_logs(self.day)
-            
-            local_time = self.current_time % 24
-            space_in_day = 24.0 - local_time
-            
-            chunk = min(remaining, space_in_day)
-            
-            logs.append({
-                "status": status,
-                "start": float(f"{local_time:.2f}"),
-                "end": float(f"{local_time + chunk:.2f}")
-            })
-            
-            self.current_time += chunk
-            if status == 'DRIVING':
-                 self.driving_today += chunk
-                 
-            remaining -= chunk
 
-    def take_rest(self):
+        # How much of days / stops run_legs() has already handed out
+        self._days_sent = 0
+        self._stops_sent = 0
+
+        # Initial OFF duty from midnight until departure
+        self._record("OFF", 0, start)
+
+    def _day(self, index):
+        while len(self.days) <= index:
+            self.days.append([])
+        return self.days[index]
+
+    def _record(self, status, start, end):
+        # Split [start, end) at midnights; consecutive entries with the same
+        # status are merged.
+        while start < end:
+            index = start // MINUTES_PER_DAY
+            day_start = index * MINUTES_PER_DAY
+            chunk_end = min(end, day_start + MINUTES_PER_DAY)
+            entries = self._day(index)
+            local_start, local_end = start - day_start, chunk_end - day_start
+            if entries and entries[-1][0] == status and entries[-1][2] == local_start:
+                entries[-1][2] = local_end
+            else:
+                entries.append([status, local_start, local_end])
+            start = chunk_end
+
+    def add_log(self, status, minutes):
+        if minutes <= 0:
+            return
+        self._record(status, self.now, self.now + minutes)
+        self.now += minutes
+        if status in ("ON", "DRIVING"):
+            self.cycle_used += minutes
+
+    def _stop(self, stop_type, poi=None):
+        stop = {'type': stop_type, 'distance_miles': self.trip_dist}
+        if poi is not None:
+            stop['poi'] = poi
+        self.stops.append(stop)
+
+    def take_rest(self, poi=None):
         # 10h SB (Sleeper Berth is more realistic for over-the-road logs)
-        # Record Stop Location (Current distance)
-        self.stops.append({'type': 'REST', 'distance_miles': self.trip_dist})
-        
-        self.add_log("SB", 10.0)
-        self.driving_today = 0.0
-        # New window starts when we come ON duty (which happens after rest)
-        # Assuming we start immediately after rest
-        self.duty_window_start = self.current_time
-
-    def drive(self, miles_to_go):
-        while miles_to_go > 0.001:
-            dist_to_fuel = 1000.0 - self.miles_since_fuel
-            
-            # Time Limits
-            hours_drive_left = 11.0 - self.driving_today
-            
-            # 14h window limit
-            # Window expiry time = duty_window_start + 14
-            # Hours left = Expiry - current_time
-            hours_window_left = (self.duty_window_start + 14.0) - self.current_time
-            
-            if hours_drive_left <= 0.001 or hours_window_left <= 0.001:
+        self._stop('REST', poi)
+        self.add_log("SB", REST_BREAK)
+        self.driving_in_shift = 0
+        self.window_start = self.now
+
+    def take_restart(self, poi=None):
+        # 34h off duty resets the 70h/8-day cycle (and the shift)
+        self._stop('RESTART', poi)
+        self.add_log("OFF", CYCLE_RESTART)
+        self.cycle_used = 0
+        self.driving_in_shift = 0
+        self.window_start = self.now
+
+    def drive(self, miles):
+        for _ in self._drive(miles):
+            pass
+
+    def _drive(self, miles):
+        # Generator: pauses after every driving chunk so run_legs() can hand
+        # out stops and finished days while a long leg is still being driven.
+        leg_start = self.trip_dist
+        remaining = miles_to_minutes(miles)
+        driven = 0
+
+        while remaining > 0:
+            cycle_left = CYCLE_LIMIT - self.cycle_used
+            if cycle_left <= 0:
+                self.take_restart()
+                continue
+
+            drive_left = MAX_DRIVING - self.driving_in_shift
+            window_left = self.window_start + DUTY_WINDOW - self.now
+            if drive_left <= 0 or window_left <= 0:
                 self.take_rest()
-                # Recalculate limits (refreshed)
                 continue
 
-            max_drive_miles = min(hours_drive_left, hours_window_left) * 60.0
-            
-            # The chunk we can drive now
-            chunk_dist = min(miles_to_go, dist_to_fuel, max_drive_miles)
-            
-            # Execute chunk
-            chunk_time = chunk_dist / 60.0
-            self.add_log("DRIVING", chunk_time)
-            
-            self.trip_dist += chunk_dist
-            self.miles_since_fuel += chunk_dist
-            miles_to_go -= chunk_dist
-            
-            # Events
-            if self.miles_since_fuel >= 1000.0 - 0.001:
-                # Fuel Stop
-                self.stops.append({'type': 'FUEL', 'distance_miles': self.trip_dist})
-                self.add_log("ON", 0.5) # 30 min
-                self.miles_since_fuel = 0.0
-                
-                # Check 14h window again? 
-                # Yes, but loop continues and checks at start
-                
-            # If we drove to limit, loop continues and takes rest next iter
-            
-    def simulate(self, seg1, seg2):
-        # 1. Drive Segment 1
-        self.drive(seg1)
-        
-        # 2. Pickup
-        # Check window using simple check. If close to 14h, take rest first.
-        if (self.current_time - self.duty_window_start + 1.0) > 14.0:
-            self.take_rest()
-        # Pickup is 1h ON. The start of this 1h is Start of Duty if previously OFF?
-        # But we were driving, so clock is running.
-        self.add_log("ON", 1.0)
-        
-        # 3. Drive Segment 2
-        self.drive(seg2)
-        
-        # 4. Dropoff
-        if (self.current_time - self.duty_window_start + 1.0) > 14.0:
+            fuel_left = self.fuel_interval - self.driving_since_fuel
+            chunk = min(remaining, drive_left, window_left, fuel_left, cycle_left)
+            snapped = None
+            if self.places is not None and chunk < remaining:
+                chunk, snapped = self._snap(chunk, fuel_left, cycle_left)
+
+            self.add_log("DRIVING", chunk)
+            self.driving_in_shift += chunk
+            self.driving_since_fuel += chunk
+            remaining -= chunk
+            driven += chunk
+            self.trip_dist = leg_start + min(driven * SPEED_MPH / 60.0, miles)
+
+            if snapped is not None:
+                stop_type, poi = snapped
+                if stop_type == 'REST':
+                    self.take_rest(poi)
+                elif stop_type == 'RESTART':
+                    self.take_restart(poi)
+                else:
+                    self.refuel(poi)
+            if self.driving_since_fuel >= self.fuel_interval:
+                self.refuel()
+            yield
+
+        self.trip_dist = leg_start + miles
+
+    def _snap(self, chunk, fuel_left, cycle_left):
+        # A limit falls inside this chunk: end the chunk at the last POI that
+        # can host the stop, at most places.lookback_miles before the limit.
+        stop_type = 'FUEL' if chunk == fuel_left else 'RESTART' if chunk == cycle_left else 'REST'
+        limit = self.trip_dist + chunk * SPEED_MPH / 60.0
+        found = self.places.last_before(stop_type, max(self.trip_dist, limit - self.places.lookback_miles), limit)
+        if found is None:
+            return chunk, None
+        mile, poi = found
+        minutes = miles_to_minutes(mile - self.trip_dist)
+        if minutes <= 0:
+            return chunk, None
+        return min(minutes, chunk), (stop_type, poi)
+
+    def _make_room(self, minutes):
+        # On-duty work may not start if it would run past the 70h cycle
+        # (34h restart first, as when driving) or the 14h window.
+        if self.cycle_used + minutes > CYCLE_LIMIT:
+            self.take_restart()
+        elif self.now - self.window_start + minutes > DUTY_WINDOW:
             self.take_rest()
-        self.add_log("ON", 1.0)
-        
-        # End OFf
-        self.add_log("OFF", 24.0 - (self.current_time % 24))
-        
-        return self.logs, self.stops
-
-def generate_eld_logs(route_data, cycle_used):
-    sim = ELDSimulator(cycle_used)
-    
+
+    def refuel(self, poi=None):
+        self._make_room(FUEL_STOP)
+        self._stop('FUEL', poi)
+        self.add_log("ON", FUEL_STOP)
+        self.driving_since_fuel = 0
+
+    def on_duty_stop(self, minutes):
+        # Loading/unloading
+        self._make_room(minutes)
+        self.add_log("ON", minutes)
+
+    def simulate(self, seg1, seg2):
+        # Pickup, then dropoff
+        return self.simulate_legs([(seg1, LOAD_UNLOAD), (seg2, LOAD_UNLOAD)])
+
+    def simulate_legs(self, legs):
+        # legs: [(miles, dwell_minutes at the stop the leg ends at), ...]
+        for miles, dwell in legs:
+            self.drive(miles)
+            if dwell:
+                self.on_duty_stop(dwell)
+        self._finish()
+        return self.day_logs(), self.stops
+
+    def run_legs(self, legs):
+        """
+        simulate_legs as a generator of ('stop', stop) and ('day', day_log)
+        events. A stop is yielded as soon as it is scheduled and a day once
+        the clock has moved past its midnight, so callers can stream a long
+        trip while it is still being simulated.
+        """
+        for miles, dwell in legs:
+            for _ in self._drive(miles):
+                yield from self._completed()
+            if dwell:
+                self.on_duty_stop(dwell)
+                yield from self._completed()
+        self._finish()
+        yield from self._completed(final=True)
+
+    def _finish(self):
+        self.arrival = self.now
+
+        # Off duty for the rest of the final day
+        if self.now % MINUTES_PER_DAY:
+            self.add_log("OFF", MINUTES_PER_DAY - self.now % MINUTES_PER_DAY)
+
+    def _completed(self, final=False):
+        for stop in self.stops[self._stops_sent:]:
+            yield 'stop', stop
+        self._stops_sent = len(self.stops)
+
+        # Entries are only ever merged into the current day, so every day
+        # before it is final
+        finished = len(self.days) if final else min(len(self.days), self.now // MINUTES_PER_DAY)
+        while self._days_sent < finished:
+            yield 'day', self._day_log(self._days_sent)
+            self._days_sent += 1
+
+    def _day_log(self, index):
+        return {
+            "day": index + 1,
+            "date": f"Day {index + 1}",
+            "logs": [
+                {"status": status, "start": round(start / 60.0, 2), "end": round(end / 60.0, 2)}
+                for status, start, end in self.days[index]
+            ]
+        }
+
+    def day_logs(self):
+        return [self._day_log(index) for index in range(len(self.days))]
+
+def route_legs(route_data):
+    """
+    (miles, dwell) legs of a start -> pickup -> dropoff route.
+    """
     seg1 = route_data.get('segment1_miles', 0)
     seg2 = route_data.get('segment2_miles', 0)
-    
+
     if seg1 == 0 and seg2 == 0:
         total = route_data.get('distance_miles', 0)
         seg1 = total * 0.5
         seg2 = total * 0.5
-        
-    logs, stops = sim.simulate(seg1, seg2)
+    return [(seg1, LOAD_UNLOAD), (seg2, LOAD_UNLOAD)]
+
+def generate_eld_logs(route_data, cycle_used, start_hour=None, places=None):
+    sim = ELDSimulator(cycle_used, start_hour, places)
+    logs, stops = sim.simulate_legs(route_legs(route_data))
+    return {'logs': logs, 'stops': stops}
+
+def stream_eld_logs(route_data, cycle_used, start_hour=None, places=None):
+    """
+    generate_eld_logs as a stream of ('stop', stop) / ('day', day_log)
+    events, in the order they are simulated.
+    """
+    return ELDSimulator(cycle_used, start_hour, places).run_legs(route_legs(route_data))
+
+def generate_leg_logs(legs, cycle_used, start_hour=None, places=None):
+    """
+    Multi-stop variant: legs is a list of (miles, dwell_minutes) pairs, one
+    per stop in visiting order.
+    """
+    sim = ELDSimulator(cycle_used, start_hour, places)
+    logs, stops = sim.simulate_legs(legs)
     return {'logs': logs, 'stops': stops}
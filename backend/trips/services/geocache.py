@@ -0,0 +1,215 @@
+
+import copy
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from . import metrics
+
+SEARCH = 'search'
+AUTOCOMPLETE = 'autocomplete'
+
+class LRUCache:
+    """
+    Small thread-safe LRU used as the in-process tier in front of the
+    GeocodeCacheEntry table. Values are stored with their expiry time.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+_local = LRUCache(getattr(settings, 'GEOCODE_CACHE_LOCAL_SIZE', 1024))
+_stats_lock = threading.Lock()
+_stats = {'local_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+_RESULTS = {'local_hits': 'local_hit', 'db_hits': 'db_hit', 'misses': 'miss'}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+    if name in _RESULTS:
+        metrics.inc('cache_lookups_total', amount, cache='geocode', result=_RESULTS[name])
+
+def normalize_query(text):
+    return re.sub(r'\s+', ' ', (text or '').strip().lower())
+
+def make_key(kind, query):
+    return hashlib.sha256(f"{kind}:{normalize_query(query)}".encode('utf-8')).hexdigest()
+
+def lookup(kind, query):
+    """
+    Return the cached payload for a query, or None on a miss.
+    Checks the in-process LRU first, then the shared database table.
+    """
+    from ..models import GeocodeCacheEntry
+
+    key = make_key(kind, query)
+    now = timezone.now()
+
+    value = _local.get(key, now)
+    if value is not None:
+        _count('local_hits')
+        return copy.deepcopy(value)
+
+    try:
+        row = (GeocodeCacheEntry.objects
+               .filter(key=key, expires_at__gt=now)
+               .values_list('payload', 'expires_at')
+               .first())
+        if row is not None:
+            GeocodeCacheEntry.objects.filter(key=key).update(hits=F('hits') + 1, last_used_at=now)
+    except DatabaseError as e:
+        print(f"Geocode cache read failed: {e}")
+        row = None
+
+    if row is None:
+        _count('misses')
+        return None
+
+    payload, expires_at = row
+    _local.set(key, payload, expires_at)
+    _count('db_hits')
+    return copy.deepcopy(payload)
+
+def store(kind, query, payload, ttl=None):
+    from ..models import GeocodeCacheEntry
+
+    key = make_key(kind, query)
+    now = timezone.now()
+    ttl = ttl if ttl is not None else settings.GEOCODE_CACHE_TTL
+    expires_at = now + timedelta(seconds=ttl)
+
+    _local.set(key, copy.deepcopy(payload), expires_at)
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={
+                'kind': kind,
+                'query': normalize_query(query)[:255],
+                'payload': payload,
+                'last_used_at': now,
+                'expires_at': expires_at,
+            }
+        )
+        _count('stores')
+        _evict_overflow()
+    except DatabaseError as e:
+        print(f"Geocode cache write failed: {e}")
+
+def cached_lookup(kind, query, fetch):
+    """
+    Return the cached payload for query, calling fetch() on a miss.
+    fetch() returning None means "do not cache" (e.g. upstream failure).
+    """
+    value = lookup(kind, query)
+    if value is not None:
+        return value
+    value = fetch()
+    if value is not None:
+        store(kind, query, value)
+    return value
+
+async def acached_lookup(kind, query, fetch):
+    """
+    cached_lookup for async callers; fetch is a coroutine function. The
+    database tier is queried in a thread.
+    """
+    value = await sync_to_async(lookup)(kind, query)
+    if value is not None:
+        return value
+    value = await fetch()
+    if value is not None:
+        await sync_to_async(store)(kind, query, value)
+    return value
+
+def _evict_overflow():
+    from ..models import GeocodeCacheEntry
+
+    max_entries = settings.GEOCODE_CACHE_MAX_ENTRIES
+    total = GeocodeCacheEntry.objects.count()
+    if total <= max_entries:
+        return
+
+    # Drop expired rows first, then the least recently used ones.
+    removed, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    overflow = total - removed - max_entries
+    if overflow > 0:
+        stale = list(GeocodeCacheEntry.objects.order_by('last_used_at').values_list('pk', flat=True)[:overflow])
+        removed += GeocodeCacheEntry.objects.filter(pk__in=stale).delete()[0]
+    _count('evictions', removed)
+
+def purge(expired_only=True):
+    """
+    Delete cached entries from the shared table and clear this process's LRU.
+    Returns the number of rows removed.
+    """
+    from ..models import GeocodeCacheEntry
+
+    qs = GeocodeCacheEntry.objects.all()
+    if expired_only:
+        qs = qs.filter(expires_at__lte=timezone.now())
+    removed, _ = qs.delete()
+    _local.clear()
+    return removed
+
+def clear_local():
+    _local.clear()
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    lookups = snapshot['local_hits'] + snapshot['db_hits'] + snapshot['misses']
+    hits = snapshot['local_hits'] + snapshot['db_hits']
+    snapshot['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+    snapshot['local_size'] = len(_local)
+    return snapshot
+
+def table_stats():
+    """
+    Shared (cross-process) view of the cache table.
+    """
+    from django.db.models import Count, Sum, Q
+    from ..models import GeocodeCacheEntry
+
+    return GeocodeCacheEntry.objects.aggregate(
+        entries=Count('pk'),
+        expired=Count('pk', filter=Q(expires_at__lte=timezone.now())),
+        total_hits=Sum('hits'),
+    )
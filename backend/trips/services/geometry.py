@@ -0,0 +1,139 @@
+
+from math import cos, radians
+import numpy as np
+from .lod_levels import FULL, LOD_LEVELS, select_level
+
+def as_points(geometry):
+    coords = geometry['coordinates'] if isinstance(geometry, dict) else geometry
+    if coords is None or not len(coords):
+        return np.zeros((0, 2))
+    return np.asarray(coords, dtype=float)[:, :2]
+
+def densify(geometry, step):
+    """
+    The line's points with extra ones interpolated so that consecutive
+    points are at most `step` degrees apart in lon and in lat.
+    """
+    points = as_points(geometry)
+    if len(points) < 2:
+        return points
+    steps = np.maximum(np.ceil(np.abs(np.diff(points, axis=0)).max(axis=1) / step), 1).astype(np.int64)
+    segment = np.repeat(np.arange(len(steps)), steps)
+    fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    samples = points[segment] + fraction[:, None] * (points[segment + 1] - points[segment])
+    return np.vstack((samples, points[-1:]))
+
+# Fixed lat/lon grids (POI index, route cells): key = row * stride + col
+GRID_ROW_STRIDE = 1 << 16
+
+def grid_cells(lon, lat, cell):
+    """
+    (row, col) arrays of the cell-degree grid cells holding each point.
+    """
+    rows = np.floor((np.asarray(lat, dtype=float) + 90.0) / cell).astype(np.int64)
+    cols = np.floor((np.asarray(lon, dtype=float) + 180.0) / cell).astype(np.int64)
+    return rows, cols
+
+def _planar(points):
+    # Equirectangular projection around the mean latitude so that a degree
+    # tolerance means the same thing east-west and north-south.
+    xy = points.copy()
+    if len(xy):
+        xy[:, 0] *= cos(radians(float(xy[:, 1].mean())))
+    return xy
+
+def simplify(geometry, tolerance):
+    """
+    Douglas-Peucker simplification of a LineString. Returns a coordinate
+    list; endpoints are always kept.
+
+    All open ranges are split together, one vectorized pass per recursion
+    depth, so noisy lines don't pay NumPy call overhead per vertex.
+    """
+    points = as_points(geometry)
+    if len(points) < 3 or tolerance <= 0:
+        return points.tolist()
+
+    xy = _planar(points)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    first = np.array([0])
+    last = np.array([len(xy) - 1])
+
+    while len(first):
+        inner = last - first - 1
+        open_ranges = inner > 0
+        first, last, inner = first[open_ranges], last[open_ranges], inner[open_ranges]
+        if not len(first):
+            break
+
+        # Flattened indices of every inner vertex, tagged with its range
+        range_id = np.repeat(np.arange(len(first)), inner)
+        offsets = np.concatenate(([0], np.cumsum(inner)[:-1]))
+        index = first[range_id] + 1 + (np.arange(len(range_id)) - offsets[range_id])
+
+        start = xy[first][range_id]
+        direction = (xy[last] - xy[first])[range_id]
+        rel = xy[index] - start
+        length_sq = np.einsum('ij,ij->i', direction, direction)
+        t = np.divide(np.einsum('ij,ij->i', rel, direction), length_sq,
+                      out=np.zeros(len(rel)), where=length_sq > 0)
+        t = np.clip(t, 0.0, 1.0)
+        dist = np.hypot(*(rel - t[:, None] * direction).T)
+
+        # Farthest vertex per range (first one on ties)
+        max_dist = np.maximum.reduceat(dist, offsets)
+        candidates = np.flatnonzero(dist == max_dist[range_id])
+        _, first_hit = np.unique(range_id[candidates], return_index=True)
+        split = index[candidates[first_hit]]
+
+        divide = max_dist > tolerance
+        split = split[divide]
+        keep[split] = True
+        first = np.concatenate((first[divide], split))
+        last = np.concatenate((split, last[divide]))
+
+    return points[keep].tolist()
+
+def build_lod(geometry):
+    """
+    Precompute every simplification level for a route. Each level is built
+    from the previous (finer) one, which is cheaper and keeps them nested.
+    """
+    levels = {}
+    coords = as_points(geometry).tolist()
+    for name, tolerance in LOD_LEVELS:
+        coords = simplify(coords, tolerance)
+        levels[name] = {'tolerance': tolerance, 'coordinates': coords}
+    return levels
+
+def snap_to_line(points, geometry):
+    """
+    Project [lon, lat] points onto the closest segment of a LineString so
+    markers sit on a simplified line. Returns the snapped points.
+    """
+    line = as_points(geometry)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(line) < 2 or not len(points):
+        return points.tolist()
+
+    scale = cos(radians(float(line[:, 1].mean())))
+    line_xy = line * [scale, 1.0]
+    points_xy = points * [scale, 1.0]
+
+    start = line_xy[:-1]
+    direction = line_xy[1:] - start
+    length_sq = np.einsum('ij,ij->i', direction, direction)
+
+    # (points x segments) projection parameters
+    rel = points_xy[:, None, :] - start[None, :, :]
+    t = np.divide(np.einsum('psj,sj->ps', rel, direction), length_sq,
+                  out=np.zeros(rel.shape[:2]), where=length_sq > 0)
+    t = np.clip(t, 0.0, 1.0)
+    projected = start[None, :, :] + t[..., None] * direction[None, :, :]
+    dist_sq = ((points_xy[:, None, :] - projected) ** 2).sum(axis=2)
+    best = np.argmin(dist_sq, axis=1)
+
+    snapped = projected[np.arange(len(points)), best]
+    snapped[:, 0] /= scale
+    return snapped.tolist()
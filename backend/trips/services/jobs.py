@@ -0,0 +1,73 @@
+
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from ..models import PlanJob
+from .planner import plan_trip
+
+def enqueue(data):
+    return PlanJob.objects.create(payload=dict(data))
+
+def claim_next(worker_id):
+    """
+    Atomically move the oldest queued job to RUNNING and return it.
+    The conditional UPDATE is the lock, so this works the same on SQLite
+    and PostgreSQL without SELECT ... FOR UPDATE.
+    """
+    while True:
+        job_id = (PlanJob.objects
+                  .filter(status=PlanJob.QUEUED)
+                  .order_by('created_at', 'id')
+                  .values_list('id', flat=True)
+                  .first())
+        if job_id is None:
+            return None
+        claimed = PlanJob.objects.filter(id=job_id, status=PlanJob.QUEUED).update(
+            status=PlanJob.RUNNING,
+            worker=worker_id[:100],
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return PlanJob.objects.get(id=job_id)
+        # Another worker got it first; try the next one.
+
+def run_job(job):
+    try:
+        trip = plan_trip(job.payload)
+    except Exception as e:
+        traceback.print_exc()
+        job.status = PlanJob.FAILED
+        job.error = str(e)
+    else:
+        job.status = PlanJob.SUCCEEDED
+        job.trip = trip
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'trip', 'error', 'finished_at'])
+    return job
+
+def process_next(worker_id):
+    """
+    Claim and run one job. Returns the finished job, or None if the queue is empty.
+    """
+    job = claim_next(worker_id)
+    if job is None:
+        return None
+    return run_job(job)
+
+def requeue_stale(max_age_seconds=None):
+    """
+    Return RUNNING jobs whose worker died back to the queue, or fail them
+    once they have used up PLAN_JOB_MAX_ATTEMPTS.
+    """
+    max_age_seconds = max_age_seconds or settings.PLAN_JOB_STALE_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+    stale = PlanJob.objects.filter(status=PlanJob.RUNNING, started_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=settings.PLAN_JOB_MAX_ATTEMPTS).update(
+        status=PlanJob.FAILED, error='Worker did not finish the job', finished_at=timezone.now()
+    )
+    requeued = stale.update(status=PlanJob.QUEUED, worker='')
+    return requeued, failed
@@ -0,0 +1,30 @@
+
+# Route detail level names, kept apart from geometry.py so that views can
+# parse ?detail= without importing numpy.
+
+# Simplification levels, finest first. Tolerances are in degrees
+# (1e-4 deg is roughly 11 m); 'full' is the stored ORS LineString.
+FULL = 'full'
+LOD_LEVELS = [
+    ('high', 0.0001),
+    ('medium', 0.001),
+    ('low', 0.01),
+    ('overview', 0.05),
+]
+
+def select_level(detail=None, tolerance=None):
+    """
+    Map ?detail= / ?tolerance= to a level name. A tolerance picks the
+    coarsest level that is still within it. Returns None for unknown input.
+    """
+    if tolerance is not None:
+        chosen = FULL
+        for name, level_tolerance in LOD_LEVELS:
+            if level_tolerance <= tolerance:
+                chosen = name
+        return chosen
+    if detail in (None, '', FULL):
+        return FULL
+    if detail in dict(LOD_LEVELS):
+        return detail
+    return None
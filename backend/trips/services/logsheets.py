@@ -0,0 +1,281 @@
+
+# Server-side driver's daily log sheets: the same 24-hour grid as the
+# frontend's LogGrid, built from a Trip.eld_logs day ({day, logs: [{status,
+# start, end}]}) as SVG or a one-page PDF. Both formats draw the same list of
+# primitives, so they always agree. Rendered pages are cached per trip-day;
+# export_zip streams many trips' sheets as a ZIP.
+
+import hashlib
+import json
+import time
+import zipfile
+from django.conf import settings
+from . import metrics
+from .geocache import LRUCache
+
+RENDER_VERSION = 1                  # bump when the layout changes
+FORMATS = {'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+
+# Page layout in points (US Letter, landscape); y grows downwards
+PAGE_WIDTH, PAGE_HEIGHT = 792, 612
+GRID_LEFT, GRID_TOP = 150, 170
+HOUR_WIDTH = 24                     # 24 h * 24 pt = 576 pt grid
+ROW_HEIGHT = 40
+GRID_WIDTH = 24 * HOUR_WIDTH
+TOTALS_LEFT = GRID_LEFT + GRID_WIDTH + 10
+
+ROWS = (
+    ('OFF', '1. OFF DUTY'),
+    ('SB', '2. SLEEPER BERTH'),
+    ('DRIVING', '3. DRIVING'),
+    ('ON', '4. ON DUTY (NOT DRIVING)'),
+)
+STATUS_ALIASES = {'SLEEPER': 'SB', 'ON-DUTY': 'ON'}
+ROW_INDEX = {status: i for i, (status, _) in enumerate(ROWS)}
+
+_cache = LRUCache(settings.LOG_SHEET_CACHE_SIZE)
+
+def _status(value):
+    # Same normalisation as the frontend: anything unknown is off duty
+    status = STATUS_ALIASES.get(value, value)
+    return status if status in ROW_INDEX else 'OFF'
+
+def _row_y(status):
+    return GRID_TOP + ROW_INDEX[status] * ROW_HEIGHT + ROW_HEIGHT / 2
+
+def _fmt(value):
+    return f"{value:.2f}".rstrip('0').rstrip('.')
+
+def _grid():
+    """
+    The fixed part of every sheet: row borders, hour lines, quarter-hour
+    ticks and labels, as (lines, texts).
+    """
+    lines, texts = [], []
+    bottom = GRID_TOP + len(ROWS) * ROW_HEIGHT
+    for i in range(len(ROWS) + 1):
+        y = GRID_TOP + i * ROW_HEIGHT
+        lines.append((GRID_LEFT, y, GRID_LEFT + GRID_WIDTH, y, 2 if i in (0, len(ROWS)) else 1))
+    for hour in range(25):
+        x = GRID_LEFT + hour * HOUR_WIDTH
+        lines.append((x, GRID_TOP - 5, x, bottom + 5, 2 if hour % 12 == 0 else 0.75))
+        if hour < 24:
+            label = 'MID' if hour == 0 else 'NOON' if hour == 12 else str(hour % 12)
+            texts.append((x + 2, GRID_TOP - 8, 8, True, label))
+        for quarter in (1, 2, 3):
+            if hour == 24:
+                break
+            x_tick = x + quarter * HOUR_WIDTH / 4
+            tick = 10 if quarter == 2 else 5
+            for row in range(len(ROWS)):
+                y = GRID_TOP + row * ROW_HEIGHT
+                lines.append((x_tick, y, x_tick, y + tick, 0.5))
+    for i, (_, label) in enumerate(ROWS):
+        texts.append((36, GRID_TOP + i * ROW_HEIGHT + ROW_HEIGHT / 2 + 3, 8, True, label))
+    texts.append((TOTALS_LEFT, GRID_TOP - 8, 8, True, 'HOURS'))
+    return lines, texts
+
+GRID_LINES, GRID_TEXTS = _grid()
+
+def sheet_parts(day_log, header=()):
+    """
+    What one day adds to the fixed grid: (texts, duty path). Texts are
+    (x, y, size, bold, text), the path a list of [x, y] points.
+    """
+    logs = sorted(day_log.get('logs') or [], key=lambda entry: entry['start'])
+    totals = dict.fromkeys(ROW_INDEX, 0.0)
+    path = []
+    for entry in logs:
+        status = _status(entry.get('status'))
+        start, end = float(entry['start']), float(entry['end'])
+        totals[status] += end - start
+        y = _row_y(status)
+        path.append([GRID_LEFT + start * HOUR_WIDTH, y])
+        path.append([GRID_LEFT + end * HOUR_WIDTH, y])
+
+    texts = []
+    texts.append((36, 60, 18, True, "DRIVER'S DAILY LOG"))
+    texts.append((36, 76, 8, False, '(Property-carrying vehicle, 70 hours / 8 days)'))
+    texts.append((PAGE_WIDTH - 120, 60, 14, True, f"Day {day_log.get('day', '')}"))
+    for i, line in enumerate(header):
+        texts.append((36, 104 + i * 14, 9, False, line))
+    for status, _ in ROWS:
+        texts.append((TOTALS_LEFT, _row_y(status) + 3, 9, False, f"{totals[status]:.2f}"))
+    bottom = GRID_TOP + len(ROWS) * ROW_HEIGHT
+    texts.append((TOTALS_LEFT, bottom + 16, 9, True, f"{sum(totals.values()):.2f}"))
+    on_duty = totals['DRIVING'] + totals['ON']
+    texts.append((36, bottom + 40, 9, False, f"Total driving: {totals['DRIVING']:.2f} h    Total on duty: {on_duty:.2f} h"))
+    return texts, path
+
+def _xml(text):
+    return str(text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+def _svg_lines(lines):
+    # One path element per stroke width keeps the file small
+    widths = {}
+    for x1, y1, x2, y2, width in lines:
+        widths.setdefault(width, []).append(f"M{_fmt(x1)} {_fmt(y1)}L{_fmt(x2)} {_fmt(y2)}")
+    return [f'<path d="{"".join(segments)}" stroke="black" stroke-width="{_fmt(width)}" fill="none"/>'
+            for width, segments in widths.items()]
+
+def _svg_texts(texts):
+    parts = []
+    for x, y, size, bold, text in texts:
+        weight = ' font-weight="bold"' if bold else ''
+        parts.append(f'<text x="{_fmt(x)}" y="{_fmt(y)}" font-size="{size}"{weight}>{_xml(text)}</text>')
+    return parts
+
+def _pdf_lines(lines):
+    widths = {}
+    for x1, y1, x2, y2, width in lines:
+        widths.setdefault(width, []).append(f"{_fmt(x1)} {_fmt(y1)} m {_fmt(x2)} {_fmt(y2)} l")
+    return [f"{_fmt(width)} w {' '.join(segments)} S".encode('ascii') for width, segments in widths.items()]
+
+def _pdf_texts(texts):
+    ops = []
+    for x, y, size, bold, text in texts:
+        font = '/F2' if bold else '/F1'
+        ops.append(f"{font} {size} Tf 1 0 0 -1 {_fmt(x)} {_fmt(y)} Tm (".encode('ascii') + _pdf_text(text) + b') Tj')
+    return ops
+
+def _pdf_text(text):
+    # Base-14 fonts only cover Latin-1
+    raw = str(text).encode('latin-1', 'replace')
+    return raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+# The grid is the same on every page: serialised once
+SVG_GRID = '\n'.join(_svg_lines(GRID_LINES) + _svg_texts(GRID_TEXTS))
+PDF_GRID_LINES = b'\n'.join(_pdf_lines(GRID_LINES))
+PDF_GRID_TEXTS = b'\n'.join(_pdf_texts(GRID_TEXTS))
+
+def to_svg(texts, path):
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{PAGE_WIDTH}" height="{PAGE_HEIGHT}" '
+        f'viewBox="0 0 {PAGE_WIDTH} {PAGE_HEIGHT}" font-family="Helvetica, Arial, sans-serif">',
+        f'<rect width="{PAGE_WIDTH}" height="{PAGE_HEIGHT}" fill="white"/>',
+        SVG_GRID,
+        *_svg_texts(texts),
+    ]
+    if path:
+        d = 'M' + 'L'.join(f"{_fmt(x)} {_fmt(y)}" for x, y in path)
+        parts.append(f'<path d="{d}" stroke="black" stroke-width="2.5" fill="none" '
+                     'stroke-linejoin="round" stroke-linecap="square"/>')
+    parts.append('</svg>\n')
+    return '\n'.join(parts).encode('utf-8')
+
+def to_pdf(texts, path):
+    """
+    A single-page PDF drawn with the standard Helvetica fonts (no embedded
+    fonts, no dependencies). The page is flipped so y grows downwards like
+    the SVG; text is flipped back.
+    """
+    ops = [f"1 0 0 -1 0 {PAGE_HEIGHT} cm".encode('ascii'), PDF_GRID_LINES]
+    if path:
+        points = ' '.join(f"{_fmt(x)} {_fmt(y)} {'m' if i == 0 else 'l'}" for i, (x, y) in enumerate(path))
+        ops.append(f"2.5 w 1 j 2 J {points} S".encode('ascii'))
+    ops += [b'BT', PDF_GRID_TEXTS, *_pdf_texts(texts), b'ET']
+    content = b'\n'.join(ops)
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+        '/Resources << /Font << /F1 5 0 R /F2 6 0 R >> >> /Contents 4 0 R >>'.encode('ascii'),
+        f'<< /Length {len(content)} >>\nstream\n'.encode('ascii') + content + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n'.encode('ascii') + body + b'\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('ascii')
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode('ascii')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('ascii')
+    return bytes(out)
+
+WRITERS = {'svg': to_svg, 'pdf': to_pdf}
+
+def trip_header(trip):
+    route = ' -> '.join(filter(None, (trip.start_location, trip.pickup_location, trip.dropoff_location)))
+    lines = [f"Trip #{trip.id}: {route}"]
+    if trip.distance_miles is not None:
+        lines.append(f"Total distance: {trip.distance_miles:.1f} mi    Planned: {trip.created_at:%Y-%m-%d}")
+    return lines
+
+def render_day(day_log, fmt='svg', header=()):
+    """
+    One day's log sheet as SVG or PDF bytes. Pages are cached in-process by
+    content, so re-exporting a trip (or any identical day) skips drawing.
+    """
+    key = hashlib.sha256(
+        json.dumps([RENDER_VERSION, fmt, list(header), day_log], sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    now = time.monotonic()
+    page = _cache.get(key, now)
+    if page is not None:
+        metrics.inc('cache_lookups_total', cache='log_sheet', result='hit')
+        return page
+    metrics.inc('cache_lookups_total', cache='log_sheet', result='miss')
+    page = WRITERS[fmt](*sheet_parts(day_log, header))
+    _cache.set(key, page, float('inf'))
+    return page
+
+def trip_sheets(trip, fmt='svg'):
+    """
+    (file name, bytes) for every day of a trip's logs.
+    """
+    header = trip_header(trip)
+    for day_log in trip.eld_logs or []:
+        yield f"day-{int(day_log.get('day', 0)):02d}.{fmt}", render_day(day_log, fmt, header)
+
+class _ZipStream:
+    """
+    Write-only, non-seekable file for zipfile: bytes written since the last
+    drain() are handed to the response and then dropped.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._written = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def export_zip(trips, fmt='svg'):
+    """
+    Stream a ZIP of every trip's log sheets (trip-<id>/day-NN.<fmt>) from an
+    iterable of trips, yielding compressed bytes as each trip is written.
+    Only one trip's pages are held at a time; zipfile itself keeps a small
+    directory entry per file for the central directory.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for trip in trips:
+            stamp = trip.created_at.timetuple()[:6] if trip.created_at else (1980, 1, 1, 0, 0, 0)
+            for name, page in trip_sheets(trip, fmt):
+                info = zipfile.ZipInfo(f"trip-{trip.id}/{name}", date_time=max(stamp, (1980, 1, 1, 0, 0, 0)))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, page)
+            data = stream.drain()
+            if data:
+                yield data
+    yield stream.drain()
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,281 @@
+
+# Lightweight in-process metrics with a Prometheus text exposition.
+# Each gunicorn worker keeps its own registry; when METRICS_MULTIPROC_DIR is
+# set, workers periodically dump their registry to <dir>/metrics-<pid>.json
+# and /metrics merges every file, so any worker can answer a scrape. When a
+# worker exits (or, if it died without doing so, at the next merge) its file
+# is folded into <dir>/metrics-archive.json, so counters and histograms never
+# go down across worker restarts. The registry holds no gauges: those would
+# be dropped with their worker instead.
+
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS = {
+    'trip_stage_seconds': ('histogram', 'Time spent in each trip planning stage'),
+    'ors_request_seconds': ('histogram', 'OpenRouteService request latency by endpoint'),
+    'ors_responses_total': ('counter', 'OpenRouteService responses by endpoint and status'),
+    'cache_lookups_total': ('counter', 'Cache lookups by cache and result'),
+    'ors_circuit_transitions_total': ('counter', 'ORS circuit breaker state changes by endpoint'),
+    'ors_hedged_requests_total': ('counter', 'Hedged (duplicate) ORS GETs sent after ORS_HEDGE_DELAY'),
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_last_flush = 0.0
+_cleanup_pid = None  # Process whose exit handler archives its dump
+
+_request_timings = ContextVar('request_timings', default=None)
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_flush()
+
+def observe(name, seconds, **labels):
+    with _lock:
+        key = _key(name, labels)
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+    _maybe_flush()
+
+@contextmanager
+def timed(stage):
+    """
+    Time a block as a trip planning stage: feeds the trip_stage_seconds
+    histogram and, inside a request, the Server-Timing header.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('trip_stage_seconds', elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+def start_request():
+    return _request_timings.set([])
+
+def end_request(token):
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return timings
+
+def server_timing_header(timings, total=None):
+    # Repeated stages (e.g. three geocode calls) are summed into one entry.
+    merged = {}
+    for stage, elapsed in timings:
+        merged[stage] = merged.get(stage, 0.0) + elapsed
+    if total is not None:
+        merged['total'] = total
+    return ', '.join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in merged.items())
+
+def snapshot():
+    with _lock:
+        return _as_snapshot(_counters, {key: list(hist) for key, hist in _histograms.items()})
+
+def _flush_path(pid=None):
+    return os.path.join(settings.METRICS_MULTIPROC_DIR, f"metrics-{pid or os.getpid()}.json")
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+    except OSError:
+        return False
+    return True
+
+def _read(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+def _write(path, snap):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as fh:
+        json.dump(snap, fh)
+    os.replace(tmp, path)
+
+def _archive_path(directory):
+    return os.path.join(directory, 'metrics-archive.json')
+
+def _archive(path):
+    """
+    Add a finished worker's dump to the archive and remove it. The lock
+    makes sure concurrent merges fold each dump exactly once.
+    """
+    archive = _archive_path(os.path.dirname(path))
+    with open(f"{archive}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            dump = _read(path)
+        except OSError:
+            return  # Already archived by another process
+        except ValueError:
+            _remove(path)
+            return
+        try:
+            merged = _read(archive)
+        except (OSError, ValueError):
+            merged = {'counters': [], 'histograms': []}
+        _write(archive, _as_snapshot(*_merge([merged, dump])))
+        _remove(path)
+
+def _archive_own_dump(pid, path):
+    # atexit handlers survive fork(): only the process that wrote it archives it
+    if os.getpid() == pid and os.path.exists(path):
+        flush()
+        _archive(path)
+
+def flush():
+    global _cleanup_pid
+    if not settings.METRICS_MULTIPROC_DIR:
+        return
+    path = _flush_path()
+    try:
+        _write(path, snapshot())
+    except OSError as e:
+        print(f"Metrics flush failed: {e}")
+        return
+    if _cleanup_pid != os.getpid():
+        _cleanup_pid = os.getpid()
+        atexit.register(_archive_own_dump, _cleanup_pid, path)
+
+def _maybe_flush():
+    global _last_flush
+    if not settings.METRICS_MULTIPROC_DIR:
+        return
+    now = time.monotonic()
+    if now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    flush()
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, hist in snap['histograms']:
+            key = _key(name, labels)
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], hist)]
+            else:
+                histograms[key] = list(hist)
+    return counters, histograms
+
+def _as_snapshot(counters, histograms):
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), hist] for (name, labels), hist in histograms.items()],
+    }
+
+def collect():
+    """
+    Merge this process's registry with every other worker's dump and the
+    archive of finished workers.
+    """
+    snapshots = [snapshot()]
+    if settings.METRICS_MULTIPROC_DIR:
+        flush()
+        own = _flush_path()
+        for path in glob.glob(os.path.join(settings.METRICS_MULTIPROC_DIR, 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if path == own or not pid.isdigit():
+                continue
+            if not _alive(int(pid)):
+                # A worker that died without archiving its dump
+                _archive(path)
+                continue
+            try:
+                snapshots.append(_read(path))
+            except (OSError, ValueError):
+                continue
+        try:
+            snapshots.append(_read(_archive_path(settings.METRICS_MULTIPROC_DIR)))
+        except (OSError, ValueError):
+            pass
+    return _merge(snapshots)
+
+def _escape(value):
+    # Label values in the text format: backslash, double quote and newline
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def render_prometheus():
+    counters, histograms = collect()
+    lines = []
+
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        else:
+            for (metric, labels), hist in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(BUCKETS, hist):
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {hist[-1]}")
+                lines.append(f"{name}_sum{_labels(labels)} {hist[-2]}")
+                lines.append(f"{name}_count{_labels(labels)} {hist[-1]}")
+
+    # Hit ratio per cache, derived from cache_lookups_total
+    lookups = {}
+    for (metric, labels), value in counters.items():
+        if metric == 'cache_lookups_total':
+            labels = dict(labels)
+            total, hits = lookups.get(labels['cache'], (0, 0))
+            hit = labels['result'] != 'miss'
+            lookups[labels['cache']] = (total + value, hits + (value if hit else 0))
+    lines.append("# HELP cache_hit_ratio Share of cache lookups served without an upstream call")
+    lines.append("# TYPE cache_hit_ratio gauge")
+    for cache, (total, hits) in sorted(lookups.items()):
+        lines.append(f"cache_hit_ratio{_labels([('cache', cache)])} {hits / total if total else 0.0}")
+
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -0,0 +1,170 @@
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from . import breaker, metrics
+
+GEOCODE_SEARCH = '/geocode/search'
+GEOCODE_AUTOCOMPLETE = '/geocode/autocomplete'
+DIRECTIONS = '/v2/directions/driving-car/geojson'
+MATRIX = '/v2/matrix/driving-car'
+
+_session = None
+_session_lock = threading.Lock()
+_hedge_pool = None
+
+# Statuses that count against the circuit (ORS overloaded or broken, not a bad request)
+FAILURE_STATUSES = (429, 500, 502, 503, 504)
+
+def _build_session():
+    retry = Retry(
+        total=settings.ORS_MAX_RETRIES,
+        backoff_factor=settings.ORS_RETRY_BACKOFF,
+        status_forcelist=(429, 502, 503, 504),
+        # Never retry a read timeout: a slow directions call would hold the
+        # worker for several timeouts before the breaker or a fallback sees
+        # it. Connect errors and the statuses above are retried.
+        read=0,
+        # Directions POSTs are read-only lookups, so they are safe to retry.
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.ORS_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session():
+    """
+    Per-process keep-alive Session shared by every ORS call site.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def reset_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+def _headers(extra=None):
+    headers = {'Authorization': settings.MAP_API_KEY}
+    if extra:
+        headers.update(extra)
+    return headers
+
+def _get_hedge_pool():
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _session_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=settings.ORS_POOL_SIZE, thread_name_prefix='ors-hedge')
+    return _hedge_pool
+
+def _hedged(call, path):
+    """
+    Run call(); if it hasn't answered after ORS_HEDGE_DELAY seconds, start a
+    second identical request and return whichever answers well first.
+    Only used for idempotent GETs.
+    """
+    delay = settings.ORS_HEDGE_DELAY
+    if delay <= 0:
+        return call()
+
+    pool = _get_hedge_pool()
+    pending = {pool.submit(call)}
+    try:
+        return next(iter(pending)).result(timeout=delay)
+    except FutureTimeout:
+        pass
+    metrics.inc('ors_hedged_requests_total', endpoint=path)
+    pending.add(pool.submit(call))
+
+    outcome = None
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    outcome = outcome or e
+                    continue
+                _close(outcome)
+                outcome = response
+                if response.status_code not in FAILURE_STATUSES:
+                    return response
+    finally:
+        # The losing request: drop it if it hasn't started, else close its
+        # response when it arrives so its pooled connection is released
+        for future in pending:
+            future.cancel()
+            future.add_done_callback(_close_result)
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+def _close(response):
+    if hasattr(response, 'close'):  # a response, not None or an exception
+        response.close()
+
+def _close_result(future):
+    if not future.cancelled() and future.exception() is None:
+        _close(future.result())
+
+def _send(method, path, **kwargs):
+    if not breaker.allow(path):
+        metrics.inc('ors_responses_total', endpoint=path, status='circuit_open')
+        raise breaker.CircuitOpen(f"ORS circuit open for {path}")
+
+    started = time.perf_counter()
+    outcome = 'error'
+    call = lambda: getattr(get_session(), method)(f"{settings.ORS_BASE_URL}{path}", **kwargs)
+    try:
+        response = _hedged(call, path) if method == 'get' else call()
+        outcome = response.status_code
+    except requests.RequestException:
+        breaker.record_failure(path)
+        raise
+    finally:
+        metrics.observe('ors_request_seconds', time.perf_counter() - started, endpoint=path)
+        metrics.inc('ors_responses_total', endpoint=path, status=outcome)
+
+    if response.status_code in FAILURE_STATUSES:
+        breaker.record_failure(path)
+    else:
+        breaker.record_success(path)
+    return response
+
+def get(path, params=None, timeout=None):
+    timeout = timeout if timeout is not None else settings.ORS_GEOCODE_TIMEOUT
+    return _send(
+        'get', path,
+        params=params,
+        headers=_headers(),
+        timeout=(settings.ORS_CONNECT_TIMEOUT, timeout),
+    )
+
+def post(path, json=None, timeout=None):
+    timeout = timeout if timeout is not None else settings.ORS_DIRECTIONS_TIMEOUT
+    return _send(
+        'post', path,
+        json=json,
+        headers=_headers({'Content-Type': 'application/json'}),
+        timeout=(settings.ORS_CONNECT_TIMEOUT, timeout),
+    )
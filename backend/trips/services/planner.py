@@ -0,0 +1,416 @@
+
+import hashlib
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from ..models import Trip
+from . import geocache, metrics, poi, routestore, spatial
+from .eld_engine import ENGINE_VERSION, generate_eld_logs, generate_leg_logs, stream_eld_logs
+from .geometry import build_lod
+from .sequencing import order_stops, stop_precedence
+from .snapshots import store_snapshot, store_snapshots
+from .routing import (
+    RouteIndex, geocode, get_matrix, get_route, get_route_for_coords, get_route_for_waypoints, with_fallbacks,
+)
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused with a different plan request."""
+
+def plan_fingerprint(data):
+    """
+    Stable hash of everything that determines a plan's output: normalized
+    addresses, cycle hours and the ELD engine version.
+    """
+    parts = [
+        geocache.normalize_query(data['start_location']),
+        geocache.normalize_query(data['pickup_location']),
+        geocache.normalize_query(data['dropoff_location']),
+        round(float(data.get('current_cycle_used') or 0.0), 2),
+        ENGINE_VERSION,
+    ]
+    if data.get('start_hour') is not None:
+        # Only when given, so default-departure plans keep their fingerprints
+        parts.append(round(float(data['start_hour']), 2))
+    parts.extend(poi_parts())
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def multi_stop_fingerprint(data):
+    """
+    plan_fingerprint for multi-stop requests; the stop list is kept in
+    request order since it also decides the order when optimize is off.
+    """
+    parts = [
+        'multi',
+        geocache.normalize_query(data['start_location']),
+        [
+            [geocache.normalize_query(stop['location']), stop['type'], stop.get('shipment'), stop['dwell_minutes']]
+            for stop in data['stops']
+        ],
+        bool(data['optimize']),
+        round(float(data.get('current_cycle_used') or 0.0), 2),
+        ENGINE_VERSION,
+    ]
+    if data.get('start_hour') is not None:
+        parts.append(round(float(data['start_hour']), 2))
+    parts.extend(poi_parts())
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def poi_parts():
+    # Stops snap to the configured POI dataset, so a new dataset means new
+    # plans; without one, fingerprints are unchanged.
+    index = poi.get_index()
+    return [['poi', index.digest]] if index is not None else []
+
+def degraded_fingerprint(fingerprint, idempotency_key=None):
+    """
+    Fingerprint stored on trips planned with a fallback (default location,
+    mock route, ...). It is unique to the request's Idempotency-Key (random
+    without one), so a degraded plan is never reused for, or collides with,
+    another plan of the same lane; a retry with the same key still is.
+    """
+    salt = idempotency_key or uuid.uuid4().hex
+    return hashlib.sha256(f"{fingerprint}:degraded:{salt}".encode('utf-8')).hexdigest()
+
+def find_existing(fingerprint, idempotency_key=None):
+    """
+    Return the Trip already planned for this request, if any.
+    Raises IdempotencyConflict when the key belongs to a different request.
+    """
+    if idempotency_key:
+        trip = Trip.objects.filter(idempotency_key=idempotency_key).first()
+        if trip is not None:
+            if trip.fingerprint not in (fingerprint, degraded_fingerprint(fingerprint, idempotency_key)):
+                raise IdempotencyConflict(idempotency_key)
+            return trip
+    return Trip.objects.filter(fingerprint=fingerprint).first()
+
+def save_trip(trip):
+    """
+    Insert a planned Trip and its snapshot. If a concurrent request inserted
+    the same plan first, the unique constraint fires and that row is
+    returned instead. Returns (trip, created).
+    """
+    try:
+        with metrics.timed('db_insert'), transaction.atomic():
+            trip.save()
+    except IntegrityError:
+        existing = find_existing(trip.fingerprint, trip.idempotency_key)
+        if existing is None:
+            raise
+        return existing, False
+    with metrics.timed('snapshot'):
+        store_snapshot(trip)
+    with metrics.timed('route_cells'):
+        spatial.index_trip(trip)
+    return trip, True
+
+def place_markers(route_data, places=None):
+    # Start, Pickup, Dropoff (or every stop of a multi-stop plan)
+    if places is None:
+        places = [
+            {'type': 'START', 'label': 'Start', 'coords': route_data['start_coords']},
+            {'type': 'PICKUP', 'label': 'Pickup', 'coords': route_data['pickup_coords']},
+            {'type': 'DROPOFF', 'label': 'Dropoff', 'coords': route_data['dropoff_coords']},
+        ]
+    return [
+        {'type': place['type'], 'lat': place['coords'][1], 'lon': place['coords'][0], 'label': place['label']}
+        for place in places
+    ]
+
+def stop_marker(stop, coords):
+    marker = {
+        'type': stop['type'],
+        'lat': coords[1],
+        'lon': coords[0],
+        'metadata': {'distance_miles': stop['distance_miles']}
+    }
+    if stop.get('poi'):
+        # Snapped to a fuel station / truck stop: mark the place itself
+        place = stop['poi']
+        marker.update(lat=place['lat'], lon=place['lon'], label=place['name'] or place['kind'].replace('_', ' ').title())
+        marker['metadata']['poi'] = {'name': place['name'], 'kind': place['kind']}
+    return marker
+
+def build_markers(route_data, stops_meta, places=None):
+    markers = place_markers(route_data, places)
+    
+    # Interpolate stops (one index per route, one batched lookup)
+    route_index = RouteIndex(route_data['geometry'])
+    stop_coords = route_index.locate_many([stop['distance_miles'] for stop in stops_meta])
+    for stop, coords in zip(stops_meta, stop_coords):
+        markers.append(stop_marker(stop, coords))
+    return markers
+
+def new_trip(data, route_data, route_lod, idempotency_key=None):
+    """
+    Unsaved Trip for a routed start/pickup/dropoff plan, without logs or
+    markers yet.
+    """
+    fallbacks = route_data.get('fallbacks') or []
+    fingerprint = plan_fingerprint(data)
+    
+    return Trip(
+        start_location=data['start_location'],
+        pickup_location=data['pickup_location'],
+        dropoff_location=data['dropoff_location'],
+        current_cycle_used=data.get('current_cycle_used', 0.0),
+        distance_miles=route_data['distance_miles'],
+        duration_hours=route_data['duration_hours'],
+        route_geometry=route_data['geometry'],
+        route_lod=route_lod,
+        route_source=route_data.get('source'),
+        fallbacks=fallbacks,
+        fingerprint=degraded_fingerprint(fingerprint, idempotency_key) if fallbacks else fingerprint,
+        idempotency_key=idempotency_key
+    )
+
+def build_trip(data, route_data, idempotency_key=None):
+    """
+    Run the ELD simulation for a routed plan and return an unsaved Trip.
+    """
+    with metrics.timed('lod'):
+        route_lod = build_lod(route_data['geometry'])
+    with metrics.timed('eld'):
+        eld_result = generate_eld_logs(
+            route_data,
+            data.get('current_cycle_used', 0.0),
+            data.get('start_hour'),
+            poi.corridor_for(route_data, route_lod)
+        )
+    with metrics.timed('markers'):
+        markers = build_markers(route_data, eld_result['stops'])
+
+    trip = new_trip(data, route_data, route_lod, idempotency_key)
+    trip.eld_logs = eld_result['logs']
+    trip.markers = markers
+    return trip
+
+def stream_trip(data, route_data, idempotency_key=None):
+    """
+    build_trip for streamed responses. Yields ('marker', marker) and
+    ('day', day_log) events while the ELD simulation runs, then a final
+    ('trip', trip) with the unsaved Trip holding every day and marker.
+    """
+    markers = place_markers(route_data)
+    for marker in markers:
+        yield 'marker', marker
+
+    route_index = RouteIndex(route_data['geometry'])
+    route_lod = build_lod(route_data['geometry'])
+    days = []
+    events = stream_eld_logs(
+        route_data, data.get('current_cycle_used', 0.0), data.get('start_hour'), poi.corridor_for(route_data, route_lod)
+    )
+    for kind, payload in events:
+        if kind == 'day':
+            days.append(payload)
+            yield 'day', payload
+        else:
+            marker = stop_marker(payload, route_index.locate(payload['distance_miles']))
+            markers.append(marker)
+            yield 'marker', marker
+
+    trip = new_trip(data, route_data, route_lod, idempotency_key)
+    trip.eld_logs = days
+    trip.markers = markers
+    yield 'trip', trip
+
+def plan_trip(data):
+    """
+    Route, simulate and save one validated plan payload, or return the
+    trip an identical earlier request produced.
+    """
+    existing = find_existing(plan_fingerprint(data))
+    if existing is not None:
+        return existing
+
+    route_data = get_route(
+        data['start_location'],
+        data['pickup_location'],
+        data['dropoff_location']
+    )
+    trip, _ = save_trip(build_trip(data, route_data))
+    return trip
+
+def plan_multi_stop(data, idempotency_key=None):
+    """
+    Plan a validated MultiStopPlanSerializer payload and return an unsaved
+    Trip. Stops are ordered on one (cached) matrix call unless optimize is
+    off, then routed with a single directions call through every stop.
+    """
+    stops = data['stops']
+    with metrics.timed('geocode'):
+        geocoded = [geocode(data['start_location'])] + [geocode(stop['location']) for stop in stops]
+    points = [coords for coords, _ in geocoded]
+    notes = [note for _, note in geocoded if note]
+
+    order = list(range(len(points)))
+    if data['optimize'] and len(stops) > 1:
+        matrix = get_matrix(points)
+        if matrix.get('fallback'):
+            notes.append(matrix['fallback'])
+        with metrics.timed('sequencing'):
+            order = order_stops(matrix['durations'], stop_precedence(stops))
+
+    ordered = [stops[i - 1] for i in order[1:]]
+    route_data = with_fallbacks(get_route_for_waypoints([points[i] for i in order]), notes)
+    leg_miles = route_data['leg_miles']
+
+    with metrics.timed('lod'):
+        route_lod = build_lod(route_data['geometry'])
+    with metrics.timed('eld'):
+        eld_result = generate_leg_logs(
+            [(miles, stop['dwell_minutes']) for miles, stop in zip(leg_miles, ordered)],
+            data.get('current_cycle_used', 0.0),
+            data.get('start_hour'),
+            poi.corridor_for(route_data, route_lod)
+        )
+
+    visits = [
+        {
+            'type': stop['type'].upper(),
+            'location': stop['location'],
+            'shipment': stop.get('shipment'),
+            'dwell_minutes': stop['dwell_minutes'],
+            'coords': points[index],
+            'leg_miles': round(miles, 2),
+        }
+        for index, stop, miles in zip(order[1:], ordered, leg_miles)
+    ]
+    places = [{'type': 'START', 'label': 'Start', 'coords': points[0]}] + [
+        {'type': visit['type'], 'label': f"{visit['type'].title()} {n}: {visit['location']}", 'coords': visit['coords']}
+        for n, visit in enumerate(visits, start=1)
+    ]
+    with metrics.timed('markers'):
+        markers = build_markers(route_data, eld_result['stops'], places)
+
+    pickups = [visit['location'] for visit in visits if visit['type'] == 'PICKUP']
+    fingerprint = multi_stop_fingerprint(data)
+    return Trip(
+        start_location=data['start_location'],
+        pickup_location=pickups[0] if pickups else visits[0]['location'],
+        dropoff_location=visits[-1]['location'],
+        current_cycle_used=data.get('current_cycle_used', 0.0),
+        distance_miles=route_data['distance_miles'],
+        duration_hours=route_data['duration_hours'],
+        route_geometry=route_data['geometry'],
+        route_lod=route_lod,
+        eld_logs=eld_result['logs'],
+        markers=markers,
+        stops=visits,
+        route_source=route_data['source'],
+        fallbacks=route_data['fallbacks'],
+        fingerprint=degraded_fingerprint(fingerprint, idempotency_key) if route_data['fallbacks'] else fingerprint,
+        idempotency_key=idempotency_key
+    )
+
+def _in_worker(fn):
+    # Pool threads open their own DB connection (cache lookups); close it
+    # when the task ends so a large batch doesn't leak connections.
+    def run(*args):
+        try:
+            return fn(*args)
+        finally:
+            connection.close()
+    return run
+
+def _pool_map(fn, items, workers):
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(_in_worker(fn), items))
+
+def _capture(fn):
+    def run(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            return e
+    return run
+
+def plan_batch(items, workers=None):
+    """
+    Plan many validated TripPlanSerializer payloads at once.
+
+    Requests matching an existing trip (same fingerprint) reuse it, and
+    duplicates inside the batch are planned once. Addresses are geocoded
+    once per distinct (normalized) string and each distinct waypoint triple
+    is routed once; routing and ELD simulation run on a bounded thread pool
+    and new trips are saved with one bulk_create. Returns a list aligned
+    with items holding either a Trip or the Exception that item failed with.
+    """
+    workers = workers or settings.PLAN_BATCH_WORKERS
+
+    fingerprints = [plan_fingerprint(data) for data in items]
+    known = (Trip.objects
+             .only('id', 'fingerprint', 'distance_miles', 'duration_hours')
+             .in_bulk(set(fingerprints), field_name='fingerprint'))
+    todo = {}
+    for fingerprint, data in zip(fingerprints, items):
+        if fingerprint not in known:
+            todo.setdefault(fingerprint, data)
+    pending = list(todo.values())
+
+    # 1. Geocode each distinct address once
+    addresses = {}
+    for data in pending:
+        for field in ('start_location', 'pickup_location', 'dropoff_location'):
+            addresses.setdefault(geocache.normalize_query(data[field]), data[field])
+    keys = list(addresses)
+    geocoded = dict(zip(keys, _pool_map(_capture(geocode), [addresses[k] for k in keys], workers)))
+
+    def geocoded_for(data):
+        return [geocoded[geocache.normalize_query(data[field])] for field in ('start_location', 'pickup_location', 'dropoff_location')]
+
+    def waypoints_for(data):
+        # (coords, fallback) pairs -> coords; failures stay Exceptions
+        return tuple(g if isinstance(g, Exception) else g[0] for g in geocoded_for(data))
+
+    # 2. Route each distinct waypoint triple once
+    lanes = {}
+    for data in pending:
+        waypoints = waypoints_for(data)
+        if not any(isinstance(w, Exception) for w in waypoints):
+            lanes.setdefault(repr(waypoints), waypoints)
+    lane_keys = list(lanes)
+    routed = dict(zip(lane_keys, _pool_map(_capture(lambda w: get_route_for_coords(*w)), [lanes[k] for k in lane_keys], workers)))
+
+    # 3. Simulate every new plan
+    def plan_item(data):
+        waypoints = waypoints_for(data)
+        for point in waypoints:
+            if isinstance(point, Exception):
+                raise point
+        route_data = routed[repr(waypoints)]
+        if isinstance(route_data, Exception):
+            raise route_data
+        notes = [note for _, note in geocoded_for(data) if note]
+        return build_trip(data, with_fallbacks(dict(route_data), notes))
+
+    planned = dict(zip(todo, _pool_map(_capture(plan_item), pending, workers)))
+
+    # 4. Persist in one round trip
+    trips = [t for t in planned.values() if isinstance(t, Trip)]
+    # Geometries first, outside the transaction: a lost insert race below
+    # must not take rows other trips now reference with it
+    routestore.store_trips(trips)
+    try:
+        with transaction.atomic():
+            Trip.objects.bulk_create(trips, batch_size=settings.PLAN_BATCH_INSERT_SIZE)
+    except IntegrityError:
+        # A concurrent request saved one of these plans first; fall back to
+        # row-by-row inserts that resolve to the existing trips.
+        for trip in trips:
+            trip.pk = None
+        planned = {
+            fingerprint: save_trip(t)[0] if isinstance(t, Trip) else t
+            for fingerprint, t in planned.items()
+        }
+    else:
+        store_snapshots(trips)
+        spatial.index_trips(trips)
+
+    known.update(planned)
+    return [known[fingerprint] for fingerprint in fingerprints]
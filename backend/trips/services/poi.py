@@ -0,0 +1,264 @@
+
+# Fuel stations, truck stops and rest areas for placing planned stops (see
+# the build_poi_index management command). POIs are bucketed on a fixed
+# lat/lon grid and stored sorted by cell next to a cell -> offset table, so
+# a corridor query only reads the cells a stretch of route passes through.
+
+import csv
+import hashlib
+import json
+import threading
+from math import ceil, cos, radians
+import numpy as np
+from django.conf import settings
+from .geometry import GRID_ROW_STRIDE, densify, grid_cells
+from .routing import RouteIndex
+
+FORMAT_VERSION = 1
+CELL_DEGREES = 0.05                 # ~3.5 mi of latitude per grid row
+MILES_PER_DEGREE = 69.0
+CORRIDOR_LOD = 'high'               # geometry.LOD_LEVELS entry used for queries
+
+KINDS = ('fuel', 'truck_stop', 'rest_area', 'parking')
+KIND_ALIASES = {
+    'gas_station': 'fuel', 'fuel_station': 'fuel',
+    'truckstop': 'truck_stop', 'travel_center': 'truck_stop',
+    'rest_stop': 'rest_area', 'truck_parking': 'parking',
+}
+
+# Planned stop type -> POI kinds that can host it
+SERVES = {
+    'FUEL': ('fuel', 'truck_stop'),
+    'REST': ('truck_stop', 'rest_area', 'parking'),
+    'RESTART': ('truck_stop', 'parking'),  # rest areas rarely allow a 34h stay
+}
+
+_index = None
+_index_lock = threading.Lock()
+
+def _kind(value):
+    kind = str(value or '').strip().lower().replace(' ', '_').replace('-', '_')
+    kind = KIND_ALIASES.get(kind, kind)
+    return kind if kind in KINDS else None
+
+def read_pois(path):
+    """
+    [(lon, lat, kind, name), ...] from a CSV (lat/lon or latitude/longitude,
+    kind and name columns) or a GeoJSON FeatureCollection of Points (kind or
+    amenity and name properties). Rows with an unknown kind are skipped.
+    """
+    rows = []
+    if path.lower().endswith(('.geojson', '.json')):
+        with open(path) as fh:
+            data = json.load(fh)
+        for feature in data.get('features', []):
+            geometry = feature.get('geometry') or {}
+            props = feature.get('properties') or {}
+            kind = _kind(props.get('kind') or props.get('amenity'))
+            if geometry.get('type') != 'Point' or kind is None:
+                continue
+            lon, lat = geometry['coordinates'][:2]
+            rows.append((float(lon), float(lat), kind, str(props.get('name') or '')))
+        return rows
+
+    with open(path, newline='') as fh:
+        for row in csv.DictReader(fh):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            kind = _kind(row.get('kind'))
+            lat = row.get('lat') or row.get('latitude')
+            lon = row.get('lon') or row.get('longitude')
+            if kind is None or not lat or not lon:
+                continue
+            rows.append((float(lon), float(lat), kind, (row.get('name') or '').strip()))
+    return rows
+
+def build_index(input_path, output_path, log=print):
+    """
+    Read a POI file and write the grid-sorted index to output_path (.npz).
+    """
+    pois = read_pois(input_path)
+    if not pois:
+        raise ValueError(f"No fuel / truck stop / rest area POIs found in {input_path}")
+    return write_index(pois, output_path, log)
+
+def write_index(pois, output_path, log=print):
+    lon = np.array([p[0] for p in pois])
+    lat = np.array([p[1] for p in pois])
+    kind = np.array([KINDS.index(p[2]) for p in pois], dtype=np.uint8)
+    name = np.array([p[3] for p in pois], dtype=str)
+
+    rows, cols = grid_cells(lon, lat, CELL_DEGREES)
+    keys = rows * GRID_ROW_STRIDE + cols
+    order = np.argsort(keys, kind='stable')
+    cells, starts = np.unique(keys[order], return_index=True)
+    lon, lat, kind, name = lon[order], lat[order], kind[order], name[order]
+
+    digest = hashlib.sha256()
+    for column in (lon, lat, kind):
+        digest.update(column.tobytes())
+    digest.update('\n'.join(name).encode('utf-8'))
+
+    np.savez_compressed(
+        output_path,
+        version=FORMAT_VERSION,
+        cell=CELL_DEGREES,
+        lon=lon, lat=lat, kind=kind, name=name,
+        cells=cells, starts=np.append(starts, len(lon)),
+        digest=digest.hexdigest(),
+    )
+    log(f"Wrote {len(lon)} POIs in {len(cells)} grid cells to {output_path}")
+    return len(lon)
+
+class POIIndex:
+    def __init__(self, path):
+        with np.load(path) as data:
+            if int(data['version']) != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported POI index version {int(data['version'])}")
+            self.cell = float(data['cell'])
+            self.lon = data['lon']
+            self.lat = data['lat']
+            self.kind = data['kind']
+            self.name = data['name']
+            self.cells = data['cells']
+            self.starts = data['starts']
+            self.digest = str(data['digest'])
+        self.path = path
+
+    def __len__(self):
+        return len(self.lon)
+
+    def in_cells(self, keys):
+        """
+        Indices of every POI in the given cell keys.
+        """
+        keys = np.unique(keys)
+        pos = np.searchsorted(self.cells, keys)
+        hit = pos < len(self.cells)
+        pos, keys = pos[hit], keys[hit]
+        pos = pos[self.cells[pos] == keys]
+        lengths = self.starts[pos + 1] - self.starts[pos]
+        offsets = np.repeat(self.starts[pos] - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def near_line(self, coords, width_miles):
+        """
+        Indices of the POIs in every grid cell that may hold a point within
+        width_miles of the polyline coords ([[lon, lat], ...]); callers
+        filter the exact distance.
+        """
+        # Sample the line every half cell, then take each sample's
+        # neighbourhood of cells wide enough to cover the corridor.
+        samples = densify(coords, self.cell / 2)
+
+        reach_lat = width_miles / MILES_PER_DEGREE + self.cell / 4
+        reach_lon = width_miles / (MILES_PER_DEGREE * max(cos(radians(np.abs(samples[:, 1]).max())), 0.01)) + self.cell / 4
+        dr, dc = np.meshgrid(np.arange(-ceil(reach_lat / self.cell), ceil(reach_lat / self.cell) + 1),
+                             np.arange(-ceil(reach_lon / self.cell), ceil(reach_lon / self.cell) + 1))
+        rows, cols = grid_cells(samples[:, 0], samples[:, 1], self.cell)
+        touched = np.unique(rows * GRID_ROW_STRIDE + cols)  # dense lines put many samples in one cell
+        keys = touched[:, None] + (dr * GRID_ROW_STRIDE + dc).ravel()
+        return self.in_cells(keys.ravel())
+
+    def poi(self, i):
+        return {
+            'name': str(self.name[i]),
+            'kind': KINDS[int(self.kind[i])],
+            'lon': float(self.lon[i]),
+            'lat': float(self.lat[i]),
+        }
+
+class Corridor:
+    """
+    POIs along one route, handed to the ELD engine as `places`. Each query
+    covers only the stretch of line between two route miles.
+    """
+    def __init__(self, index, route_index, width_miles, lookback_miles):
+        self.index = index
+        self.route = route_index
+        self.width_miles = width_miles
+        self.lookback_miles = lookback_miles
+        self._kinds = {
+            stop_type: np.array([KINDS.index(kind) for kind in kinds], dtype=np.uint8)
+            for stop_type, kinds in SERVES.items()
+        }
+
+    def last_before(self, stop_type, start_mile, end_mile):
+        """
+        The POI able to host stop_type that lies furthest along the route in
+        (start_mile, end_mile], as (route mile, poi dict), or None.
+        """
+        cumulative = self.route.cumulative_miles
+        if end_mile <= start_mile or len(cumulative) < 2 or stop_type not in self._kinds:
+            return None
+        # The stretch of line between the two miles: both ends interpolated,
+        # plus the route vertices in between
+        lo = int(np.searchsorted(cumulative, start_mile, side='right'))
+        hi = int(np.searchsorted(cumulative, end_mile, side='left'))
+        ends = self.route.locate_many([start_mile, end_mile])
+        points = np.vstack(([ends[0]], self.route.coords[lo:hi], [ends[1]]))
+        point_miles = np.concatenate(([start_mile], cumulative[lo:hi], [end_mile]))
+
+        candidates = self.index.near_line(points, self.width_miles)
+        candidates = candidates[np.isin(self.index.kind[candidates], self._kinds[stop_type])]
+        if not len(candidates):
+            return None
+
+        # Project onto each segment of the stretch (local equirectangular miles)
+        scale_x = MILES_PER_DEGREE * cos(radians(float(points[:, 1].mean())))
+        x, y = points[:, 0] * scale_x, points[:, 1] * MILES_PER_DEGREE
+        dx, dy = np.diff(x), np.diff(y)
+        length2 = np.maximum(dx * dx + dy * dy, 1e-12)
+        px = (self.index.lon[candidates] * scale_x)[:, None] - x[None, :-1]
+        py = (self.index.lat[candidates] * MILES_PER_DEGREE)[:, None] - y[None, :-1]
+        # Unclamped past both ends of the stretch, so POIs beyond it land
+        # outside (start_mile, end_mile] instead of on its endpoints
+        lower, upper = np.zeros(len(dx)), np.ones(len(dx))
+        lower[0], upper[-1] = -np.inf, np.inf
+        t = np.clip((px * dx + py * dy) / length2, lower, upper)
+        px -= t * dx
+        py -= t * dy
+        offset2 = px * px + py * py
+        nearest = offset2.argmin(axis=1)
+        rows = np.arange(len(candidates))
+        miles = point_miles[nearest] + t[rows, nearest] * np.diff(point_miles)[nearest]
+
+        ok = (offset2[rows, nearest] <= self.width_miles ** 2) & (miles > start_mile) & (miles <= end_mile)
+        if not ok.any():
+            return None
+        best = np.flatnonzero(ok)[np.argmax(miles[ok])]
+        return float(miles[best]), self.index.poi(candidates[best])
+
+def get_index():
+    """
+    The process-wide index from POI_INDEX_PATH, loaded on first use.
+    Returns None when no index is configured or the file cannot be read.
+    """
+    global _index
+    path = settings.POI_INDEX_PATH
+    if not path:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            try:
+                _index = POIIndex(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"POI index load failed: {e}")
+                return None
+        return _index
+
+def corridor_for(route_data, route_lod=None):
+    """
+    The ELD engine's `places` for a route, or None without a POI index.
+    Given the route's LOD levels, queries run on the finest simplified line
+    (a few metres off the full one, with far fewer vertices per stretch).
+    """
+    index = get_index()
+    if index is None:
+        return None
+    line = route_lod[CORRIDOR_LOD]['coordinates'] if route_lod else route_data['geometry']
+    return Corridor(index, RouteIndex(line), settings.POI_CORRIDOR_MILES, settings.POI_SNAP_LOOKBACK_MILES)
+
+def reset():
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,392 @@
+
+# Offline routing over a preprocessed road graph (see the build_road_graph
+# management command). The graph is a CSR adjacency list with travel-time
+# weights plus ALT landmark distances, stored as one .npz file; queries are
+# A* with the landmark (triangle inequality) lower bound as heuristic.
+
+import heapq
+import threading
+import xml.etree.ElementTree as ET
+from math import cos, radians
+import numpy as np
+from django.conf import settings
+from .geometry import GRID_ROW_STRIDE, grid_cells
+
+FORMAT_VERSION = 1
+METERS_TO_MILES = 0.000621371
+NODE_CELL_DEGREES = 0.05            # nearest_node grid, ~3.5 mi cells
+NODE_SEARCH_RINGS = 8               # rings of cells searched before a full scan
+
+# Default free-flow truck speeds (km/h) per OSM highway class
+HIGHWAY_SPEEDS = {
+    'motorway': 100, 'motorway_link': 60,
+    'trunk': 85, 'trunk_link': 50,
+    'primary': 70, 'primary_link': 45,
+    'secondary': 60, 'secondary_link': 40,
+    'tertiary': 50, 'tertiary_link': 35,
+    'unclassified': 40, 'residential': 30,
+    'living_street': 10, 'service': 15, 'road': 40,
+}
+ONEWAY_BY_DEFAULT = {'motorway', 'motorway_link'}
+
+_graph = None
+_graph_lock = threading.Lock()
+
+class NoRoute(Exception):
+    pass
+
+def _parse_speed(value, default):
+    # "65 mph", "100", "50;70" -> km/h
+    if not value:
+        return default
+    value = value.split(';')[0].strip().lower()
+    try:
+        if value.endswith('mph'):
+            return float(value[:-3]) * 1.609344
+        return float(value.split()[0])
+    except (ValueError, IndexError):
+        return default
+
+def _distances_m(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(a)) * 6371008.8
+
+def _stream(path):
+    """
+    Yield the top-level elements (node, way, relation) of an OSM XML file
+    one at a time, freeing each one and detaching it from the root once
+    the caller is done with it, so memory stays flat on a large extract.
+    """
+    events = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(events)
+    depth = 0
+    for event, elem in events:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield elem
+            elem.clear()
+            root.clear()
+
+def parse_osm(path):
+    """
+    Read drivable ways from an OSM XML extract. Returns (node_ids, lon, lat,
+    edges) where edges is a list of (from_id, to_id, speed_kmh).
+    """
+    edges = []
+    needed = set()
+    for elem in _stream(path):
+        if elem.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+            highway = tags.get('highway')
+            if highway in HIGHWAY_SPEEDS and tags.get('access') not in ('no', 'private'):
+                refs = [nd.get('ref') for nd in elem.iter('nd')]
+                speed = _parse_speed(tags.get('maxspeed'), HIGHWAY_SPEEDS[highway])
+                oneway = tags.get('oneway', 'yes' if highway in ONEWAY_BY_DEFAULT else 'no')
+                if tags.get('junction') == 'roundabout' and 'oneway' not in tags:
+                    oneway = 'yes'
+                if oneway == '-1':
+                    refs.reverse()
+                for a, b in zip(refs, refs[1:]):
+                    edges.append((a, b, speed))
+                    if oneway not in ('yes', 'true', '1', '-1'):
+                        edges.append((b, a, speed))
+                needed.update(refs)
+
+    coords = {}
+    for elem in _stream(path):
+        if elem.tag == 'node':
+            node_id = elem.get('id')
+            if node_id in needed:
+                coords[node_id] = (float(elem.get('lon')), float(elem.get('lat')))
+
+    edges = [e for e in edges if e[0] in coords and e[1] in coords]
+    node_ids = sorted({n for e in edges for n in e[:2]})
+    lon = np.array([coords[n][0] for n in node_ids])
+    lat = np.array([coords[n][1] for n in node_ids])
+    return node_ids, lon, lat, edges
+
+def _csr(n, sources, targets, *weights):
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+    return (indptr, targets[order]) + tuple(w[order] for w in weights)
+
+def _dijkstra(indptr, targets, weights, source):
+    """
+    Full single-source shortest paths; returns an array (inf = unreachable).
+    """
+    indptr, targets, weights = indptr.tolist(), targets.tolist(), weights.tolist()
+    dist = [float('inf')] * (len(indptr) - 1)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for i in range(indptr[u], indptr[u + 1]):
+            v = targets[i]
+            nd = d + weights[i]
+            if nd < dist[v]:
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return np.array(dist)
+
+def _ring(radius):
+    # (row, col) offsets of the cells exactly `radius` cells from the centre
+    span = np.arange(-radius, radius + 1)
+    dr, dc = np.meshgrid(span, span)
+    edge = np.maximum(np.abs(dr), np.abs(dc)) == radius
+    return dr[edge], dc[edge]
+
+def _largest_component(n, sources, targets):
+    # Weakly connected components by union-find; keep the biggest so that
+    # snapped endpoints are (almost always) mutually reachable.
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(sources.tolist(), targets.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[ra] = rb
+    roots = np.array([find(x) for x in range(n)])
+    return roots == np.bincount(roots).argmax()
+
+def build_graph(osm_path, output_path, landmarks=8, log=print):
+    """
+    Parse an OSM extract, keep its largest connected road network and write
+    the CSR graph plus ALT landmark tables to output_path (.npz).
+    """
+    node_ids, lon, lat, edges = parse_osm(osm_path)
+    if not edges:
+        raise ValueError(f"No drivable ways found in {osm_path}")
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    sources = np.array([index[e[0]] for e in edges], dtype=np.int64)
+    targets = np.array([index[e[1]] for e in edges], dtype=np.int64)
+    speed_kmh = np.array([e[2] for e in edges], dtype=float)
+    log(f"Parsed {len(node_ids)} nodes, {len(edges)} directed edges")
+
+    keep = _largest_component(len(node_ids), sources, targets)
+    remap = np.cumsum(keep) - 1
+    kept_edges = keep[sources]
+    sources, targets, speed_kmh = remap[sources[kept_edges]], remap[targets[kept_edges]], speed_kmh[kept_edges]
+    lon, lat = lon[keep], lat[keep]
+    n = len(lon)
+
+    meters = _distances_m(lon[sources], lat[sources], lon[targets], lat[targets])
+    seconds = meters / (speed_kmh / 3.6)
+    indptr, csr_targets, csr_seconds, csr_meters = _csr(n, sources, targets, seconds, meters)
+    rev_indptr, rev_targets, rev_seconds = _csr(n, targets, sources, seconds)
+
+    # Farthest-point landmark selection: each new landmark is the node
+    # farthest (in travel time) from the ones chosen so far.
+    chosen, lm_from, lm_to = [], [], []
+    nearest = np.full(n, np.inf)
+    candidate = 0
+    for _ in range(min(landmarks, n)):
+        chosen.append(candidate)
+        from_landmark = _dijkstra(indptr, csr_targets, csr_seconds, candidate)
+        to_landmark = _dijkstra(rev_indptr, rev_targets, rev_seconds, candidate)
+        lm_from.append(from_landmark)
+        lm_to.append(to_landmark)
+        reach = np.where(np.isfinite(from_landmark), from_landmark, 0.0)
+        nearest = np.minimum(nearest, reach)
+        candidate = int(np.argmax(nearest))
+        log(f"Landmark {len(chosen)}/{landmarks}: node {chosen[-1]}")
+
+    np.savez_compressed(
+        output_path,
+        version=FORMAT_VERSION,
+        lon=lon, lat=lat,
+        indptr=indptr, targets=csr_targets.astype(np.int32),
+        seconds=csr_seconds.astype(np.float32), meters=csr_meters.astype(np.float32),
+        landmarks=np.array(chosen, dtype=np.int32),
+        lm_from=np.array(lm_from, dtype=np.float32), lm_to=np.array(lm_to, dtype=np.float32),
+    )
+    log(f"Wrote {n} nodes, {len(csr_targets)} edges to {output_path}")
+    return n, len(csr_targets)
+
+class RoadGraph:
+    def __init__(self, path):
+        with np.load(path) as data:
+            if int(data['version']) != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported road graph version {int(data['version'])}")
+            self.lon = data['lon']
+            self.lat = data['lat']
+            self.lm_from = data['lm_from'].astype(float)
+            self.lm_to = data['lm_to'].astype(float)
+            # Python lists: the A* loop indexes them one element at a time
+            self.indptr = data['indptr'].tolist()
+            self.targets = data['targets'].tolist()
+            self.seconds = data['seconds'].astype(float).tolist()
+            self.meters = data['meters'].astype(float).tolist()
+
+        # Node-major landmark rows [-d(L,v)..., d(v,L)...]: adding the
+        # target's [d(L,t)..., -d(t,L)...] gives a node's ALT bounds.
+        self._node_bounds = np.hstack((-self.lm_from.T, self.lm_to.T))
+        self._scale = cos(radians(float(self.lat.mean())))
+        self._x = self.lon * self._scale
+
+        # Nodes bucketed by grid cell (as in the POI index) for nearest_node
+        rows, cols = grid_cells(self.lon, self.lat, NODE_CELL_DEGREES)
+        keys = rows * GRID_ROW_STRIDE + cols
+        self._by_cell = np.argsort(keys, kind='stable')
+        self._cells, starts = np.unique(keys[self._by_cell], return_index=True)
+        self._starts = np.append(starts, len(keys))
+        self.path = path
+
+    def __len__(self):
+        return len(self.lon)
+
+    def _in_cells(self, keys):
+        # Indices of every node in the given cell keys
+        pos = np.searchsorted(self._cells, keys)
+        hit = pos < len(self._cells)
+        pos, keys = pos[hit], keys[hit]
+        pos = pos[self._cells[pos] == keys]
+        lengths = self._starts[pos + 1] - self._starts[pos]
+        offsets = np.repeat(self._starts[pos] - np.cumsum(lengths) + lengths, lengths)
+        return self._by_cell[offsets + np.arange(lengths.sum())]
+
+    def nearest_node(self, lon, lat):
+        """
+        Closest graph node to [lon, lat]; returns (node, distance in miles).
+        """
+        # Search outward ring by ring; a node `ring` cells out is at least
+        # (ring - 1) cells away, so stop once that exceeds the best so far.
+        x = lon * self._scale
+        row, col = (int(v) for v in grid_cells(lon, lat, NODE_CELL_DEGREES))
+        reach = NODE_CELL_DEGREES * self._scale
+        node, best = None, float('inf')
+        for ring in range(NODE_SEARCH_RINGS + 1):
+            if (max(ring - 1, 0) * reach) ** 2 > best:
+                break
+            dr, dc = _ring(ring)
+            nodes = self._in_cells((row + dr) * GRID_ROW_STRIDE + col + dc)
+            if len(nodes):
+                d2 = (self._x[nodes] - x) ** 2 + (self.lat[nodes] - lat) ** 2
+                i = int(np.argmin(d2))
+                if d2[i] < best:
+                    node, best = int(nodes[i]), float(d2[i])
+        else:
+            if (NODE_SEARCH_RINGS * reach) ** 2 <= best:
+                # Far from every node (or the ring search was inconclusive)
+                node = int(np.argmin((self._x - x) ** 2 + (self.lat - lat) ** 2))
+        miles = float(_distances_m(lon, lat, self.lon[node], self.lat[node])) * METERS_TO_MILES
+        return node, miles
+
+    def shortest_path(self, source, target):
+        """
+        A* from source to target. Returns (node path, seconds, meters).
+        """
+        if source == target:
+            return [source], 0.0, 0.0
+
+        # ALT lower bound on travel time to target, computed only for the
+        # nodes the search reaches:
+        # d(v,t) >= d(L,t) - d(L,v) and d(v,t) >= d(v,L) - d(t,L)
+        to_target = np.concatenate((self.lm_from[:, target], -self.lm_to[:, target]))
+        h = {}
+
+        def bound(nodes):
+            fresh = [v for v in nodes if v not in h]
+            if fresh:
+                bounds = self._node_bounds[fresh] + to_target
+                bounds[~np.isfinite(bounds)] = 0.0
+                h.update(zip(fresh, np.maximum(bounds.max(axis=1), 0.0).tolist()))
+
+        indptr, targets, seconds = self.indptr, self.targets, self.seconds
+        bound([source])
+        best = {source: 0.0}
+        parent = {source: (None, None)}
+        heap = [(h[source], 0.0, source)]
+        settled = set()
+
+        while heap:
+            _, g, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in settled:
+                continue
+            settled.add(u)
+            bound(targets[indptr[u]:indptr[u + 1]])
+            for i in range(indptr[u], indptr[u + 1]):
+                v = targets[i]
+                ng = g + seconds[i]
+                if ng < best.get(v, float('inf')):
+                    best[v] = ng
+                    parent[v] = (u, i)
+                    heapq.heappush(heap, (ng + h[v], ng, v))
+        else:
+            raise NoRoute(f"No road path between nodes {source} and {target}")
+
+        path, meters = [target], 0.0
+        node = target
+        while parent[node][0] is not None:
+            node, edge = parent[node]
+            meters += self.meters[edge]
+            path.append(node)
+        path.reverse()
+        return path, best[target], meters
+
+    def route(self, waypoints):
+        """
+        Route through [lon, lat] waypoints. Returns the same dict shape as
+        routing.fetch_directions, with one leg distance per waypoint pair.
+        """
+        max_snap = settings.ROAD_GRAPH_MAX_SNAP_MILES
+        nodes = []
+        for lon, lat in (w[:2] for w in waypoints):
+            node, miles = self.nearest_node(lon, lat)
+            if miles > max_snap:
+                raise NoRoute(f"[{lon}, {lat}] is {miles:.1f} mi from the road graph")
+            nodes.append(node)
+
+        coords, legs, total_seconds = [], [], 0.0
+        for source, target in zip(nodes, nodes[1:]):
+            path, seconds, meters = self.shortest_path(source, target)
+            leg = [[float(self.lon[n]), float(self.lat[n])] for n in path]
+            coords.extend(leg[1:] if coords else leg)
+            legs.append(meters * METERS_TO_MILES)
+            total_seconds += seconds
+
+        total_miles = sum(legs)
+        return {
+            'distance_miles': round(total_miles, 2),
+            'duration_hours': round(total_seconds / 3600.0, 2),
+            'geometry': {'type': 'LineString', 'coordinates': coords},
+            'segment1_miles': legs[0] if legs else 0.0,
+            'segment2_miles': legs[1] if len(legs) > 1 else 0.0,
+            'leg_miles': legs,
+        }
+
+def get_graph():
+    """
+    The process-wide graph from ROAD_GRAPH_PATH, loaded on first use.
+    Returns None when no graph is configured or the file cannot be read.
+    """
+    global _graph
+    path = settings.ROAD_GRAPH_PATH
+    if not path:
+        return None
+    with _graph_lock:
+        if _graph is None or _graph.path != path:
+            try:
+                _graph = RoadGraph(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Road graph load failed: {e}")
+                return None
+        return _graph
+
+def reset():
+    global _graph
+    with _graph_lock:
+        _graph = None
@@ -0,0 +1,191 @@
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from . import metrics
+
+PENDING = 'pending'
+READY = 'ready'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'saved_ms': 0.0}
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_RESULTS = {'hits': 'hit', 'coalesced': 'coalesced', 'misses': 'miss'}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+    if name in _RESULTS:
+        metrics.inc('cache_lookups_total', amount, cache='route', result=_RESULTS[name])
+
+def round_coordinates(coordinates, precision=None):
+    precision = settings.ROUTE_CACHE_PRECISION if precision is None else precision
+    return [[round(float(c), precision) for c in point[:2]] for point in coordinates]
+
+def make_key(coordinates, precision=None, namespace=None):
+    rounded = round_coordinates(coordinates, precision)
+    if namespace:
+        # Other ORS lookups on the same waypoints (e.g. 'matrix') get their own keys
+        rounded = [namespace, rounded]
+    return hashlib.sha256(json.dumps(rounded).encode('utf-8')).hexdigest()
+
+def cached_route(coordinates, fetch, namespace=None):
+    """
+    Return the route for a waypoint list, calling fetch() at most once
+    across concurrent identical requests.
+
+    Requests in the same process wait on the leader's in-flight call;
+    requests in other gunicorn workers wait on the pending lease row in
+    RouteCacheEntry. Exceptions from fetch() propagate and are not cached.
+    """
+    key = make_key(coordinates, namespace=namespace)
+
+    with _inflight_lock:
+        inflight = _inflight.get(key)
+        leader = inflight is None
+        if leader:
+            inflight = _inflight[key] = _InFlight()
+
+    if not leader:
+        inflight.done.wait(settings.ROUTE_CACHE_LEASE_SECONDS)
+        if inflight.result is not None:
+            _count('coalesced')
+            return copy.deepcopy(inflight.result)
+        # Leader failed or timed out; try on our own.
+        return _load_or_fetch(key, coordinates, fetch)
+
+    try:
+        inflight.result = _load_or_fetch(key, coordinates, fetch)
+        return copy.deepcopy(inflight.result)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        inflight.done.set()
+
+def _load_or_fetch(key, coordinates, fetch):
+    from ..models import RouteCacheEntry
+
+    deadline = time.monotonic() + settings.ROUTE_CACHE_LEASE_SECONDS
+    while True:
+        now = timezone.now()
+        try:
+            row = RouteCacheEntry.objects.filter(key=key).values(
+                'status', 'payload', 'upstream_ms', 'expires_at', 'lease_expires_at'
+            ).first()
+        except DatabaseError as e:
+            print(f"Route cache read failed: {e}")
+            return _fetch_uncached(fetch)
+
+        if row and row['status'] == READY and row['expires_at'] > now:
+            RouteCacheEntry.objects.filter(key=key).update(hits=F('hits') + 1)
+            _count('hits')
+            _count('saved_ms', row['upstream_ms'])
+            return row['payload']
+
+        if row and row['status'] == PENDING and row['lease_expires_at'] > now and time.monotonic() < deadline:
+            # Another worker holds the lease; wait for it to publish.
+            time.sleep(settings.ROUTE_CACHE_POLL_INTERVAL)
+            continue
+
+        if _claim_lease(key, coordinates, row is not None):
+            break
+        if time.monotonic() >= deadline:
+            # The lease holder is stuck; don't block the request on it.
+            return _fetch_uncached(fetch)
+        # Lost the race for the lease; re-read and wait on the winner.
+
+    _count('misses')
+    started = time.perf_counter()
+    try:
+        payload = fetch()
+    except Exception:
+        RouteCacheEntry.objects.filter(key=key, status=PENDING).delete()
+        raise
+    upstream_ms = (time.perf_counter() - started) * 1000
+
+    RouteCacheEntry.objects.filter(key=key).update(
+        status=READY,
+        payload=payload,
+        upstream_ms=upstream_ms,
+        expires_at=timezone.now() + timedelta(seconds=settings.ROUTE_CACHE_TTL),
+    )
+    return payload
+
+def _claim_lease(key, coordinates, exists):
+    from ..models import RouteCacheEntry
+
+    now = timezone.now()
+    lease_expires_at = now + timedelta(seconds=settings.ROUTE_CACHE_LEASE_SECONDS)
+
+    if not exists:
+        try:
+            with transaction.atomic():
+                RouteCacheEntry.objects.create(
+                    key=key,
+                    coordinates=round_coordinates(coordinates),
+                    status=PENDING,
+                    lease_expires_at=lease_expires_at,
+                    expires_at=lease_expires_at,
+                )
+            return True
+        except IntegrityError:
+            return False
+
+    # Take over an expired entry or an abandoned lease; the conditional
+    # update makes sure only one worker wins.
+    claimed = RouteCacheEntry.objects.filter(key=key).filter(
+        Q(status=READY, expires_at__lte=now) | Q(status=PENDING, lease_expires_at__lte=now)
+    ).update(status=PENDING, lease_expires_at=lease_expires_at)
+    return claimed == 1
+
+def _fetch_uncached(fetch):
+    _count('misses')
+    return fetch()
+
+def purge(expired_only=True):
+    from ..models import RouteCacheEntry
+
+    qs = RouteCacheEntry.objects.all()
+    if expired_only:
+        qs = qs.filter(status=READY, expires_at__lte=timezone.now())
+    removed, _ = qs.delete()
+    return removed
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    lookups = snapshot['hits'] + snapshot['coalesced'] + snapshot['misses']
+    snapshot['hit_ratio'] = round((snapshot['hits'] + snapshot['coalesced']) / lookups, 4) if lookups else 0.0
+    snapshot['saved_ms'] = round(snapshot['saved_ms'], 1)
+    return snapshot
+
+def table_stats():
+    """
+    Shared (cross-process) view: every hit on a row saved one upstream call
+    of that row's recorded latency.
+    """
+    from ..models import RouteCacheEntry
+
+    totals = RouteCacheEntry.objects.filter(status=READY).aggregate(
+        total_hits=Sum('hits'),
+        saved_ms=Sum(F('hits') * F('upstream_ms')),
+    )
+    totals['entries'] = RouteCacheEntry.objects.filter(status=READY).count()
+    totals['saved_ms'] = round(totals['saved_ms'] or 0.0, 1)
+    totals['total_hits'] = totals['total_hits'] or 0
+    return totals
@@ -0,0 +1,253 @@
+
+# Content-addressed storage for route lines. Replanning a lane produces the
+# same geometry every time, so trips reference one RouteGeometry row keyed
+# by the sha256 of its encoding instead of each carrying the JSON. Lines are
+# stored as fixed-point coordinates, delta-encoded per axis, zigzag varints,
+# zlib-compressed: a 5-decimal ORS route is ~3 bytes a point against ~25 as
+# JSON. Decoded lines are kept in a per-process LRU for hot lanes.
+
+import hashlib
+import json
+import struct
+import time
+import zlib
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from . import metrics
+from .geocache import LRUCache
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BBBB')    # version, kind, decimals, dimensions
+
+FIXED, RAW, JSON = 0, 1, 2          # kinds
+DECIMALS = (5, 6, 7)                # tried in order; RAW float64 when none is exact
+VARINT_BYTES = 10                   # enough for any 64-bit value
+
+_cache = LRUCache(settings.ROUTE_GEOMETRY_CACHE_SIZE)
+
+def _varints(values):
+    # Unsigned LEB128, every value at once
+    values = values.astype(np.uint64)
+    groups = (values[:, None] >> (np.arange(VARINT_BYTES, dtype=np.uint64) * np.uint64(7))) & np.uint64(0x7f)
+    used = np.where(groups.any(axis=1), VARINT_BYTES - np.argmax(groups[:, ::-1] != 0, axis=1), 1)
+    position = np.arange(VARINT_BYTES)
+    groups |= np.where(position < used[:, None] - 1, 0x80, 0).astype(np.uint64)
+    return groups[position < used[:, None]].astype(np.uint8).tobytes()
+
+def _from_varints(data):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = (np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)).astype(np.uint64) * np.uint64(7)
+    return np.bitwise_or.reduceat((raw & 0x7f).astype(np.uint64) << shift, starts) if len(raw) else np.zeros(0, np.uint64)
+
+def _fixed_point(points):
+    # Smallest decimals at which every coordinate round-trips exactly
+    if not np.isfinite(points).all():
+        return None
+    for decimals in DECIMALS:
+        scale = 10.0 ** decimals
+        if np.abs(points).max(initial=0) * scale >= 2 ** 62:
+            return None
+        scaled = np.round(points * scale)
+        if np.array_equal(scaled / scale, points):
+            return decimals, scaled.astype(np.int64)
+    return None
+
+def _line(geometry):
+    # The (n, dims) coordinate array of a plain LineString, else None
+    if not isinstance(geometry, dict) or set(geometry) != {'type', 'coordinates'} or geometry['type'] != 'LineString':
+        return None
+    coords = geometry['coordinates']
+    if not isinstance(coords, list) or not coords or not all(isinstance(c, list) and c for c in coords):
+        return None
+    if any(isinstance(v, bool) or not isinstance(v, (int, float)) for c in coords for v in c):
+        return None
+    if len({len(c) for c in coords}) != 1 or len(coords[0]) > 255:
+        return None
+    return np.array(coords, dtype=float)
+
+def encode(geometry):
+    """
+    (digest, compressed bytes, point count) for a GeoJSON geometry. Plain
+    LineStrings are stored exactly (integer coordinates come back as
+    floats); anything else falls back to compact JSON.
+    """
+    points = _line(geometry)
+    if points is None:
+        header = HEADER.pack(FORMAT_VERSION, JSON, 0, 0)
+        body = json.dumps(geometry, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        count = len(geometry.get('coordinates') or []) if isinstance(geometry, dict) else 0
+    else:
+        count, dims = points.shape
+        fixed = _fixed_point(points)
+        if fixed is None:
+            header = HEADER.pack(FORMAT_VERSION, RAW, 0, dims)
+            body = points.astype('<f8').tobytes()
+        else:
+            decimals, scaled = fixed
+            deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, dims), dtype=np.int64)).ravel()
+            zigzag = (deltas << 1) ^ (deltas >> 63)
+            header = HEADER.pack(FORMAT_VERSION, FIXED, decimals, dims)
+            body = _varints(zigzag.view(np.uint64))
+    digest = hashlib.sha256(header + body).hexdigest()
+    return digest, header + zlib.compress(body, 6), count
+
+def decode(data):
+    """
+    The GeoJSON geometry back from encode()'s bytes.
+    """
+    data = bytes(data)
+    version, kind, decimals, dims = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported route geometry version {version}")
+    body = zlib.decompress(data[HEADER.size:])
+    if kind == JSON:
+        return json.loads(body)
+    if kind == RAW:
+        points = np.frombuffer(body, dtype='<f8').reshape(-1, dims)
+    else:
+        zigzag = _from_varints(body)
+        deltas = (zigzag >> np.uint64(1)) ^ (np.uint64(0) - (zigzag & np.uint64(1)))
+        scaled = np.cumsum(deltas.view(np.int64).reshape(-1, dims), axis=0)
+        points = scaled / 10.0 ** decimals
+    return {'type': 'LineString', 'coordinates': points.tolist()}
+
+def get_many(digests):
+    """
+    {digest: geometry} for the given digests, decoding only the ones not
+    already cached (in a single query). The cached dicts are shared between
+    trips on the same lane: treat them as read-only.
+    """
+    now = time.monotonic()
+    found, missing = {}, set()
+    for digest in set(digests):
+        geometry = _cache.get(digest, now)
+        if geometry is None:
+            missing.add(digest)
+        else:
+            found[digest] = geometry
+    if found:
+        metrics.inc('cache_lookups_total', cache='route_geometry', result='hit')
+    if missing:
+        from ..models import RouteGeometry
+        metrics.inc('cache_lookups_total', cache='route_geometry', result='miss')
+        for digest, data in RouteGeometry.objects.filter(pk__in=missing).values_list('digest', 'data'):
+            found[digest] = decode(data)
+            _cache.set(digest, found[digest], float('inf'))
+    return found
+
+def get(digest):
+    return get_many([digest]).get(digest)
+
+def get_lod(digest):
+    """
+    The simplified levels stored with a line, or None when not built yet.
+    """
+    from ..models import RouteGeometry
+    return RouteGeometry.objects.filter(pk=digest).values_list('lod', flat=True).first()
+
+def prefetch(trips):
+    """
+    Load the route geometry of every trip in one query (cache misses only),
+    so that reading trip.route_geometry in a loop does not query per trip.
+    """
+    pending = [t for t in trips if '_route_geometry' not in t.__dict__ and t.geometry_id]
+    geometries = get_many([t.geometry_id for t in pending])
+    for trip in pending:
+        trip.__dict__['_route_geometry'] = geometries.get(trip.geometry_id)
+    return trips
+
+def with_geometries(trips, chunk_size=200):
+    """
+    Iterate trips (e.g. a queryset's .iterator()) with their geometries
+    prefetched a chunk at a time.
+    """
+    chunk = []
+    for trip in trips:
+        chunk.append(trip)
+        if len(chunk) == chunk_size:
+            yield from prefetch(chunk)
+            chunk = []
+    yield from prefetch(chunk)
+
+def store_trips(trips):
+    """
+    Write the pending route geometries of unsaved (or changed) trips to the
+    store and point the trips at them, with their LOD levels when set.
+    Lanes already stored are not rewritten. Returns the number of new
+    RouteGeometry rows.
+    """
+    from ..models import RouteGeometry
+    pending, encoded = [], {}
+    for trip in trips:
+        if not trip.geometry_pending:
+            continue
+        digest = None
+        if trip.route_geometry is not None:
+            digest, data, count = encode(trip.route_geometry)
+            lod = trip.__dict__.get('_route_lod')
+            encoded.setdefault(digest, RouteGeometry(digest=digest, data=data, points=count, lod=lod))
+        pending.append((trip, digest))
+
+    rows = []
+    if encoded:
+        # Marking reused rows used keeps a concurrent prune off them; any it
+        # deleted first are missing from the update and stored again
+        used = RouteGeometry.objects.filter(pk__in=list(encoded)).update(used_at=timezone.now())
+        if used < len(encoded):
+            existing = set(RouteGeometry.objects.filter(pk__in=list(encoded)).values_list('digest', flat=True))
+            rows = [row for digest, row in encoded.items() if digest not in existing]
+            RouteGeometry.objects.bulk_create(rows, batch_size=settings.ROUTE_GEOMETRY_INSERT_SIZE, ignore_conflicts=True)
+    for trip, digest in pending:
+        trip.geometry_stored(digest)
+    return len(rows)
+
+def backfill(batch_size=500, log=print):
+    """
+    Move trips saved before the store existed from their legacy JSON column
+    into it. Returns the number of trips moved.
+    """
+    from ..models import Trip
+    pending = Trip.objects.filter(geometry__isnull=True, legacy_geometry__isnull=False)
+    moved, last_id = 0, 0
+    while True:
+        batch = list(pending.filter(id__gt=last_id).only('id', 'geometry', 'legacy_geometry').order_by('id')[:batch_size])
+        if not batch:
+            return moved
+        for trip in batch:
+            trip.route_geometry = trip.legacy_geometry
+        created = store_trips(batch)
+        Trip.objects.bulk_update(batch, ['geometry', 'legacy_geometry'])
+        moved += len(batch)
+        last_id = batch[-1].id
+        log(f"Moved {moved} trips ({created} new geometries in this batch)")
+
+def prune(batch_size=500):
+    """
+    Delete the RouteGeometry rows no trip references any more (all of
+    their trips were deleted). Rows used within ROUTE_GEOMETRY_PRUNE_AGE
+    are kept: batch plans store lines before inserting their trips.
+    Returns the number of rows deleted.
+    """
+    from ..models import RouteGeometry, Trip
+    cutoff = timezone.now() - timedelta(seconds=settings.ROUTE_GEOMETRY_PRUNE_AGE)
+    orphans = RouteGeometry.objects.filter(~Exists(Trip.objects.filter(geometry=OuterRef('pk'))), used_at__lt=cutoff)
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            digests = list(orphans.select_for_update().values_list('digest', flat=True)[:batch_size])
+            if not digests:
+                return deleted
+            # Filtered again under the row locks: a plan may have reused a
+            # row (or saved a trip on it) since it was picked
+            deleted += orphans.filter(pk__in=digests).delete()[1].get(RouteGeometry._meta.label, 0)
+        for digest in digests:
+            _cache.discard(digest)
+
+def clear_cache():
+    _cache.clear()
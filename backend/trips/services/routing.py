@@ -1,10 +1,13 @@
 
-import requests
+import asyncio
 import re
 from math import radians, cos, sin, asin, sqrt
+import numpy as np
 from django.conf import settings
+from asgiref.sync import async_to_sync, sync_to_async
+from . import aors, geocache, metrics, ors, roadgraph, routecache
 
-ORS_BASE_URL = "https://api.openrouteservice.org"
+EARTH_RADIUS_MILES = 3956
 
 def haversine(lon1, lat1, lon2, lat2):
     """
@@ -17,42 +20,77 @@ def haversine(lon1, lat1, lon2, lat2):
     dlat = lat2 - lat1 
     a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
     c = 2 * asin(sqrt(a)) 
-    r = 3956 # Radius of earth in miles
-    return c * r
+    return c * EARTH_RADIUS_MILES
+
+class RouteIndex:
+    """
+    Cumulative-distance index over a LineString geometry.
+    Built once per route so that locating stops is a binary search
+    instead of a walk over every segment.
+    """
+    def __init__(self, geometry):
+        coords = geometry['coordinates'] if isinstance(geometry, dict) else geometry
+        points = np.asarray(coords, dtype=float) if coords else np.zeros((0, 2))
+        self.coords = points[:, :2]
+
+        if len(self.coords) < 2:
+            self.segment_miles = np.zeros(0)
+            self.cumulative_miles = np.zeros(1)
+            return
+
+        lon = np.radians(self.coords[:, 0])
+        lat = np.radians(self.coords[:, 1])
+        dlon = np.diff(lon)
+        dlat = np.diff(lat)
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+        self.segment_miles = 2 * np.arcsin(np.sqrt(a)) * EARTH_RADIUS_MILES
+        self.cumulative_miles = np.concatenate(([0.0], np.cumsum(self.segment_miles)))
+
+    @property
+    def total_miles(self):
+        return float(self.cumulative_miles[-1])
+
+    def locate(self, distance_miles):
+        return self.locate_many([distance_miles])[0]
+
+    def locate_many(self, distances):
+        """
+        Return [lon, lat] for every distance (miles from the route start).
+        Distances past the end of the line resolve to the last coordinate.
+        """
+        distances = np.asarray(distances, dtype=float)
+        if len(self.coords) < 2:
+            point = self.coords[0].tolist() if len(self.coords) else [0, 0]
+            return [list(point) for _ in range(len(distances))]
+
+        # First segment whose end lies at or beyond the requested distance,
+        # matching the original linear walk.
+        seg = np.searchsorted(self.cumulative_miles[1:], distances, side='left')
+        past_end = seg >= len(self.segment_miles)
+        seg = np.minimum(seg, len(self.segment_miles) - 1)
+
+        seg_len = self.segment_miles[seg]
+        remaining = distances - self.cumulative_miles[seg]
+        ratio = np.divide(remaining, seg_len, out=np.zeros_like(remaining), where=seg_len > 0)
+
+        p1 = self.coords[seg]
+        p2 = self.coords[seg + 1]
+        points = p1 + (p2 - p1) * ratio[:, None]
+        points[past_end] = self.coords[-1]
+        return points.tolist()
 
 def interpolate_along_route(geometry, distance_miles):
     """
     Find point at distance_miles along the LineString geometry.
     Geometry is GeoJSON dict or coordinate list.
+    For several stops on the same route build a RouteIndex once instead.
     """
-    coords = geometry['coordinates'] if isinstance(geometry, dict) else geometry
-    
-    if not coords or len(coords) < 2:
-        return coords[0] if coords else [0, 0]
-        
-    accumulated_dist = 0.0
-    
-    for i in range(len(coords) - 1):
-        p1 = coords[i]
-        p2 = coords[i+1]
-        
-        # p1 is [lon, lat]
-        dist_segment = haversine(p1[0], p1[1], p2[0], p2[1])
-        
-        if accumulated_dist + dist_segment >= distance_miles:
-            # Interpolate in this segment
-            remaining = distance_miles - accumulated_dist
-            ratio = remaining / dist_segment if dist_segment > 0 else 0
-            
-            lon = p1[0] + (p2[0] - p1[0]) * ratio
-            lat = p1[1] + (p2[1] - p1[1]) * ratio
-            return [lon, lat]
-            
-        accumulated_dist += dist_segment
-        
-    return coords[-1] # End of line
+    return RouteIndex(geometry).locate(distance_miles)
 
-def get_coords(address):
+NYC_FALLBACK = [-74.0060, 40.7128]
+
+def _local_coords(address):
+    # Coordinates resolvable without a geocoding call, else None
     # Check for "lat,lon" input
     latlon_match = re.match(r'^(-?\d+(\.\d+)?),\s*(-?\d+(\.\d+)?)$', address.strip())
     if latlon_match:
@@ -63,101 +101,266 @@ def get_coords(address):
     if not api_key or "YOUR" in api_key:
          if "mock" in address.lower() or "test" in address.lower():
              return [-118.2437, 34.0522]
+    return None
+
+def _parse_geocode(response):
+    response.raise_for_status()
+    data = response.json()
+    if data.get('features'):
+        return data['features'][0]['geometry']['coordinates']
+    return None
+
+def geocode(address):
+    """
+    Resolve an address to [lon, lat]. Returns (coords, fallback) where
+    fallback describes why the default location was used, else None.
+    """
+    local = _local_coords(address)
+    if local is not None:
+        return local, None
+    errors = []
     
-    url = f"{ORS_BASE_URL}/geocode/search"
-    params = {
-        "api_key": api_key,
-        "text": address,
-        "size": 1
-    }
-    
-    try:
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        if data.get('features'):
-            return data['features'][0]['geometry']['coordinates']
-    except Exception as e:
-        print(f"Geocoding error for {address}: {e}")
-        pass
-    
+    def fetch():
+        params = {
+            "text": address,
+            "size": 1
+        }
+
+        try:
+            return _parse_geocode(ors.get(ors.GEOCODE_SEARCH, params=params))
+        except Exception as e:
+            print(f"Geocoding error for {address}: {e}")
+            errors.append(str(e))
+        return None
+
+    coords = geocache.cached_lookup(geocache.SEARCH, address, fetch)
+    if coords is not None:
+        return coords, None
+
     # Fallback/Mock just to allow demo to proceed if key fails?
     # No, better fail or return mock coords if "demo".
-    return [-74.0060, 40.7128] # NYC Default fallback
+    return list(NYC_FALLBACK), _geocode_fallback(address, errors) # NYC Default fallback
 
-def get_route(start_addr, pickup_addr, dropoff_addr):
-    coords_start = get_coords(start_addr)
-    coords_pickup = get_coords(pickup_addr)
-    coords_dropoff = get_coords(dropoff_addr)
-    
-    api_key = settings.MAP_API_KEY
-    url = f"{ORS_BASE_URL}/v2/directions/driving-car/geojson"
-    
-    body = {
-        "coordinates": [coords_start, coords_pickup, coords_dropoff],
+def _geocode_fallback(address, errors):
+    reason = errors[0] if errors else "no match"
+    return f"geocode '{address}': {reason}; using the default location"
+
+def get_coords(address):
+    return geocode(address)[0]
+
+async def ageocode(address):
+    """
+    geocode for async views: the ORS call goes through the async client,
+    cache reads and writes run in a thread.
+    """
+    local = _local_coords(address)
+    if local is not None:
+        return local, None
+    errors = []
+
+    async def fetch():
+        try:
+            return _parse_geocode(await aors.get(ors.GEOCODE_SEARCH, params={"text": address, "size": 1}))
+        except Exception as e:
+            print(f"Geocoding error for {address}: {e}")
+            errors.append(str(e))
+        return None
+
+    coords = await geocache.acached_lookup(geocache.SEARCH, address, fetch)
+    if coords is not None:
+        return coords, None
+    return list(NYC_FALLBACK), _geocode_fallback(address, errors)
+
+def _directions_body(coordinates):
+    if not settings.MAP_API_KEY:
+        raise ValueError("MAP_API_KEY is not configured on the server")
+    return {
+        "coordinates": coordinates,
         "instructions": False,
         "maneuvers": False
     }
+
+def _parse_directions(response):
+    if response.status_code != 200:
+        error_data = response.json() if response.headers.get('Content-Type') == 'application/json' else response.text
+        print(f"ORS API ERROR: {response.status_code} - {error_data}")
+        raise Exception(f"Routing API error: {error_data}")
+    data = response.json()
     
-    headers = {
-        "Authorization": api_key,
-        "Content-Type": "application/json"
-    }
+    feature = data['features'][0]
+    props = feature['properties']
+    summary = props['summary']
+    segments = props.get('segments', [])
+    
+    dist_total_miles = summary['distance'] * 0.000621371
+    dur_total_hours = summary['duration'] / 3600.0
+    
+    leg_miles = [segment['distance'] * 0.000621371 for segment in segments] or [dist_total_miles]
+    seg1_miles = leg_miles[0]
+    seg2_miles = leg_miles[1] if len(leg_miles) > 1 else 0.0
     
+    return {
+        'distance_miles': round(dist_total_miles, 2),
+        'duration_hours': round(dur_total_hours, 2),
+        'geometry': feature['geometry'],
+        'segment1_miles': seg1_miles,
+        'segment2_miles': seg2_miles,
+        'leg_miles': leg_miles,
+    }
+
+def fetch_directions(coordinates):
+    """
+    POST the waypoint list to ORS directions and return the route summary.
+    Raises on any upstream or configuration error.
+    """
+    return _parse_directions(ors.post(ors.DIRECTIONS, json=_directions_body(coordinates)))
+
+async def afetch_directions(coordinates):
+    return _parse_directions(await aors.post(ors.DIRECTIONS, json=_directions_body(coordinates)))
+
+def fetch_matrix(coordinates):
+    """
+    One ORS matrix call for every pair of locations. Returns
+    {'distances': miles, 'durations': hours} as nested lists.
+    Raises on any upstream or configuration error.
+    """
+    if not settings.MAP_API_KEY:
+        raise ValueError("MAP_API_KEY is not configured on the server")
+
+    response = ors.post(ors.MATRIX, json={
+        "locations": coordinates,
+        "metrics": ["distance", "duration"],
+        "units": "mi",
+    })
+    if response.status_code != 200:
+        raise Exception(f"Matrix API error: {response.status_code} - {response.text[:500]}")
+    data = response.json()
+    return {
+        'distances': data['distances'],
+        'durations': [[seconds / 3600.0 if seconds is not None else None for seconds in row] for row in data['durations']],
+    }
+
+def get_matrix(coordinates):
+    """
+    Distance/duration matrix for stop ordering, cached like directions.
+    Falls back to straight-line distances at the mock 60 mph when ORS is
+    unavailable.
+    """
     try:
-        if not api_key:
-            raise ValueError("MAP_API_KEY is not configured on the server")
-            
-        response = requests.post(url, json=body, headers=headers, timeout=10)
-        
-        if response.status_code != 200:
-            error_data = response.json() if response.headers.get('Content-Type') == 'application/json' else response.text
-            print(f"ORS API ERROR: {response.status_code} - {error_data}")
-            raise Exception(f"Routing API error: {error_data}")
-        data = response.json()
-        
-        feature = data['features'][0]
-        props = feature['properties']
-        summary = props['summary']
-        segments = props.get('segments', [])
-        
-        dist_total_miles = summary['distance'] * 0.000621371
-        dur_total_hours = summary['duration'] / 3600.0
-        
-        seg1_miles = segments[0]['distance'] * 0.000621371 if len(segments) > 0 else dist_total_miles
-        seg2_miles = segments[1]['distance'] * 0.000621371 if len(segments) > 1 else 0.0
-        
-        return {
-            'distance_miles': round(dist_total_miles, 2),
-            'duration_hours': round(dur_total_hours, 2),
-            'geometry': feature['geometry'],
-            'segment1_miles': seg1_miles,
-            'segment2_miles': seg2_miles,
-            'start_coords': coords_start,
-            'pickup_coords': coords_pickup,
-            'dropoff_coords': coords_dropoff
-        }
-        
+        with metrics.timed('matrix'):
+            return routecache.cached_route(coordinates, lambda: fetch_matrix(coordinates), namespace='matrix')
     except Exception as e:
-        print(f"Routing API failed: {e}. Returning mock.")
-        return get_mock_route(coords_start, coords_pickup, coords_dropoff)
+        print(f"Matrix API failed: {e}. Using straight-line distances.")
+        fallback = f"matrix: {e}; stops ordered by straight-line distance"
+    distances = [[haversine(a[0], a[1], b[0], b[1]) for b in coordinates] for a in coordinates]
+    return {'distances': distances, 'durations': [[d / 60.0 for d in row] for row in distances], 'fallback': fallback}
+
+def get_route(start_addr, pickup_addr, dropoff_addr):
+    with metrics.timed('geocode'):
+        geocoded = [geocode(start_addr), geocode(pickup_addr), geocode(dropoff_addr)]
+    route = get_route_for_coords(*[coords for coords, _ in geocoded])
+    return with_fallbacks(route, [note for _, note in geocoded if note])
+
+def with_fallbacks(route, notes):
+    # Earlier degraded steps (e.g. geocoding) go first in route['fallbacks']
+    if notes:
+        route['fallbacks'] = list(notes) + route.get('fallbacks', [])
+    return route
+
+async def aget_route(start_addr, pickup_addr, dropoff_addr):
+    """
+    get_route for async views: the three addresses are geocoded
+    concurrently. Directions keep the sync cache and its cross-worker lease
+    (in a thread), but the ORS call itself runs on this event loop.
+    """
+    with metrics.timed('geocode'):
+        geocoded = await asyncio.gather(ageocode(start_addr), ageocode(pickup_addr), ageocode(dropoff_addr))
+    route_in_thread = sync_to_async(get_route_for_coords)
+    route = await route_in_thread(*[coords for coords, _ in geocoded], fetch=async_to_sync(afetch_directions))
+    return with_fallbacks(route, [note for _, note in geocoded if note])
+
+def get_route_for_coords(coords_start, coords_pickup, coords_dropoff, fetch=None):
+    route = get_route_for_waypoints([coords_start, coords_pickup, coords_dropoff], fetch)
+    route.update({
+        'start_coords': coords_start,
+        'pickup_coords': coords_pickup,
+        'dropoff_coords': coords_dropoff
+    })
+    return route
+
+def get_route_for_waypoints(waypoints, fetch=None):
+    """
+    One directions call through every waypoint, in order. 'leg_miles' holds
+    the distance between each consecutive pair. fetch replaces
+    fetch_directions for the upstream call.
 
-def get_mock_route(start, pickup, dropoff):
-    # Mock route: Line Start -> Pickup -> Dropoff
+    'source' says which backend answered ('ors', 'offline' or 'mock') and
+    'fallbacks' lists why a preferred backend was skipped.
+    """
+    fetch = fetch or fetch_directions
+    route = None
+    fallbacks = []
+
+    if settings.ROUTING_BACKEND != 'offline':
+        try:
+            with metrics.timed('directions'):
+                route = routecache.cached_route(waypoints, lambda: fetch(waypoints))
+            route['source'] = 'ors'
+        except Exception as e:
+            print(f"Routing API failed: {e}")
+            fallbacks.append(f"directions: {e}")
+
+    if route is None:
+        route = get_offline_route(waypoints)
+        if route is not None:
+            route['source'] = 'offline'
+    if route is None:
+        print("No route available. Returning mock.")
+        route = get_mock_route(*waypoints)
+        fallbacks.append("directions: no road route available; using straight lines between stops")
+
+    # Entries cached before leg_miles existed only know the first two legs
+    route.setdefault('leg_miles', [route['segment1_miles'], route['segment2_miles']])
+    route['fallbacks'] = fallbacks
+    return route
+
+def get_offline_route(waypoints):
+    """
+    Route over the local road graph (ROAD_GRAPH_PATH). Returns None when no
+    graph is configured or the waypoints can't be connected on it.
+    """
+    graph = roadgraph.get_graph()
+    if graph is None:
+        return None
+    try:
+        with metrics.timed('directions_offline'):
+            return graph.route(waypoints)
+    except roadgraph.NoRoute as e:
+        print(f"Offline routing failed: {e}")
+        return None
+
+def get_mock_route(*waypoints):
+    # Mock route: straight lines through the waypoints (Start -> Pickup -> Dropoff)
     # Distances approximate
-    d1 = haversine(start[0], start[1], pickup[0], pickup[1])
-    d2 = haversine(pickup[0], pickup[1], dropoff[0], dropoff[1])
+    legs = [haversine(a[0], a[1], b[0], b[1]) for a, b in zip(waypoints, waypoints[1:])]
+    total = sum(legs)
     
-    return {
-        'distance_miles': round(d1 + d2, 2),
-        'duration_hours': round((d1+d2)/60.0, 2),
+    route = {
+        'distance_miles': round(total, 2),
+        'duration_hours': round(total/60.0, 2),
         'geometry': {
             "type": "LineString",
-            "coordinates": [start, pickup, dropoff] # Just 3 points
+            "coordinates": list(waypoints) # Just the waypoints
         },
-        'segment1_miles': d1,
-        'segment2_miles': d2,
-        'start_coords': start,
-        'pickup_coords': pickup,
-        'dropoff_coords': dropoff
+        'segment1_miles': legs[0] if legs else 0.0,
+        'segment2_miles': legs[1] if len(legs) > 1 else 0.0,
+        'leg_miles': legs,
+        'source': 'mock',
     }
+    if len(waypoints) == 3:
+        route.update({
+            'start_coords': waypoints[0],
+            'pickup_coords': waypoints[1],
+            'dropoff_coords': waypoints[2]
+        })
+    return route
@@ -0,0 +1,82 @@
+
+# Stop ordering for multi-stop plans: an open path from the start (index 0)
+# through every stop, minimizing matrix cost. Nearest neighbour builds a
+# feasible tour, then 2-opt (reverse a run) and or-opt (move a run of 1-3
+# stops) improve it. Every move is checked against the pickup-before-dropoff
+# precedence pairs.
+
+def path_cost(order, cost):
+    return sum(cost[a][b] for a, b in zip(order, order[1:]))
+
+def is_feasible(order, precedence):
+    """
+    precedence maps a dropoff index to the pickup index it must follow.
+    """
+    position = {stop: i for i, stop in enumerate(order)}
+    return all(position[pickup] < position[dropoff] for dropoff, pickup in precedence.items())
+
+def stop_precedence(stops):
+    """
+    {dropoff index: pickup index} for shipment pairs; indices count the
+    start location as 0, so stop i is index i + 1.
+    """
+    pickups = {s['shipment']: i + 1 for i, s in enumerate(stops) if s['type'] == 'pickup' and 'shipment' in s}
+    return {
+        i + 1: pickups[s['shipment']]
+        for i, s in enumerate(stops) if s['type'] == 'dropoff' and 'shipment' in s
+    }
+
+def nearest_neighbour(cost, precedence):
+    n = len(cost)
+    order, visited = [0], {0}
+    while len(order) < n:
+        current = order[-1]
+        candidates = [
+            stop for stop in range(1, n)
+            if stop not in visited and precedence.get(stop, 0) in visited
+        ]
+        nxt = min(candidates, key=lambda stop: cost[current][stop])
+        order.append(nxt)
+        visited.add(nxt)
+    return order
+
+def _two_opt(order, cost, precedence):
+    best = path_cost(order, cost)
+    for i in range(1, len(order) - 1):
+        for j in range(i + 1, len(order)):
+            candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+            candidate_cost = path_cost(candidate, cost)
+            if candidate_cost < best - 1e-9 and is_feasible(candidate, precedence):
+                return candidate, candidate_cost
+    return None
+
+def _or_opt(order, cost, precedence):
+    best = path_cost(order, cost)
+    for length in (1, 2, 3):
+        for i in range(1, len(order) - length + 1):
+            run = order[i:i + length]
+            rest = order[:i] + order[i + length:]
+            for j in range(1, len(rest) + 1):
+                if j == i:
+                    continue
+                candidate = rest[:j] + run + rest[j:]
+                candidate_cost = path_cost(candidate, cost)
+                if candidate_cost < best - 1e-9 and is_feasible(candidate, precedence):
+                    return candidate, candidate_cost
+    return None
+
+def order_stops(cost, precedence=None, max_rounds=1000):
+    """
+    Visiting order (list of matrix indices, starting with 0) for the square
+    cost matrix. Unreachable pairs may be None and are treated as infinite.
+    """
+    precedence = precedence or {}
+    cost = [[float('inf') if c is None else c for c in row] for row in cost]
+    order = nearest_neighbour(cost, precedence)
+
+    for _ in range(max_rounds):
+        improved = _two_opt(order, cost, precedence) or _or_opt(order, cost, precedence)
+        if improved is None:
+            break
+        order = improved[0]
+    return order
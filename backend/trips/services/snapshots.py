@@ -0,0 +1,193 @@
+
+import gzip
+import hashlib
+import uuid
+from django.conf import settings
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+from ..lazy import lazy_import
+from ..models import RenderedRoute, RouteGeometry, TripSnapshot
+from ..serializers import TripSerializer
+from .lod_levels import FULL
+
+# Only needed to build a snapshot, never to serve one
+geometry = lazy_import('trips.services.geometry')
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip is always available
+    brotli = None
+
+# Stands in for the route line in shared-geometry snapshot bodies; rendered
+# JSON never holds a raw NUL byte
+SHARED_GEOMETRY = b'\x00'
+SERVE_COMPRESS_LEVEL = 6            # gzip / brotli level for bodies assembled per response
+
+def lod_for(trip):
+    # Lanes stored before LOD levels existed get them built on first use
+    # (and rows not yet moved to the store, every time)
+    if trip.route_lod is None and trip.route_geometry is not None:
+        trip.route_lod = geometry.build_lod(trip.route_geometry)
+        if trip.geometry_id:
+            RouteGeometry.objects.filter(pk=trip.geometry_id, lod__isnull=True).update(lod=trip.route_lod)
+    return trip.route_lod
+
+def route_line(trip, level=FULL):
+    """
+    The route geometry of a detail body at this level, or None.
+    """
+    if level == FULL:
+        return trip.route_geometry
+    lod = lod_for(trip)
+    return {'type': 'LineString', 'coordinates': lod[level]['coordinates']} if lod else None
+
+def snap_markers(markers, coords):
+    snapped = geometry.snap_to_line([[m['lon'], m['lat']] for m in markers], coords)
+    return [dict(m, lon=point[0], lat=point[1]) for m, point in zip(markers, snapped)]
+
+def detail_data(trip, fields=None, level=FULL):
+    """
+    TripDetailView's body: the serializer fields (all when None), with the
+    route geometry and markers on the requested level's simplified line.
+    """
+    fields = list(fields or TripSerializer().fields)
+    simplified = level != FULL
+    if simplified:
+        data = TripSerializer(trip, fields=[f for f in fields if f != 'route_geometry']).data
+    else:
+        data = TripSerializer(trip, fields=fields).data
+
+    if 'route_geometry' in fields or 'markers' in fields:
+        if simplified:
+            line = route_line(trip, level)
+            if 'route_geometry' in fields:
+                data['route_geometry'] = line
+            if 'markers' in fields and line is not None:
+                data['markers'] = snap_markers(trip.markers or [], line['coordinates'])
+        data['route_detail'] = level
+    return data
+
+def render_detail(trip, level=FULL):
+    """
+    The exact body TripDetailView returns for a plain GET at this ?detail= level.
+    """
+    return JSONRenderer().render(detail_data(trip, level=level))
+
+def snapshot_levels():
+    # Built when a trip is saved; other levels are built on first request
+    return settings.TRIP_SNAPSHOT_LEVELS
+
+def build_snapshot(trip, level=FULL):
+    data = detail_data(trip, level=level)
+    if trip.geometry_id and data.get('route_geometry') is not None:
+        # Every trip on the lane has the same line: store the body around it
+        # and take the line from the lane's RenderedRoute when serving.
+        renderer, token = JSONRenderer(), uuid.uuid4().hex
+        line = renderer.render(data['route_geometry'])
+        data['route_geometry'] = token
+        prefix, suffix = renderer.render(data).split(f'"{token}"'.encode('utf-8'), 1)
+        body = prefix + line + suffix
+        gzip_body, brotli_body = gzip.compress(prefix + SHARED_GEOMETRY + suffix, compresslevel=9, mtime=0), None
+        shared = True
+    else:
+        body = JSONRenderer().render(data)
+        gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        brotli_body = brotli.compress(body) if brotli else None
+        shared = False
+    return TripSnapshot(
+        trip=trip,
+        detail=level,
+        etag=hashlib.sha256(body).hexdigest(),
+        gzip_body=gzip_body,
+        brotli_body=brotli_body,
+        size=len(body),
+        shared_geometry=shared,
+    )
+
+def share_geometries(trips, levels):
+    """
+    Store the rendered line of each trip's lane at each level, once per
+    lane, for the shared-geometry snapshots built from it.
+    """
+    lanes = {trip.geometry_id: trip for trip in trips if trip.geometry_id}
+    if not lanes:
+        return 0
+    stored = set(
+        RenderedRoute.objects.filter(geometry__in=list(lanes), detail__in=levels).values_list('geometry_id', 'detail')
+    )
+    rows = []
+    for digest, trip in lanes.items():
+        for level in levels:
+            line = route_line(trip, level) if (digest, level) not in stored else None
+            if line is not None:
+                body = gzip.compress(JSONRenderer().render(line), compresslevel=9, mtime=0)
+                rows.append(RenderedRoute(geometry_id=digest, detail=level, body=body))
+    RenderedRoute.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+def store_snapshot(trip, levels=None):
+    return store_snapshots([trip], levels)
+
+def store_snapshots(trips, levels=None):
+    levels = levels or snapshot_levels()
+    share_geometries(trips, levels)
+    # ignore_conflicts: a concurrent request may have stored the same trip first
+    snapshots = [build_snapshot(trip, level) for trip in trips for level in levels]
+    return TripSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+
+def stored_body(stored, shared, encoding):
+    """
+    (body, Content-Encoding or None) of the stored snapshot row in the
+    chosen encoding. Shared-geometry bodies are put back together with the
+    lane's line at the snapshot's level and compressed for this response.
+    """
+    if not shared:
+        column = 'brotli_body' if encoding == 'br' else 'gzip_body'
+        body = bytes(stored.values_list(column, flat=True).get())
+        if encoding == 'identity':
+            return gzip.decompress(body), None
+        return body, encoding
+
+    rendered = stored.filter(trip__geometry__renderings__detail=F('detail'))
+    template, line = rendered.values_list('gzip_body', 'trip__geometry__renderings__body').get()
+    body = gzip.decompress(template).replace(SHARED_GEOMETRY, gzip.decompress(line), 1)
+    if encoding == 'br':
+        return brotli.compress(body, quality=SERVE_COMPRESS_LEVEL), encoding
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=SERVE_COMPRESS_LEVEL, mtime=0), encoding
+    return body, None
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    if brotli and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return 'identity'
+
+def etag_for(digest, encoding):
+    # Strong validators must differ per Content-Encoding
+    return f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+
+def etag_matches(if_none_match, digest):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"').split('-')[0] == digest:
+            return True
+    return False
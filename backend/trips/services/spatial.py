@@ -0,0 +1,184 @@
+
+# "Trips near a point" / "trips through a box" without PostGIS. Every saved
+# trip gets one TripRouteCell row per grid cell its route passes through;
+# a query turns its search area into row-wise cell ranges (plain indexed
+# integer lookups on SQLite and PostgreSQL alike), then checks only those
+# candidates' geometries exactly.
+
+from itertools import islice
+from math import cos, radians
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Min, Q
+from django.db.models.functions import Abs, Greatest
+from ..models import ROUTE_GEOMETRY_COLUMNS, Trip, TripRouteCell
+from .geometry import GRID_ROW_STRIDE, as_points, densify, grid_cells
+from .routestore import prefetch, with_geometries
+from .routing import haversine
+
+CELL_DEGREES = 0.25                 # ~17 mi of latitude; changing it needs a reindex
+MILES_PER_DEGREE = 69.0
+REFINE_CHUNK_SIZE = 200             # candidates whose lines are loaded and checked at a time
+
+def route_cells(geometry):
+    """
+    Sorted keys of every grid cell the LineString passes through (sampled
+    every half cell, so every point of the line is within a quarter cell of
+    a sample in each coordinate).
+    """
+    samples = densify(geometry, CELL_DEGREES / 2)
+    if not len(samples):
+        return []
+    rows, cols = grid_cells(samples[:, 0], samples[:, 1], CELL_DEGREES)
+    return np.unique(rows * GRID_ROW_STRIDE + cols).tolist()
+
+def index_trips(trips):
+    # ignore_conflicts: re-indexing a trip (or a concurrent save) is harmless
+    rows = [TripRouteCell(trip=trip, cell=cell) for trip in trips for cell in route_cells(trip.route_geometry)]
+    TripRouteCell.objects.bulk_create(rows, batch_size=settings.ROUTE_CELL_INSERT_SIZE, ignore_conflicts=True)
+    return len(rows)
+
+def index_trip(trip):
+    return index_trips([trip])
+
+def _cell_filter(min_lon, min_lat, max_lon, max_lat):
+    # One key range per grid row: cells of a row are consecutive integers
+    (row_lo, row_hi), (col_lo, col_hi) = grid_cells([min_lon, max_lon], [min_lat, max_lat], CELL_DEGREES)
+    condition = Q()
+    for row in range(int(row_lo), int(row_hi) + 1):
+        condition |= Q(cell__range=(row * GRID_ROW_STRIDE + int(col_lo), row * GRID_ROW_STRIDE + int(col_hi)))
+    return condition
+
+def candidate_cells(min_lon, min_lat, max_lon, max_lat):
+    """
+    TripRouteCell rows near the box: every trip whose route enters the box
+    has at least one of them.
+    """
+    margin = CELL_DEGREES / 4
+    return TripRouteCell.objects.filter(_cell_filter(min_lon - margin, min_lat - margin, max_lon + margin, max_lat + margin))
+
+def candidate_ids(min_lon, min_lat, max_lon, max_lat):
+    """
+    Ids of trips with a route cell near the box. Every trip whose route
+    enters the box is included; the caller refines exactly.
+    """
+    return candidate_cells(min_lon, min_lat, max_lon, max_lat).values_list('trip_id', flat=True).distinct()
+
+def distance_to_route(geometry, lon, lat):
+    """
+    Miles from [lon, lat] to the closest point of the LineString: the
+    closest point is found in a local projection around the query point,
+    its distance is then measured on the sphere.
+    """
+    points = as_points(geometry)
+    if not len(points):
+        return None
+    scale = cos(radians(lat))
+    xy = (points - [lon, lat]) * [scale, 1.0]
+    if len(xy) == 1:
+        closest = points[0]
+    else:
+        start, direction = xy[:-1], np.diff(xy, axis=0)
+        length_sq = np.einsum('ij,ij->i', direction, direction)
+        t = np.divide(-np.einsum('ij,ij->i', start, direction), length_sq,
+                      out=np.zeros(len(start)), where=length_sq > 0)
+        t = np.clip(t, 0.0, 1.0)
+        projected = start + t[:, None] * direction
+        best = int(np.argmin(np.einsum('ij,ij->i', projected, projected)))
+        closest = points[best] + t[best] * (points[best + 1] - points[best])
+    return haversine(lon, lat, float(closest[0]), float(closest[1]))
+
+def crosses_box(geometry, min_lon, min_lat, max_lon, max_lat):
+    """
+    True when any part of the LineString lies inside the box
+    (Liang-Barsky clipping of every segment at once).
+    """
+    points = as_points(geometry)
+    if not len(points):
+        return False
+    if len(points) == 1:
+        points = np.vstack((points, points))
+    start, delta = points[:-1], np.diff(points, axis=0)
+    t0, t1 = np.zeros(len(start)), np.ones(len(start))
+    for p, q in (
+        (-delta[:, 0], start[:, 0] - min_lon), (delta[:, 0], max_lon - start[:, 0]),
+        (-delta[:, 1], start[:, 1] - min_lat), (delta[:, 1], max_lat - start[:, 1]),
+    ):
+        parallel = p == 0
+        outside = parallel & (q < 0)
+        ratio = np.divide(q, p, out=np.zeros_like(q), where=~parallel)
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, ratio), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, ratio), t1)
+        t1 = np.where(outside, -1.0, t1)
+    return bool((t0 <= t1).any())
+
+def trips_near(lon, lat, radius_miles, limit, fields=()):
+    """
+    Trips whose route passes within radius_miles of [lon, lat], closest
+    first, as (trip, distance in miles) pairs.
+    """
+    reach_lat = radius_miles / MILES_PER_DEGREE
+    scale = max(cos(radians(min(abs(lat) + reach_lat, 89.9))), 1e-6)  # east-west miles per degree, worst case
+    reach_lon = reach_lat / scale
+    cells = candidate_cells(lon - reach_lon, lat - reach_lat, lon + reach_lon, lat + reach_lat)
+
+    # Candidates ranked by their closest route cell's ring around the query
+    # cell, grouped and ordered by the database and read as needed
+    row, col = (int(v) for v in grid_cells(lon, lat, CELL_DEGREES))
+    cell_row = F('cell') / GRID_ROW_STRIDE
+    ring = Greatest(Abs(cell_row - row), Abs(F('cell') - cell_row * GRID_ROW_STRIDE - col))
+    ranked = cells.values('trip_id').annotate(ring=Min(ring)).order_by('ring', 'trip_id').values_list('trip_id', 'ring')
+
+    # A trip `ring` cells out is at least ring - 1 whole cells away, less
+    # the quarter cell its line may stray from its cells
+    cell_miles = CELL_DEGREES * MILES_PER_DEGREE * scale
+
+    found = []
+    rows = ranked.iterator(chunk_size=REFINE_CHUNK_SIZE)
+    while True:
+        chunk = list(islice(rows, REFINE_CHUNK_SIZE))
+        if not chunk:
+            break
+        nearest = max(chunk[0][1] - 1.25, 0) * cell_miles
+        if nearest > radius_miles or (len(found) >= limit and found[limit - 1][1] < nearest):
+            break
+        trips = Trip.objects.filter(id__in=[trip_id for trip_id, _ in chunk]).only('id', *ROUTE_GEOMETRY_COLUMNS, *fields)
+        for trip in prefetch(list(trips)):
+            distance = distance_to_route(trip.route_geometry, lon, lat)
+            if distance is not None and distance <= radius_miles:
+                found.append((trip, distance))
+        found.sort(key=lambda pair: (pair[1], pair[0].id))
+    return found[:limit]
+
+def trips_within(min_lon, min_lat, max_lon, max_lat, limit, fields=()):
+    """
+    Newest trips whose route passes through the box.
+    """
+    ids = candidate_ids(min_lon, min_lat, max_lon, max_lat)
+    qs = Trip.objects.filter(id__in=ids).only('id', *ROUTE_GEOMETRY_COLUMNS, *fields).order_by('-created_at', '-id')
+    found = []
+    for trip in with_geometries(qs.iterator(chunk_size=200)):
+        if crosses_box(trip.route_geometry, min_lon, min_lat, max_lon, max_lat):
+            found.append(trip)
+            if len(found) == limit:
+                break
+    return found
+
+def backfill(batch_size=500, log=print):
+    """
+    Index trips that have no route cells yet (saved before the index
+    existed). Returns the number of trips indexed.
+    """
+    pending = Trip.objects.filter(Q(geometry__isnull=False) | Q(legacy_geometry__isnull=False)).exclude(
+        id__in=TripRouteCell.objects.values('trip_id')
+    )
+    indexed, last_id = 0, 0
+    while True:
+        batch = list(pending.filter(id__gt=last_id).only('id', *ROUTE_GEOMETRY_COLUMNS).order_by('id')[:batch_size])
+        prefetch(batch)
+        if not batch:
+            return indexed
+        cells = index_trips(batch)
+        indexed += len(batch)
+        last_id = batch[-1].id
+        log(f"Indexed {indexed} trips ({cells} cells in this batch)")
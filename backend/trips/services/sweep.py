@@ -0,0 +1,141 @@
+
+# Departure-time / cycle-hours sweep: the ELDSimulator state machine run for
+# many scenarios at once. Every scenario is one slot in a set of NumPy
+# arrays; each loop iteration advances all unfinished scenarios by one
+# duty event (drive chunk, fuel, 10h rest, 34h restart or stop dwell), so
+# the loop count is that of the longest single simulation, not the number
+# of scenarios. Results match ELDSimulator.simulate_legs exactly.
+
+import numpy as np
+from .eld_engine import (
+    CYCLE_LIMIT, CYCLE_RESTART, DUTY_WINDOW, FUEL_INTERVAL_MILES, FUEL_STOP, MAX_DRIVING,
+    MINUTES_PER_DAY, REST_BREAK, miles_to_minutes, start_minute,
+)
+
+def sweep(legs, departure_hours, cycle_used):
+    """
+    Simulate every (departure hour, cycle hours used) pair for the same
+    legs ([(miles, dwell_minutes), ...]). departure_hours and cycle_used are
+    broadcast against each other. Returns a dict of equally long arrays.
+    """
+    departure_hours, cycle_used = np.broadcast_arrays(
+        np.asarray(departure_hours, dtype=float), np.asarray(cycle_used, dtype=float)
+    )
+    departure_hours, cycle_used = departure_hours.ravel(), cycle_used.ravel()
+    size = len(departure_hours)
+
+    drive_minutes = np.array([miles_to_minutes(miles) for miles, _ in legs] + [0], dtype=np.int64)
+    dwell_minutes = np.array([dwell for _, dwell in legs] + [0], dtype=np.int64)
+    fuel_interval = miles_to_minutes(FUEL_INTERVAL_MILES)
+
+    start = np.array([start_minute(hour) for hour in departure_hours], dtype=np.int64)
+    now = start.copy()
+    window_start = start.copy()
+    shift = np.zeros(size, dtype=np.int64)
+    since_fuel = np.zeros(size, dtype=np.int64)
+    cycle = np.clip(np.round(np.nan_to_num(cycle_used) * 60).astype(np.int64), 0, CYCLE_LIMIT)
+    leg = np.zeros(size, dtype=np.int64)
+    remaining = np.full(size, drive_minutes[0])
+    done = np.full(size, len(legs) == 0)
+
+    rests = np.zeros(size, dtype=np.int64)
+    restarts = np.zeros(size, dtype=np.int64)
+    fuel_stops = np.zeros(size, dtype=np.int64)
+    on_duty = np.zeros(size, dtype=np.int64)
+
+    def rest(mask):
+        now[mask] += REST_BREAK
+        shift[mask] = 0
+        window_start[mask] = now[mask]
+        rests[mask] += 1
+
+    def restart(mask):
+        now[mask] += CYCLE_RESTART
+        cycle[mask] = 0
+        shift[mask] = 0
+        window_start[mask] = now[mask]
+        restarts[mask] += 1
+
+    def make_room(mask, minutes):
+        # ELDSimulator._make_room: on-duty work that would run past the 70h
+        # cycle waits for a 34h restart, past the 14h window for a 10h rest
+        over_cycle = mask & (cycle + minutes > CYCLE_LIMIT)
+        restart(over_cycle)
+        rest(mask & ~over_cycle & (now - window_start + minutes > DUTY_WINDOW))
+
+    while not done.all():
+        active = ~done
+        driving = active & (remaining > 0)
+        at_stop = active & (remaining <= 0)
+
+        # Driving: restart, rest or one chunk up to the next limit
+        cycle_left = CYCLE_LIMIT - cycle
+        drive_left = MAX_DRIVING - shift
+        window_left = window_start + DUTY_WINDOW - now
+        restarting = driving & (cycle_left <= 0)
+        needs_rest = driving & ~restarting & ((drive_left <= 0) | (window_left <= 0))
+        go = driving & ~restarting & ~needs_rest
+
+        restart(restarting)
+        rest(needs_rest)
+
+        chunk = np.minimum.reduce([remaining, drive_left, window_left, fuel_interval - since_fuel, cycle_left])
+        chunk = np.where(go, chunk, 0)
+        now += chunk
+        shift += chunk
+        since_fuel += chunk
+        remaining -= chunk
+        cycle += chunk
+        on_duty += chunk
+
+        refuel = go & (since_fuel >= fuel_interval)
+        make_room(refuel, FUEL_STOP)
+        now[refuel] += FUEL_STOP
+        cycle[refuel] += FUEL_STOP
+        on_duty[refuel] += FUEL_STOP
+        since_fuel[refuel] = 0
+        fuel_stops[refuel] += 1
+
+        # Leg finished: dwell at the stop (after a restart or rest if it
+        # would overrun the cycle or window), then start the next leg
+        dwell = np.where(at_stop, dwell_minutes[leg], 0)
+        make_room(at_stop & (dwell > 0), dwell)
+        now += dwell
+        cycle += dwell
+        on_duty += dwell
+
+        leg[at_stop] += 1
+        done |= at_stop & (leg >= len(legs))
+        remaining[at_stop] = drive_minutes[np.minimum(leg[at_stop], len(legs))]
+
+    return {
+        'departure_minute': start,
+        'cycle_used': cycle_used,
+        'arrival_minute': now,
+        'rests': rests,
+        'restarts': restarts,
+        'fuel_stops': fuel_stops,
+        'on_duty_minutes': on_duty,
+    }
+
+def scenarios(result):
+    """
+    Per-scenario dicts for the API, in sweep order.
+    """
+    rows = []
+    for i in range(len(result['arrival_minute'])):
+        departure = int(result['departure_minute'][i])
+        arrival = int(result['arrival_minute'][i])
+        day, minute = divmod(arrival, MINUTES_PER_DAY)
+        rows.append({
+            'departure_hour': round(departure / 60.0, 2),
+            'cycle_used': float(result['cycle_used'][i]),
+            'arrival_hour': round(arrival / 60.0, 2),
+            'arrival': f"Day {day + 1} {minute // 60:02d}:{minute % 60:02d}",
+            'trip_hours': round((arrival - departure) / 60.0, 2),
+            'rests': int(result['rests'][i]),
+            'restarts': int(result['restarts'][i]),
+            'fuel_stops': int(result['fuel_stops'][i]),
+            'on_duty_hours': round(int(result['on_duty_minutes'][i]) / 60.0, 2),
+        })
+    return rows
@@ -1,10 +1,48 @@
 
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import xml.etree.ElementTree as ElementTree
+import zipfile
+import numpy as np
+import time
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from unittest.mock import patch
-from .models import Trip
+from unittest.mock import AsyncMock, MagicMock, patch
+from .lazy import lazy_import
+from .models import (
+    Trip, CircuitState, GeocodeCacheEntry, PlanJob, RenderedRoute, RouteCacheEntry, RouteGeometry, TripRouteCell, TripSnapshot
+)
+from .services import (
+    aors, breaker, geocache, jobs, logsheets, metrics, ors, planner, poi, roadgraph, routecache, routestore, spatial, sweep
+)
+from .services.eld_engine import ELDSimulator, generate_eld_logs, generate_leg_logs
+from .services.planner import build_trip, plan_fingerprint, save_trip, stream_trip
+from .services.snapshots import render_detail, store_snapshots
+from .services.sequencing import is_feasible, nearest_neighbour, order_stops, path_cost
+from .benchmarks import coldstart, suite
+from .views import trip_fields
+from .benchmarks.stub_ors import StubORSServer, fake_coords
+from .services.geometry import LOD_LEVELS, build_lod, select_level, snap_to_line
+from .services.routing import (
+    RouteIndex, get_coords, get_mock_route, get_route, get_route_for_coords, haversine, interpolate_along_route
+)
 
 class TripPlanTests(TestCase):
     def setUp(self):
@@ -24,7 +62,7 @@ class TripPlanTests(TestCase):
             'dropoff_coords': [20,20]
         }
 
-    @patch('trips.views.get_route')
+    @patch('trips.services.routing.get_route')
     def test_plan_trip_success(self, mock_get_route):
         mock_get_route.return_value = self.mock_route_data
         
@@ -57,7 +95,7 @@ class TripPlanTests(TestCase):
         self.assertIn('DROPOFF', types)
         self.assertIn('FUEL', types)
 
-    @patch('trips.views.get_route')
+    @patch('trips.services.routing.get_route')
     def test_plan_trip_api_fail(self, mock_get_route):
         mock_get_route.side_effect = Exception("API Error")
         
@@ -68,3 +106,1755 @@ class TripPlanTests(TestCase):
         }
         response = self.client.post(self.url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class RouteIndexTests(TestCase):
+    def setUp(self):
+        self.geometry = {
+            "type": "LineString",
+            "coordinates": [[0, 0], [0, 1], [1, 1], [1, 1], [2, 3]]
+        }
+
+    def reference_walk(self, coords, distance_miles):
+        # The original per-stop linear walk, kept here as the oracle.
+        accumulated = 0.0
+        for p1, p2 in zip(coords, coords[1:]):
+            seg = haversine(p1[0], p1[1], p2[0], p2[1])
+            if accumulated + seg >= distance_miles:
+                ratio = (distance_miles - accumulated) / seg if seg > 0 else 0
+                return [p1[0] + (p2[0] - p1[0]) * ratio, p1[1] + (p2[1] - p1[1]) * ratio]
+            accumulated += seg
+        return coords[-1]
+
+    def test_locate_many_matches_linear_walk(self):
+        index = RouteIndex(self.geometry)
+        distances = [0.0, 10.0, 69.0, 100.0, 150.0, index.total_miles, index.total_miles + 50]
+        located = index.locate_many(distances)
+        for distance, point in zip(distances, located):
+            expected = self.reference_walk(self.geometry['coordinates'], distance)
+            self.assertAlmostEqual(point[0], expected[0], places=9)
+            self.assertAlmostEqual(point[1], expected[1], places=9)
+
+    def test_degenerate_geometry(self):
+        self.assertEqual(interpolate_along_route({"coordinates": []}, 5), [0, 0])
+        self.assertEqual(RouteIndex([[3, 4]]).locate_many([1, 2]), [[3, 4], [3, 4]])
+
+class GeocodeCacheTests(TestCase):
+    def setUp(self):
+        geocache.clear_local()
+
+    def fake_response(self, coords):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'features': [{'geometry': {'coordinates': coords}}]}
+        return response
+
+    @patch('trips.services.ors.get')
+    def test_repeat_lookup_served_from_cache(self, mock_get):
+        mock_get.return_value = self.fake_response([-87.6, 41.8])
+
+        self.assertEqual(get_coords('Chicago, IL'), [-87.6, 41.8])
+        # Normalized key: case and whitespace differences still hit
+        self.assertEqual(get_coords('  chicago,   il '), [-87.6, 41.8])
+        self.assertEqual(mock_get.call_count, 1)
+
+        # Shared tier survives a cold in-process cache (e.g. another worker)
+        geocache.clear_local()
+        self.assertEqual(get_coords('Chicago, IL'), [-87.6, 41.8])
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(GeocodeCacheEntry.objects.get().hits, 1)
+
+    @patch('trips.services.ors.get')
+    def test_failures_are_not_cached(self, mock_get):
+        mock_get.side_effect = Exception("timeout")
+        get_coords('Nowhere')
+        get_coords('Nowhere')
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertFalse(GeocodeCacheEntry.objects.exists())
+
+    def test_expired_entries_miss_and_purge(self):
+        geocache.store(geocache.SEARCH, 'Dallas', [-96.8, 32.8], ttl=-1)
+        self.assertIsNone(geocache.lookup(geocache.SEARCH, 'Dallas'))
+        self.assertEqual(geocache.purge(), 1)
+
+    @override_settings(GEOCODE_CACHE_MAX_ENTRIES=2)
+    def test_eviction_keeps_table_bounded(self):
+        for i in range(4):
+            geocache.store(geocache.SEARCH, f'place {i}', [i, i])
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 2)
+        self.assertTrue(GeocodeCacheEntry.objects.filter(query='place 3').exists())
+
+class RouteCacheTests(TestCase):
+    def setUp(self):
+        self.waypoints = [[-87.6298, 41.8781], [-90.1994, 38.6270], [-97.5164, 35.4676]]
+        self.route = {
+            'distance_miles': 800.0,
+            'duration_hours': 13.0,
+            'geometry': {"type": "LineString", "coordinates": self.waypoints},
+            'segment1_miles': 300.0,
+            'segment2_miles': 500.0,
+        }
+
+    def test_hit_on_rounded_coordinates(self):
+        fetch = MagicMock(return_value=self.route)
+        routecache.cached_route(self.waypoints, fetch)
+        jittered = [[lon + 1e-6, lat - 1e-6] for lon, lat in self.waypoints]
+        self.assertEqual(routecache.cached_route(jittered, fetch), self.route)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(routecache.table_stats()['total_hits'], 1)
+
+    def test_failures_release_the_lease(self):
+        fetch = MagicMock(side_effect=[Exception("503"), self.route])
+        with self.assertRaises(Exception):
+            routecache.cached_route(self.waypoints, fetch)
+        self.assertFalse(RouteCacheEntry.objects.exists())
+        self.assertEqual(routecache.cached_route(self.waypoints, fetch), self.route)
+
+    def test_abandoned_lease_is_taken_over(self):
+        past = timezone.now() - timedelta(seconds=1)
+        RouteCacheEntry.objects.create(
+            key=routecache.make_key(self.waypoints), coordinates=self.waypoints,
+            status=routecache.PENDING, lease_expires_at=past, expires_at=past
+        )
+        fetch = MagicMock(return_value=self.route)
+        self.assertEqual(routecache.cached_route(self.waypoints, fetch), self.route)
+        self.assertEqual(RouteCacheEntry.objects.get().status, routecache.READY)
+
+    def test_concurrent_requests_coalesce_in_process(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_load(key, coordinates, fetch):
+            calls.append(key)
+            release.wait(5)
+            return self.route
+
+        with patch('trips.services.routecache._load_or_fetch', side_effect=slow_load):
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(routecache.cached_route(self.waypoints, None)))
+                       for _ in range(5)]
+            for t in threads:
+                t.start()
+            time.sleep(0.1)
+            release.set()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [self.route] * 5)
+
+    @patch('trips.services.routing.fetch_directions')
+    def test_get_route_uses_cache(self, mock_fetch):
+        mock_fetch.return_value = self.route
+        addresses = [f"{lat},{lon}" for lon, lat in self.waypoints]
+        first = get_route(*addresses)
+        second = get_route(*addresses)
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second['pickup_coords'], self.waypoints[1])
+
+class ORSClientTests(TestCase):
+    def tearDown(self):
+        ors.reset_session()
+
+    @override_settings(ORS_POOL_SIZE=7, ORS_MAX_RETRIES=4)
+    def test_single_pooled_session_per_process(self):
+        ors.reset_session()
+        session = ors.get_session()
+        self.assertIs(ors.get_session(), session)
+        adapter = session.get_adapter('https://api.openrouteservice.org')
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter.max_retries.total, 4)
+        self.assertEqual(adapter.max_retries.read, 0)
+
+    @override_settings(ORS_BASE_URL='http://ors.local', MAP_API_KEY='key-123')
+    def test_requests_carry_base_url_key_and_timeouts(self):
+        with patch.object(ors.get_session(), 'get') as mock_get:
+            ors.get(ors.GEOCODE_SEARCH, params={'text': 'x'})
+        args, kwargs = mock_get.call_args
+        self.assertEqual(args[0], 'http://ors.local/geocode/search')
+        self.assertEqual(kwargs['headers']['Authorization'], 'key-123')
+        self.assertEqual(kwargs['timeout'][1], 5)
+
+    @patch('trips.services.ors.get')
+    def test_location_search_goes_through_client_and_cache(self, mock_get):
+        geocache.clear_local()
+        mock_get.return_value = MagicMock(status_code=200)
+        mock_get.return_value.json.return_value = {'features': [
+            {'properties': {'label': 'Denver, CO'}, 'geometry': {'coordinates': [-104.99, 39.74]}}
+        ]}
+        url = reverse('location-search')
+        first = self.client.get(url, {'q': 'Denv'})
+        second = self.client.get(url, {'q': 'denv'})
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_get.call_args[0][0], ors.GEOCODE_AUTOCOMPLETE)
+
+class TripPlanBatchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('trip-plan-batch')
+
+    def fake_route(self, start, pickup, dropoff):
+        return get_mock_route(start, pickup, dropoff)
+
+    @patch('trips.services.planner.get_route_for_coords')
+    def test_batch_dedupes_lanes_and_bulk_inserts(self, mock_route):
+        mock_route.side_effect = self.fake_route
+        lane = {"start_location": "41.87,-87.62", "pickup_location": "38.62,-90.19", "dropoff_location": "35.46,-97.51"}
+        other = dict(lane, dropoff_location="32.77,-96.79")
+        payload = [lane, dict(lane, current_cycle_used=20.0), other, {"start_location": "A"}]
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (3, 1))
+        self.assertIn('details', body['results'][3])
+        self.assertEqual(mock_route.call_count, 2)  # two distinct lanes
+        self.assertEqual(Trip.objects.count(), 3)
+        trip = Trip.objects.get(pk=body['results'][1]['id'])
+        self.assertEqual(trip.current_cycle_used, 20.0)
+        self.assertTrue(trip.eld_logs)
+
+    @patch('trips.services.planner.get_route_for_coords')
+    def test_per_item_errors_do_not_fail_the_batch(self, mock_route):
+        mock_route.side_effect = [Exception("boom")]
+        payload = {'trips': [{"start_location": "1,1", "pickup_location": "2,2", "dropoff_location": "3,3"}]}
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('boom', response.json()['results'][0]['error'])
+        self.assertFalse(Trip.objects.exists())
+
+    @override_settings(PLAN_BATCH_MAX_ITEMS=1)
+    def test_rejects_oversized_batches(self):
+        response = self.client.post(self.url, [{}, {}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class PlanJobTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.data = {"start_location": "A", "pickup_location": "B", "dropoff_location": "C", "current_cycle_used": 5.0}
+
+    def route(self, *addresses):
+        return get_mock_route([0, 0], [5, 5], [10, 10])
+
+    @patch('trips.services.planner.get_route')
+    def test_async_plan_returns_202_and_worker_completes_job(self, mock_get_route):
+        mock_get_route.side_effect = self.route
+        response = self.client.post(reverse('trip-plan'), self.data, format='json', HTTP_PREFER='respond-async')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['status'], PlanJob.QUEUED)
+        self.assertFalse(Trip.objects.exists())
+        status_url = reverse('plan-job-detail', args=[response.json()['id']])
+        self.assertTrue(response['Location'].endswith(status_url))
+
+        job = jobs.process_next('test-worker')
+        self.assertEqual(job.status, PlanJob.SUCCEEDED)
+        self.assertIsNone(jobs.process_next('test-worker'))
+
+        polled = self.client.get(status_url).json()
+        self.assertEqual(polled['status'], PlanJob.SUCCEEDED)
+        self.assertEqual(polled['result']['id'], Trip.objects.get().id)
+        self.assertEqual(polled['result']['current_cycle_used'], 5.0)
+
+    @patch('trips.services.planner.get_route')
+    def test_failed_job_records_error(self, mock_get_route):
+        mock_get_route.side_effect = Exception("ORS down")
+        job = jobs.enqueue(self.data)
+        jobs.process_next('test-worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanJob.FAILED)
+        self.assertIn('ORS down', job.error)
+
+    def test_claim_is_exclusive_and_stale_jobs_requeue(self):
+        job = jobs.enqueue(self.data)
+        self.assertEqual(jobs.claim_next('w1').id, job.id)
+        self.assertIsNone(jobs.claim_next('w2'))
+
+        PlanJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(60), (1, 0))
+        self.assertEqual(jobs.claim_next('w2').attempts, 2)
+
+class PlanWorkerTests(TransactionTestCase):
+    # The worker command's threads use their own connections
+    data = {"start_location": "A", "pickup_location": "B", "dropoff_location": "C"}
+
+    @override_settings(PLAN_JOB_STALE_SECONDS=0.2, PLAN_JOB_REQUEUE_INTERVAL=0.1)
+    def test_running_worker_recovers_jobs_of_a_worker_that_died(self):
+        orphaned = jobs.enqueue(self.data)
+        self.assertEqual(jobs.claim_next('dead-worker').id, orphaned.id)  # ... which then dies
+        queued = jobs.enqueue(self.data)
+
+        def slow_plan(data):
+            time.sleep(1.0)  # the orphaned job goes stale meanwhile
+
+        with patch('trips.services.jobs.plan_trip', side_effect=slow_plan):
+            call_command('plan_worker', concurrency=1, once=True, poll_interval=0.05, stdout=io.StringIO())
+        for job in (orphaned, queued):
+            job.refresh_from_db()
+            self.assertEqual(job.status, PlanJob.SUCCEEDED)
+        self.assertEqual(orphaned.attempts, 2)
+        self.assertNotEqual(orphaned.worker, 'dead-worker')
+
+class ELDEngineTests(TestCase):
+    def totals(self, logs):
+        totals = {}
+        for day in logs:
+            for entry in day['logs']:
+                totals[entry['status']] = round(totals.get(entry['status'], 0) + entry['end'] - entry['start'], 2)
+        return totals
+
+    def test_single_shift_trip(self):
+        result = generate_eld_logs({'segment1_miles': 100, 'segment2_miles': 50}, 0)
+        self.assertEqual(result['stops'], [])
+        self.assertEqual(result['logs'], [{
+            'day': 1, 'date': 'Day 1', 'logs': [
+                {'status': 'OFF', 'start': 0.0, 'end': 8.0},
+                {'status': 'DRIVING', 'start': 8.0, 'end': 9.67},
+                {'status': 'ON', 'start': 9.67, 'end': 10.67},
+                {'status': 'DRIVING', 'start': 10.67, 'end': 11.5},
+                {'status': 'ON', 'start': 11.5, 'end': 12.5},
+                {'status': 'OFF', 'start': 12.5, 'end': 24.0},
+            ]
+        }])
+
+    def test_drive_window_and_fuel_limits(self):
+        result = generate_eld_logs({'segment1_miles': 1500, 'segment2_miles': 1300}, 0)
+        self.assertEqual(
+            [(s['type'], round(s['distance_miles'])) for s in result['stops']],
+            [('REST', 660), ('FUEL', 1000), ('REST', 1320), ('REST', 1980), ('FUEL', 2000), ('REST', 2640)]
+        )
+        self.assertEqual([d['day'] for d in result['logs']], [1, 2, 3, 4, 5])
+        for day in result['logs']:
+            self.assertEqual(day['logs'][0]['start'], 0.0)
+            self.assertEqual(day['logs'][-1]['end'], 24.0)
+        self.assertEqual(self.totals(result['logs'])['DRIVING'], 46.67)
+
+    def test_cycle_used_forces_34h_restart(self):
+        fresh = generate_eld_logs({'segment1_miles': 600, 'segment2_miles': 600}, 0)
+        tired = generate_eld_logs({'segment1_miles': 600, 'segment2_miles': 600}, 65)
+        self.assertNotIn('RESTART', [s['type'] for s in fresh['stops']])
+        self.assertEqual(tired['stops'][0], {'type': 'RESTART', 'distance_miles': 300.0})
+        self.assertGreaterEqual(self.totals(tired['logs'])['OFF'], 34)
+
+    def test_on_duty_stop_near_cycle_limit_restarts_first(self):
+        # 69.5h used: the 30 min drive to the pickup reaches the limit, so
+        # its hour of loading has to wait for a 34h restart
+        result = generate_leg_logs([(30, 60), (30, 60)], 69.5)
+        self.assertEqual(result['stops'], [{'type': 'RESTART', 'distance_miles': 30.0}])
+        first_on = min((day['day'] - 1) * 24 + e['start'] for day in result['logs'] for e in day['logs'] if e['status'] == 'ON')
+        self.assertGreaterEqual(first_on, 8.5 + 34)
+
+    def test_cycle_limit_is_never_exceeded(self):
+        for cycle_used in (0, 60, 68, 69.5, 70):
+            for legs in ([(30, 60), (30, 60)], [(700, 600)], [(950, 60), (40, 300), (1200, 60)]):
+                sim = ELDSimulator(cycle_used)
+                add_log = sim.add_log
+
+                def checked(status, minutes):
+                    add_log(status, minutes)
+                    self.assertLessEqual(sim.cycle_used, 70 * 60, (cycle_used, legs))
+
+                sim.add_log = checked
+                sim.simulate_legs(legs)
+
+    def test_multi_week_trip_scales_with_events(self):
+        result = generate_eld_logs({'segment1_miles': 15000, 'segment2_miles': 15000}, 0)
+        self.assertGreater(len(result['logs']), 50)
+        self.assertEqual(round(self.totals(result['logs'])['DRIVING']), 500)
+        # No more than a handful of entries per day regardless of trip length
+        self.assertLessEqual(max(len(d['logs']) for d in result['logs']), 8)
+
+class RouteLODTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        # A wiggly 2,000-point line heading east
+        xs = np.linspace(-100, -90, 2000)
+        ys = 35 + 0.00005 * np.sin(np.arange(2000)) + 0.5 * np.sin(xs / 2)
+        self.geometry = {'type': 'LineString', 'coordinates': np.column_stack([xs, ys]).tolist()}
+
+    def make_trip(self, **kwargs):
+        return Trip.objects.create(
+            start_location='A', pickup_location='B', dropoff_location='C',
+            route_geometry=self.geometry,
+            markers=[{'type': 'FUEL', 'lat': 35.3, 'lon': -95.0, 'metadata': {'distance_miles': 300}}],
+            **kwargs
+        )
+
+    def test_simplify_keeps_endpoints_and_tolerance(self):
+        coords = self.geometry['coordinates']
+        lod = build_lod(self.geometry)
+        sizes = [len(lod[name]['coordinates']) for name, _ in LOD_LEVELS]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertLess(sizes[-1], len(coords) / 10)
+        for level in lod.values():
+            self.assertEqual(level['coordinates'][0], coords[0])
+            self.assertEqual(level['coordinates'][-1], coords[-1])
+
+    def test_detail_level_and_markers_on_simplified_line(self):
+        trip = self.make_trip()
+        url = reverse('trip-detail', args=[trip.pk])
+
+        full = self.client.get(url).json()
+        self.assertEqual(full['route_detail'], 'full')
+        self.assertEqual(len(full['route_geometry']['coordinates']), 2000)
+
+        low = self.client.get(url, {'detail': 'low'}).json()
+        coords = low['route_geometry']['coordinates']
+        self.assertLess(len(coords), 200)
+        marker = low['markers'][0]
+        self.assertEqual(snap_to_line([[marker['lon'], marker['lat']]], coords)[0], [marker['lon'], marker['lat']])
+
+        # Levels built lazily for older rows are persisted
+        trip.refresh_from_db()
+        self.assertIn('low', trip.route_lod)
+
+    def test_tolerance_selects_coarsest_level_within_it(self):
+        self.assertEqual(select_level(tolerance=0.005), 'medium')
+        self.assertEqual(select_level(tolerance=0.00001), 'full')
+        response = self.client.get(reverse('trip-detail', args=[self.make_trip().pk]), {'detail': 'bogus'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class TripSparseFieldsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.trip = Trip.objects.create(
+            start_location='A', pickup_location='B', dropoff_location='C', distance_miles=10.0,
+            route_geometry={'type': 'LineString', 'coordinates': [[0, 0], [0.5, 0.5001], [1, 1]]},
+            eld_logs=[{'day': 1, 'date': 'Day 1', 'logs': []}],
+            markers=[{'type': 'START', 'lat': 0, 'lon': 0, 'label': 'Start'}],
+        )
+
+    def test_fields_param_trims_response_and_query(self):
+        url = reverse('trip-detail', args=[self.trip.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'distance_miles,start_location'})
+        self.assertEqual(response.json(), {'id': self.trip.pk, 'start_location': 'A', 'distance_miles': 10.0})
+        sql = queries.captured_queries[0]['sql']
+        self.assertNotIn('geometry', sql)
+        self.assertNotIn('eld_logs', sql)
+
+    def test_unknown_field_rejected(self):
+        response = self.client.get(reverse('trip-detail', args=[self.trip.pk]), {'fields': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sub_resource_endpoints(self):
+        logs = self.client.get(reverse('trip-logs', args=[self.trip.pk])).json()
+        self.assertEqual(set(logs), {'id', 'eld_logs'})
+        markers = self.client.get(reverse('trip-markers', args=[self.trip.pk])).json()
+        self.assertEqual(set(markers), {'id', 'markers', 'route_detail'})
+
+        # Simplified levels are built once (loading the full line) and persisted ...
+        geometry = self.client.get(reverse('trip-geometry', args=[self.trip.pk]), {'detail': 'overview'}).json()
+        self.assertEqual(geometry['route_geometry']['coordinates'], [[0, 0], [1, 1]])
+        # ... after which the full route geometry is never read.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('trip-geometry', args=[self.trip.pk]), {'detail': 'overview'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"data"', queries.captured_queries[0]['sql'])
+        self.assertNotIn('legacy_geometry', queries.captured_queries[0]['sql'])
+
+class TripSnapshotTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    @patch('trips.services.routing.get_route')
+    def test_detail_served_from_precompressed_snapshot(self, mock_get_route):
+        mock_get_route.return_value = get_mock_route([0, 0], [5, 5], [10, 10])
+        created = self.client.post(reverse('trip-plan'), {
+            "start_location": "A", "pickup_location": "B", "dropoff_location": "C"
+        }, format='json').json()
+        url = reverse('trip-detail', args=[created['id']])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(len(queries), 2)  # etag lookup + body; no Trip row load
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(body, dict(created, route_detail='full'))
+
+        not_modified = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+
+        plain = self.client.get(url, HTTP_ACCEPT_ENCODING='identity')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(plain.content), body)
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+    @patch('trips.services.routing.get_route')
+    def test_detail_levels_have_their_own_snapshots(self, mock_get_route):
+        mock_get_route.return_value = get_mock_route([0, 0], [5, 5], [10, 10])
+        created = self.client.post(reverse('trip-plan'), {
+            "start_location": "A", "pickup_location": "B", "dropoff_location": "C"
+        }, format='json').json()
+        url = reverse('trip-detail', args=[created['id']])
+        # The frontend's request (getTrip asks for ?detail=high) is pre-rendered at save time
+        self.assertEqual(
+            set(TripSnapshot.objects.filter(trip_id=created['id']).values_list('detail', flat=True)), {'full', 'high'}
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'detail': 'high'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(len(queries), 2)  # etag lookup + body; no Trip row load
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(body['route_detail'], 'high')
+        live = self.client.get(url, {'detail': 'high', 'fields': ','.join(trip_fields())}).json()
+        self.assertEqual(body, live)
+        self.assertNotEqual(response['ETag'], self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')['ETag'])
+
+        not_modified = self.client.get(url, {'detail': 'high'}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+        # Other levels are rendered once, on their first request
+        overview = self.client.get(url, {'detail': 'overview'})
+        self.assertEqual(json.loads(overview.content)['route_detail'], 'overview')
+        self.assertTrue(TripSnapshot.objects.filter(trip_id=created['id'], detail='overview').exists())
+        self.assertEqual(self.client.get(url, {'detail': 'nope'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_snapshot_built_on_demand_for_older_trips(self):
+        trip = Trip.objects.create(start_location='A', pickup_location='B', dropoff_location='C')
+        response = self.client.get(reverse('trip-detail', args=[trip.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['id'], trip.pk)
+        self.assertTrue(TripSnapshot.objects.filter(trip=trip).exists())
+        self.assertEqual(self.client.get(reverse('trip-detail', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+class TripListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('trip-list')
+        base = timezone.now() - timedelta(days=10)
+        for i in range(7):
+            trip = Trip.objects.create(
+                start_location='Chicago' if i % 2 else 'Denver', pickup_location='B', dropoff_location='C',
+                distance_miles=100.0 * i, route_geometry={'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]},
+                eld_logs=[], markers=[]
+            )
+            # Two trips share a timestamp to exercise the id tie-breaker
+            Trip.objects.filter(pk=trip.pk).update(created_at=base + timedelta(days=min(i, 5)))
+
+    def test_keyset_pages_cover_every_trip_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            with CaptureQueriesContext(connection) as queries:
+                body = self.client.get(self.url, params).json()
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('geometry', queries.captured_queries[0]['sql'])
+            self.assertNotIn('eld_logs', queries.captured_queries[0]['sql'])
+            seen.extend(row['id'] for row in body['results'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+        expected = list(Trip.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_filters(self):
+        body = self.client.get(self.url, {'start_location': 'Chicago', 'min_distance': 200}).json()
+        self.assertEqual(sorted(r['distance_miles'] for r in body['results']), [300.0, 500.0])
+        self.assertNotIn('route_geometry', body['results'][0])
+
+        since = (timezone.now() - timedelta(days=6)).date().isoformat()
+        body = self.client.get(self.url, {'created_after': since}).json()
+        self.assertEqual(len(body['results']), 3)
+
+    def test_bad_cursor_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'created_after': 'soon'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+class PlanIdempotencyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('trip-plan')
+        self.data = {"start_location": "Chicago, IL", "pickup_location": "St Louis", "dropoff_location": "Dallas", "current_cycle_used": 12}
+
+    def route(self, *addresses):
+        return get_mock_route([0, 0], [5, 5], [10, 10])
+
+    @patch('trips.services.routing.get_route')
+    def test_identical_request_reuses_trip(self, mock_get_route):
+        mock_get_route.side_effect = self.route
+        first = self.client.post(self.url, self.data, format='json')
+        retry = self.client.post(self.url, dict(self.data, start_location='  chicago,  IL'), format='json')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(mock_get_route.call_count, 1)
+
+        changed = self.client.post(self.url, dict(self.data, current_cycle_used=13), format='json')
+        self.assertEqual(changed.status_code, status.HTTP_201_CREATED)
+
+    @patch('trips.services.routing.get_route')
+    def test_idempotency_key(self, mock_get_route):
+        mock_get_route.side_effect = self.route
+        first = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+        again = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+        self.assertEqual(again.json()['id'], first.json()['id'])
+
+        other = self.client.post(self.url, dict(self.data, dropoff_location='Austin'), format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+        self.assertEqual(other.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @patch('trips.services.routing.get_route')
+    def test_concurrent_duplicate_loses_insert_race(self, mock_get_route):
+        mock_get_route.side_effect = self.route
+        winner = build_trip(self.data, self.route())
+        winner.save()
+        # The losing request checked before the winner committed; the
+        # lookup after its failed insert sees the winner
+        lookups = [lambda *args: None, planner.find_existing]
+        with patch('trips.services.planner.find_existing', side_effect=lambda *args: lookups.pop(0)(*args)) as lookup:
+            response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['id'], winner.id)
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def lose_race(self):
+        # The lookup before planning misses (the winner had not committed);
+        # the one after the failed insert sees the winner
+        lookups = [lambda *args: None, planner.find_existing]
+        return patch('trips.services.planner.find_existing', side_effect=lambda *args: lookups.pop(0)(*args))
+
+    @patch('trips.services.routing.get_route')
+    def test_key_reused_for_different_request_loses_insert_race(self, mock_get_route):
+        mock_get_route.side_effect = self.route
+        build_trip(self.data, self.route(), idempotency_key='k-race').save()
+        other = dict(self.data, dropoff_location='Austin')
+
+        with self.lose_race():
+            response = self.client.post(self.url, other, format='json', HTTP_IDEMPOTENCY_KEY='k-race')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(response.json(), {'error': 'Idempotency-Key was already used for a different trip request'})
+
+        with self.lose_race():
+            streamed = self.client.post(self.url, other, format='json', HTTP_IDEMPOTENCY_KEY='k-race', HTTP_ACCEPT='application/x-ndjson')
+        last = json.loads(b''.join(streamed.streaming_content).splitlines()[-1])
+        self.assertEqual(last, {'event': 'error', 'error': 'Idempotency-Key was already used for a different trip request'})
+
+        stops = {'start_location': 'A', 'stops': [{'location': 'B', 'type': 'pickup'}, {'location': 'C', 'type': 'dropoff'}]}
+        with self.lose_race(), \
+                patch('trips.services.planner.plan_multi_stop', return_value=build_trip(other, self.route(), idempotency_key='k-race')):
+            multi = self.client.post(reverse('trip-plan-multi'), stops, format='json', HTTP_IDEMPOTENCY_KEY='k-race')
+        self.assertEqual(multi.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Trip.objects.count(), 1)
+
+    @patch('trips.services.planner.get_route_for_coords')
+    def test_batch_reuses_existing_and_in_batch_duplicates(self, mock_route):
+        mock_route.side_effect = lambda *w: get_mock_route(*w)
+        lane = {"start_location": "1,1", "pickup_location": "2,2", "dropoff_location": "3,3"}
+        existing = build_trip(lane, get_mock_route([1, 1], [2, 2], [3, 3]))
+        existing.save()
+
+        other = dict(lane, current_cycle_used=30)
+        body = self.client.post(reverse('trip-plan-batch'), [lane, other, other], format='json').json()
+        ids = [r['id'] for r in body['results']]
+        self.assertEqual(ids[0], existing.id)
+        self.assertEqual(ids[1], ids[2])
+        self.assertEqual(Trip.objects.count(), 2)
+        self.assertEqual(mock_route.call_count, 1)
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        metrics.reset()
+
+    @patch('trips.services.routing.get_route')
+    def test_server_timing_header_lists_stages(self, mock_get_route):
+        mock_get_route.return_value = get_mock_route([0, 0], [5, 5], [10, 10])
+        response = self.client.post(reverse('trip-plan'), {
+            "start_location": "A", "pickup_location": "B", "dropoff_location": "C"
+        }, format='json')
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        for stage in ('eld', 'markers', 'db_insert', 'serialize', 'total'):
+            self.assertIn(stage, stages)
+
+    @patch('trips.services.ors.get')
+    def test_prometheus_endpoint(self, mock_get):
+        geocache.clear_local()
+        mock_get.return_value = MagicMock(status_code=200)
+        mock_get.return_value.json.return_value = {'features': [{'geometry': {'coordinates': [1, 2]}}]}
+        get_coords('Reno')
+        get_coords('Reno')
+        with metrics.timed('eld'):
+            pass
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('trip_stage_seconds_count{stage="eld"} 1', text)
+        self.assertIn('cache_lookups_total{cache="geocode",result="miss"} 1', text)
+        self.assertIn('cache_hit_ratio{cache="geocode"} 0.5', text)
+
+    def dump(self, directory, pid, count):
+        path = os.path.join(directory, f'metrics-{pid}.json')
+        with open(path, 'w') as fh:
+            json.dump({
+                'counters': [['ors_responses_total', {'endpoint': '/x', 'status': '200'}, count]],
+                'histograms': [],
+            }, fh)
+        return path
+
+    def test_worker_dumps_are_merged(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(METRICS_MULTIPROC_DIR=tmp):
+            metrics.inc('ors_responses_total', endpoint='/x', status=200)
+            self.dump(tmp, os.getppid(), 4)  # another live worker
+            text = metrics.render_prometheus()
+        self.assertIn('ors_responses_total{endpoint="/x",status="200"} 5', text)
+
+    def test_dumps_of_finished_workers_are_archived(self):
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        with tempfile.TemporaryDirectory() as tmp, override_settings(METRICS_MULTIPROC_DIR=tmp):
+            metrics.inc('ors_responses_total', endpoint='/x', status=200)
+            stale = self.dump(tmp, dead.pid, 40)
+            text = metrics.render_prometheus()
+            self.assertFalse(os.path.exists(stale))
+            # Counters never go down when a worker goes away, nor count twice
+            self.assertIn('ors_responses_total{endpoint="/x",status="200"} 41', text)
+            self.assertEqual(metrics.render_prometheus(), text)
+
+            # A worker exiting cleanly hands its totals over the same way
+            metrics._archive_own_dump(os.getpid(), metrics._flush_path())
+            metrics.reset()
+            metrics.inc('ors_responses_total', endpoint='/x', status=200)
+            self.assertIn('ors_responses_total{endpoint="/x",status="200"} 42', metrics.render_prometheus())
+
+    def test_label_values_are_escaped(self):
+        metrics.inc('ors_responses_total', endpoint='/a"b\\c\nd', status=200)
+        text = metrics.render_prometheus()
+        self.assertIn('ors_responses_total{endpoint="/a\\"b\\\\c\\nd",status="200"} 1', text)
+
+class BenchmarkSuiteTests(TestCase):
+    def test_compare_flags_regressions_over_threshold(self):
+        baseline = {'results': {'a': {'median_ms': 10.0}, 'b': {'median_ms': 10.0}, 'gone': {'median_ms': 1.0}}}
+        current = {'results': {'a': {'median_ms': 12.0}, 'b': {'median_ms': 13.0}, 'new': {'median_ms': 1.0}}}
+        rows = suite.compare(current, baseline, threshold=0.25)
+        self.assertEqual([(case, regressed) for case, _, _, _, regressed in rows], [('a', False), ('b', True)])
+
+    def test_stub_ors_serves_the_real_client(self):
+        geocache.clear_local()
+        with StubORSServer(points_per_leg=50) as stub, \
+                override_settings(ORS_BASE_URL=stub.url, MAP_API_KEY='bench'):
+            route = get_route('Stub start', 'Stub pickup', 'Stub dropoff')
+        ors.reset_session()
+        self.assertEqual(len(route['geometry']['coordinates']), 99)  # 2 legs x 50 points, shared pickup vertex
+        self.assertAlmostEqual(route['segment1_miles'] + route['segment2_miles'], route['distance_miles'], places=1)
+        self.assertEqual(route['start_coords'], fake_coords('Stub start'))
+        self.assertEqual(stub.requests, 4)  # three geocodes + one directions call
+
+    def test_eld_and_interpolation_groups_run(self):
+        report = suite.run_suite(repeat=1, quick=True, only={'eld', 'interpolate'})
+        self.assertIn('eld_simulate/10000mi', report['results'])
+        self.assertIn('interpolate/10000pts', report['results'])
+
+def write_grid_osm(path, size=6, step=0.01, origin=(-100.0, 35.0)):
+    """
+    size x size residential grid; the bottom row is a fast oneway (eastbound)
+    primary road.
+    """
+    nodes, ways = [], []
+    node_id = lambda r, c: r * size + c + 1
+    for r in range(size):
+        for c in range(size):
+            nodes.append(f'<node id="{node_id(r, c)}" lon="{origin[0] + c * step}" lat="{origin[1] + r * step}"/>')
+
+    def way(way_id, refs, **tags):
+        nds = ''.join(f'<nd ref="{ref}"/>' for ref in refs)
+        tag_xml = ''.join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+        ways.append(f'<way id="{way_id}">{nds}{tag_xml}</way>')
+
+    way(1, [node_id(0, c) for c in range(size)], highway='primary', oneway='yes', maxspeed='55 mph')
+    for r in range(1, size):
+        way(10 + r, [node_id(r, c) for c in range(size)], highway='residential')
+    for c in range(size):
+        way(100 + c, [node_id(r, c) for r in range(size)], highway='residential')
+    way(999, [node_id(1, 1), node_id(2, 2)], highway='footway')  # not drivable
+
+    with open(path, 'w') as fh:
+        fh.write('<?xml version="1.0"?><osm version="0.6">' + ''.join(nodes + ways) + '</osm>')
+
+class OfflineRoutingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        osm_path = os.path.join(cls.tmp.name, 'grid.osm')
+        cls.graph_path = os.path.join(cls.tmp.name, 'grid.npz')
+        write_grid_osm(osm_path)
+        roadgraph.build_graph(osm_path, cls.graph_path, landmarks=3, log=lambda *_: None)
+
+    @classmethod
+    def tearDownClass(cls):
+        roadgraph.reset()
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.graph = roadgraph.RoadGraph(self.graph_path)
+        self.waypoints = [[-100.0, 35.0], [-99.95, 35.0], [-99.95, 35.05]]
+
+    def test_astar_matches_dijkstra(self):
+        indptr = np.array(self.graph.indptr)
+        targets = np.array(self.graph.targets)
+        seconds = np.array(self.graph.seconds)
+        for source in range(0, len(self.graph), 7):
+            exact = roadgraph._dijkstra(indptr, targets, seconds, source)
+            for target in range(0, len(self.graph), 5):
+                _, travel, _ = self.graph.shortest_path(source, target)
+                self.assertAlmostEqual(travel, exact[target], places=6)
+
+    def test_osm_parse_frees_elements_as_it_goes(self):
+        seen = []
+        for elem in roadgraph._stream(os.path.join(self.tmp.name, 'grid.osm')):
+            self.assertIsNotNone(elem.get('id'))
+            seen.append(elem)
+        self.assertIn('node', {elem.tag for elem in seen})
+        self.assertTrue(all(len(elem) == 0 and not elem.attrib for elem in seen))
+
+    def test_nearest_node_matches_linear_scan(self):
+        rng = np.random.default_rng(3)
+        points = np.column_stack((rng.uniform(-100.3, -99.7, 200), rng.uniform(34.7, 35.3, 200)))
+        points = np.vstack((points, [[-80.0, 40.0], [-100.0, 35.0]]))  # far away, exactly on a node
+        x = self.graph.lon * self.graph._scale
+        for lon, lat in points.tolist():
+            d2 = (x - lon * self.graph._scale) ** 2 + (self.graph.lat - lat) ** 2
+            node, miles = self.graph.nearest_node(lon, lat)
+            self.assertAlmostEqual(d2[node], d2.min(), places=12)
+            self.assertAlmostEqual(miles, haversine(lon, lat, self.graph.lon[node], self.graph.lat[node]), delta=0.01 + miles * 0.001)
+
+    def test_oneway_roads_are_respected(self):
+        west, _ = self.graph.nearest_node(-100.0, 35.0)
+        east, _ = self.graph.nearest_node(-99.95, 35.0)
+        forward, _, _ = self.graph.shortest_path(west, east)
+        backward, _, _ = self.graph.shortest_path(east, west)
+        self.assertEqual(len(forward), 6)  # straight along the primary road
+        self.assertGreater(len(backward), 6)  # has to detour through the grid
+
+    @patch('trips.services.routing.fetch_directions')
+    def test_offline_backend_skips_ors(self, mock_fetch):
+        with override_settings(ROUTING_BACKEND='offline', ROAD_GRAPH_PATH=self.graph_path):
+            route = get_route_for_coords(*self.waypoints)
+        mock_fetch.assert_not_called()
+        self.assertGreater(len(route['geometry']['coordinates']), 3)
+        self.assertAlmostEqual(route['segment1_miles'] + route['segment2_miles'], route['distance_miles'], places=1)
+        self.assertAlmostEqual(route['segment1_miles'], haversine(-100.0, 35.0, -99.95, 35.0), delta=0.05)
+        self.assertEqual(route['pickup_coords'], self.waypoints[1])
+
+    @patch('trips.services.routing.fetch_directions', side_effect=Exception("ORS down"))
+    def test_ors_failure_falls_back_to_graph_then_mock(self, mock_fetch):
+        with override_settings(ROAD_GRAPH_PATH=self.graph_path):
+            route = get_route_for_coords(*self.waypoints)
+            self.assertGreater(len(route['geometry']['coordinates']), 3)
+
+            far_away = [[-80.0, 40.0], [-81.0, 40.0], [-82.0, 40.0]]
+            route = get_route_for_coords(*far_away)
+        self.assertEqual(route['geometry']['coordinates'], far_away)
+        self.assertEqual(mock_fetch.call_count, 2)
+
+class MultiStopPlanTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('trip-plan-multi')
+
+    def test_order_respects_pickup_before_dropoff(self):
+        # Start at 0 on a line; the dropoff (x=1) is closest but its pickup is at x=4
+        xs = [0, 1, 2, 4, 3]
+        cost = [[abs(a - b) for b in xs] for a in xs]
+        precedence = {1: 3}
+        order = order_stops(cost, precedence)
+        self.assertTrue(is_feasible(order, precedence))
+        self.assertEqual(order, [0, 2, 4, 3, 1])
+        self.assertEqual(order_stops(cost), [0, 1, 2, 4, 3])
+
+    def test_local_search_improves_nearest_neighbour(self):
+        rng = np.random.default_rng(7)
+        points = rng.uniform(0, 100, size=(12, 2))
+        cost = np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1)).tolist()
+        self.assertLessEqual(path_cost(order_stops(cost), cost), path_cost(nearest_neighbour(cost, {}), cost))
+
+    def test_leg_simulation_matches_two_segment_plan(self):
+        classic = generate_eld_logs({'segment1_miles': 700, 'segment2_miles': 900}, 20)
+        legs = generate_leg_logs([(700, 60), (900, 60)], 20)
+        self.assertEqual(classic, legs)
+        logs, _ = ELDSimulator().simulate_legs([(60, 0), (60, 90)])
+        self.assertEqual(logs[0]['logs'][1:3], [
+            {'status': 'DRIVING', 'start': 8.0, 'end': 10.0},
+            {'status': 'ON', 'start': 10.0, 'end': 11.5},
+        ])
+
+    def test_one_matrix_and_one_directions_call(self):
+        payload = {
+            'start_location': 'Multi start',
+            'stops': [
+                {'location': 'Multi drop A', 'type': 'dropoff', 'shipment': 'A'},
+                {'location': 'Multi pick A', 'type': 'pickup', 'shipment': 'A', 'dwell_minutes': 30},
+                {'location': 'Multi pick B', 'type': 'pickup', 'shipment': 'B'},
+                {'location': 'Multi drop B', 'type': 'dropoff', 'shipment': 'B'},
+            ],
+        }
+        geocache.clear_local()
+        with StubORSServer(points_per_leg=20) as stub, \
+                override_settings(ORS_BASE_URL=stub.url, MAP_API_KEY='test-key'):
+            response = self.client.post(self.url, payload, format='json')
+            replay = self.client.post(self.url, payload, format='json')
+        ors.reset_session()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(stub.requests, 5 + 2)  # five geocodes, one matrix, one directions
+        self.assertEqual(replay.status_code, status.HTTP_200_OK)
+
+        visits = response.data['stops']
+        order = [(v['type'], v['shipment']) for v in visits]
+        self.assertLess(order.index(('PICKUP', 'A')), order.index(('DROPOFF', 'A')))
+        self.assertLess(order.index(('PICKUP', 'B')), order.index(('DROPOFF', 'B')))
+        self.assertAlmostEqual(sum(v['leg_miles'] for v in visits), response.data['distance_miles'], delta=0.1)
+        self.assertEqual([m['type'] for m in response.data['markers'][:5]], ['START'] + [t for t, _ in order])
+        self.assertEqual(response.data['dropoff_location'], visits[-1]['location'])
+
+    def test_rejects_unpaired_or_misordered_stops(self):
+        unpaired = {'start_location': 'S', 'stops': [{'location': 'D', 'type': 'dropoff', 'shipment': 'X'}]}
+        misordered = {
+            'start_location': 'S', 'optimize': False,
+            'stops': [
+                {'location': 'D', 'type': 'dropoff', 'shipment': 'X'},
+                {'location': 'P', 'type': 'pickup', 'shipment': 'X'},
+            ],
+        }
+        for payload in (unpaired, misordered):
+            response = self.client.post(self.url, payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class DepartureSweepTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('trip-sweep')
+
+    def test_start_hour_moves_the_first_duty_period(self):
+        logs, _ = ELDSimulator(0, start_hour=21.5).simulate(60, 0)
+        self.assertEqual(logs[0]['logs'][:2], [
+            {'status': 'OFF', 'start': 0.0, 'end': 21.5},
+            {'status': 'DRIVING', 'start': 21.5, 'end': 22.5},
+        ])
+        logs, _ = ELDSimulator(0, start_hour=0).simulate(60, 0)
+        self.assertEqual(logs[0]['logs'][0]['status'], 'DRIVING')
+
+    def assert_matches_engine(self, legs, hours, cycles):
+        result = sweep.sweep(legs, hours, cycles)
+        for i, (hour, cycle) in enumerate(zip(np.ravel(hours), np.ravel(cycles))):
+            sim = ELDSimulator(cycle, start_hour=hour)
+            sim.simulate_legs(legs)
+            kinds = [stop['type'] for stop in sim.stops]
+            on_duty = sum(end - start for day in sim.days for s, start, end in day if s in ('ON', 'DRIVING'))
+            self.assertEqual(
+                (sim.arrival, kinds.count('REST'), kinds.count('RESTART'), kinds.count('FUEL'), on_duty),
+                (result['arrival_minute'][i], result['rests'][i], result['restarts'][i],
+                 result['fuel_stops'][i], result['on_duty_minutes'][i]),
+            )
+        return result
+
+    def test_batched_sweep_matches_scalar_engine(self):
+        legs = [(1400, 60), (0, 30), (2200, 60)]
+        hours, cycles = np.meshgrid(np.arange(0, 24, 1.5), [0, 35, 62, 70], indexing='ij')
+        result = self.assert_matches_engine(legs, hours, cycles)
+        self.assertGreater(result['restarts'].max(), 0)
+
+    def test_sweep_matches_engine_near_the_cycle_limit(self):
+        # Fuel stops and dwells that would run past 70h take the restart first
+        result = self.assert_matches_engine([(60, 60)], [8.0], [68.5])
+        self.assertEqual((result['arrival_minute'][0], result['restarts'][0]), (2640, 1))
+
+        rng = np.random.default_rng(17)
+        for _ in range(20):
+            legs = [(int(miles), int(dwell)) for miles, dwell in zip(rng.integers(0, 1500, 3), rng.choice([0, 30, 60, 120], 3))]
+            self.assert_matches_engine(legs, rng.uniform(0, 24, 12).round(2), rng.uniform(55, 70, 12).round(2))
+
+    def test_start_hour_is_part_of_the_fingerprint(self):
+        data = {'start_location': 'A', 'pickup_location': 'B', 'dropoff_location': 'C', 'current_cycle_used': 0.0}
+        self.assertEqual(plan_fingerprint(data), plan_fingerprint(dict(data, start_hour=None)))
+        self.assertNotEqual(plan_fingerprint(data), plan_fingerprint(dict(data, start_hour=8.0)))
+
+    def test_sweep_endpoint_grid(self):
+        response = self.client.post(self.url, {
+            'legs': [{'miles': 600}, {'miles': 500, 'dwell_minutes': 30}],
+            'departure_step': 6,
+            'cycle_used': [0, 69],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(len(response.data['scenarios']), 4 * 2)
+        self.assertEqual(response.data['scenarios'][1]['cycle_used'], 69.0)
+        best = response.data['earliest_arrival']
+        self.assertEqual(best['arrival_hour'], min(s['arrival_hour'] for s in response.data['scenarios']))
+        self.assertEqual(best['departure_hour'], 0.0)
+        self.assertEqual(best['cycle_used'], 0.0)
+
+    @patch('trips.services.routing.get_route')
+    def test_sweep_endpoint_routes_locations(self, mock_get_route):
+        mock_get_route.return_value = get_mock_route([0, 0], [5, 5], [10, 10])
+        response = self.client.post(self.url, {
+            'start_location': 'A', 'pickup_location': 'B', 'dropoff_location': 'C', 'departure_hours': [8],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['legs']), 2)
+
+    def test_sweep_endpoint_limits(self):
+        both = {'legs': [{'miles': 10}], 'start_location': 'A'}
+        self.assertEqual(self.client.post(self.url, both, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(SWEEP_MAX_SCENARIOS=10):
+            response = self.client.post(self.url, {'legs': [{'miles': 10}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class AsyncPlanTests(TransactionTestCase):
+    # Async views run their ORM calls in per-request threads, so the rows
+    # have to be committed for the test to see them.
+    def setUp(self):
+        geocache.clear_local()
+
+    async def test_geocodes_concurrently_through_the_async_client(self):
+        latency_ms = 300
+        payload = {'start_location': 'Async A', 'pickup_location': 'Async B', 'dropoff_location': 'Async C'}
+        with StubORSServer(latency_ms=latency_ms, points_per_leg=20) as stub, \
+                override_settings(ORS_BASE_URL=stub.url, MAP_API_KEY='test-key'):
+            response = await AsyncClient().post(reverse('trip-plan-async'), payload, content_type='application/json')
+            replay = await AsyncClient().post(reverse('trip-plan-async'), payload, content_type='application/json')
+            await aors.reset_client()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.content)
+        body = response.json()
+        self.assertEqual(body['start_location'], 'Async A')
+        self.assertEqual(body['route_geometry']['coordinates'][0], fake_coords('Async A'))
+        self.assertEqual(stub.requests, 4)
+        self.assertEqual(replay.status_code, status.HTTP_200_OK)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        timings = dict(part.split(';dur=') for part in response['Server-Timing'].split(', '))
+        self.assertLess(float(timings['geocode']), 2 * latency_ms)  # three lookups, not three in a row
+        self.assertIn('eld', timings)
+
+    async def test_key_reused_for_different_request_loses_insert_race(self):
+        route = get_mock_route([0, 0], [5, 5], [10, 10])
+        data = {'start_location': 'A', 'pickup_location': 'B', 'dropoff_location': 'C'}
+        await sync_to_async(lambda: build_trip(data, route, idempotency_key='k-race').save())()
+        lookups = [lambda *args: None, planner.find_existing]
+        with patch('trips.services.planner.find_existing', side_effect=lambda *args: lookups.pop(0)(*args)), \
+                patch('trips.services.routing.aget_route', AsyncMock(return_value=route)):
+            response = await AsyncClient().post(
+                reverse('trip-plan-async'), dict(data, dropoff_location='D'),
+                content_type='application/json', headers={'Idempotency-Key': 'k-race'},
+            )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY, response.content)
+
+    async def test_async_search_uses_cache(self):
+        with StubORSServer() as stub, override_settings(ORS_BASE_URL=stub.url, MAP_API_KEY='test-key'):
+            first = await AsyncClient().get(reverse('location-search-async'), {'q': 'Denver'})
+            second = await AsyncClient().get(reverse('location-search-async'), {'q': 'denver '})
+            await aors.reset_client()
+        self.assertEqual(first.json(), [{'label': 'Denver', 'coords': fake_coords('Denver')}])
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(stub.requests, 1)
+
+    async def test_ndjson_streams_under_asgi(self):
+        route = get_mock_route([-122.4, 37.8], [-104.9, 39.7], [-71.1, 42.4])
+        payload = {'start_location': 'SF', 'pickup_location': 'Denver', 'dropoff_location': 'Boston'}
+        with patch('trips.services.routing.get_route', return_value=route):
+            response = await AsyncClient().post(reverse('trip-plan'), payload, content_type='application/json', ACCEPT='application/x-ndjson')
+            lines = [line async for line in response.streaming_content]
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        events = [json.loads(line) for line in lines]
+        self.assertEqual([events[0]['event'], events[-1]['event']], ['route', 'trip'])
+        self.assertTrue(await Trip.objects.filter(pk=events[-1]['id']).aexists())
+
+    async def test_export_streams_under_asgi(self):
+        route = get_mock_route([-122.4, 37.8], [-104.9, 39.7], [-71.1, 42.4])
+        payload = {'start_location': 'SF', 'pickup_location': 'Denver', 'dropoff_location': 'Boston'}
+        trip, _ = await sync_to_async(save_trip)(build_trip(payload, route))
+        response = await AsyncClient().get(reverse('trip-export'), {'type': 'pdf'})
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        names = zipfile.ZipFile(io.BytesIO(body)).namelist()
+        self.assertEqual(len(names), len(trip.eld_logs))
+        self.assertEqual(names[0], f"trip-{trip.id}/day-01.pdf")
+
+    async def test_sync_views_get_a_thread_each_under_the_asgi_handler(self):
+        from config.asgi import ThreadedASGIHandler
+
+        def slow_view(request):
+            time.sleep(0.3)
+            return threading.get_ident()
+
+        view = ThreadedASGIHandler().make_view_atomic(slow_view)
+        started = time.monotonic()
+        threads = await asyncio.gather(view(None), view(None), view(None))
+        self.assertLess(time.monotonic() - started, 0.6)  # not one after another on a shared thread
+        self.assertEqual(len(set(threads)), 3)
+
+    async def test_validation_errors(self):
+        response = await AsyncClient().post(reverse('trip-plan-async'), {'start_location': 'A'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['error'], 'Validation Failed')
+
+@override_settings(ORS_BASE_URL='http://ors.local', MAP_API_KEY='key-123', ORS_BREAKER_FAILURES=3,
+                   ORS_BREAKER_RESET_SECONDS=30, ORS_HEDGE_DELAY=0)
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        breaker.reset()
+        geocache.clear_local()
+        self.session = MagicMock()
+        self.session.post.return_value = MagicMock(status_code=503, text='down', headers={})
+        patcher = patch('trips.services.ors.get_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        breaker.reset()
+
+    def trip_circuit(self):
+        for _ in range(3):
+            ors.post(ors.DIRECTIONS, json={})
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        self.trip_circuit()
+        self.assertEqual(CircuitState.objects.get(endpoint=ors.DIRECTIONS).state, breaker.OPEN)
+        with self.assertRaises(breaker.CircuitOpen):
+            ors.post(ors.DIRECTIONS, json={})
+        self.assertEqual(self.session.post.call_count, 3)
+        # Other endpoints have their own circuit
+        self.session.get.return_value = MagicMock(status_code=200)
+        ors.get(ors.GEOCODE_SEARCH, params={'text': 'x'})
+
+    def test_state_is_shared_across_workers(self):
+        self.trip_circuit()
+        breaker._local.clear()  # A different process has no local copy
+        self.assertFalse(breaker.allow(ors.DIRECTIONS))
+
+    def test_half_open_lets_one_probe_through(self):
+        self.trip_circuit()
+        CircuitState.objects.update(retry_at=timezone.now() - timedelta(seconds=1))
+        breaker._local.clear()
+        self.assertTrue(breaker.allow(ors.DIRECTIONS))
+        breaker._local.clear()
+        self.assertFalse(breaker.allow(ors.DIRECTIONS))  # probe already in flight
+
+        breaker.record_success(ors.DIRECTIONS)
+        row = CircuitState.objects.get()
+        self.assertEqual((row.state, row.failures), (breaker.CLOSED, 0))
+        self.assertTrue(breaker.allow(ors.DIRECTIONS))
+
+    def test_failed_probe_reopens(self):
+        self.trip_circuit()
+        CircuitState.objects.update(retry_at=timezone.now() - timedelta(seconds=1))
+        breaker._local.clear()
+        ors.post(ors.DIRECTIONS, json={})
+        row = CircuitState.objects.get()
+        self.assertEqual(row.state, breaker.OPEN)
+        self.assertGreater(row.retry_at, timezone.now())
+
+    def test_open_circuit_plans_are_flagged_and_not_reused(self):
+        self.trip_circuit()
+        payload = {'start_location': '40.0,-100.0', 'pickup_location': '41.0,-100.0', 'dropoff_location': '42.0,-100.0'}
+        response = APIClient().post(reverse('trip-plan'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['route_source'], 'mock')
+        self.assertIn('circuit open', response.data['fallbacks'][0])
+        self.assertEqual(self.session.post.call_count, 3)  # no upstream call while open
+
+        # Once ORS is back, the same request is planned again instead of replaying the mock
+        breaker.reset()
+        with patch('trips.services.routing.get_route', return_value=dict(get_mock_route([0, 0], [1, 1], [2, 2]), source='ors', fallbacks=[])):
+            again = APIClient().post(reverse('trip-plan'), payload, format='json')
+        self.assertEqual(again.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(again.data['fallbacks'], [])
+
+    def test_degraded_plans_of_the_same_lane_are_not_deduplicated(self):
+        self.trip_circuit()
+        payload = {'start_location': '40.0,-100.0', 'pickup_location': '41.0,-100.0', 'dropoff_location': '42.0,-100.0'}
+        first = APIClient().post(reverse('trip-plan'), payload, format='json')
+        second = APIClient().post(reverse('trip-plan'), payload, format='json')
+        for response in (first, second):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertNotEqual(first.data['id'], second.data['id'])
+
+        # A retry with the same Idempotency-Key still replays the degraded plan
+        keyed = [APIClient().post(reverse('trip-plan'), payload, format='json', HTTP_IDEMPOTENCY_KEY='k-down') for _ in range(2)]
+        self.assertEqual(keyed[1].status_code, status.HTTP_200_OK)
+        self.assertEqual(keyed[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(keyed[0].data['id'], keyed[1].data['id'])
+
+    def test_geocode_fallback_is_reported(self):
+        self.session.get.return_value = MagicMock(status_code=503, headers={})
+        self.session.get.return_value.raise_for_status.side_effect = Exception("503 Server Error")
+        with patch('trips.services.routing.fetch_directions', return_value=get_mock_route([0, 0], [1, 1], [2, 2])):
+            route = get_route('Nowhere 1', '40.0,-100.0', '41.0,-100.0')
+        self.assertEqual(len(route['fallbacks']), 1)
+        self.assertIn("geocode 'Nowhere 1'", route['fallbacks'][0])
+
+    @override_settings(ORS_HEDGE_DELAY=0.05)
+    def test_slow_gets_are_hedged(self):
+        calls, responses = [], {}
+
+        def slow_then_fast(*args, **kwargs):
+            calls.append(time.monotonic())
+            marker = len(calls)
+            if marker == 1:
+                time.sleep(0.5)
+            responses[marker] = MagicMock(status_code=200, marker=marker)
+            return responses[marker]
+
+        self.session.get.side_effect = slow_then_fast
+        started = time.monotonic()
+        response = ors.get(ors.GEOCODE_SEARCH, params={'text': 'x'})
+        self.assertEqual(response.marker, 2)
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(len(calls), 2)
+
+        # The slow loser is closed once it answers, releasing its connection
+        time.sleep(0.6)
+        responses[1].close.assert_called_once()
+        responses[2].close.assert_not_called()
+
+class StreamingPlanTests(TestCase):
+    def setUp(self):
+        self.route = get_mock_route([-122.4, 37.8], [-104.9, 39.7], [-71.1, 42.4])  # ~2800 mi
+        self.payload = {'start_location': 'SF', 'pickup_location': 'Denver', 'dropoff_location': 'Boston', 'current_cycle_used': 30}
+
+    def events(self, response):
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_streams_days_and_markers_then_saves(self):
+        with patch('trips.services.routing.get_route', return_value=self.route):
+            response = APIClient().post(reverse('trip-plan'), self.payload, format='json', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        events = self.events(response)
+        self.assertEqual(events[0]['event'], 'route')
+        self.assertEqual(events[0]['route_source'], 'mock')
+        self.assertEqual(events[-1]['event'], 'trip')
+        self.assertFalse(events[-1]['replayed'])
+
+        # Same content as the buffered JSON plan, persisted once the stream ends
+        trip = Trip.objects.get(pk=events[-1]['id'])
+        expected = build_trip(self.payload, self.route)
+        self.assertEqual([e['day'] for e in events if e['event'] == 'day'], expected.eld_logs)
+        self.assertEqual([e['marker'] for e in events if e['event'] == 'marker'], expected.markers)
+        self.assertEqual(trip.eld_logs, expected.eld_logs)
+        self.assertEqual(trip.markers, expected.markers)
+        self.assertGreater(len(trip.eld_logs), 4)
+
+    def test_days_are_yielded_before_the_trip_is_simulated(self):
+        events = ELDSimulator(0).run_legs([(2500, 60), (2500, 60)])
+        kinds = []
+        for kind, _ in events:
+            kinds.append(kind)
+            if kind == 'day':
+                break
+        self.assertEqual(kinds[-1], 'day')
+        self.assertIn('stop', kinds)  # stops come out as they happen, too
+        remaining = [kind for kind, _ in events]
+        self.assertGreater(remaining.count('day'), 3)
+
+        stream = stream_trip(self.payload, self.route)
+        self.assertEqual(next(stream)[0], 'marker')
+        self.assertEqual(Trip.objects.count(), 0)
+
+    def test_replay_streams_stored_trip(self):
+        with patch('trips.services.routing.get_route', return_value=self.route):
+            first = self.events(APIClient().post(reverse('trip-plan'), self.payload, format='json', HTTP_ACCEPT='application/x-ndjson'))
+            replay = APIClient().post(reverse('trip-plan'), self.payload, format='json', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(replay.status_code, status.HTTP_200_OK)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        again = self.events(replay)
+        self.assertEqual(again[-1], {'event': 'trip', 'id': first[-1]['id'], 'replayed': True})
+        self.assertEqual(again[1:-1], sorted(first[1:-1], key=lambda e: e['event'] != 'marker'))
+
+    def test_errors_are_single_lines(self):
+        response = APIClient().post(reverse('trip-plan'), {'start_location': 'A'}, format='json', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.content.count(b'\n'), 1)
+        self.assertEqual(json.loads(response.content)['error'], 'Validation Failed')
+
+        with patch('trips.services.routing.get_route', return_value=self.route), \
+                patch('trips.services.planner.RouteIndex', side_effect=ValueError('bad geometry')):
+            response = APIClient().post(reverse('trip-plan'), self.payload, format='json', HTTP_ACCEPT='application/x-ndjson')
+            events = self.events(response)  # the plan runs as the body is read
+        self.assertEqual(events[-1]['event'], 'error')
+        self.assertFalse(Trip.objects.exists())
+
+class POISnapTests(TestCase):
+    # Straight eastbound route along 40N, ~1050 miles
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        coords = [[lon, 40.0] for lon in np.linspace(-100.0, -80.0, 201)]
+        cls.route_index = RouteIndex(coords)
+        total = cls.route_index.total_miles
+        cls.route = {
+            'distance_miles': total, 'duration_hours': total / 60.0,
+            'geometry': {'type': 'LineString', 'coordinates': coords},
+            'segment1_miles': 400.0, 'segment2_miles': total - 400.0,
+            'start_coords': coords[0], 'pickup_coords': cls.route_index.locate(400.0), 'dropoff_coords': coords[-1],
+        }
+
+        def at(mile, off_lat=0.01):
+            lon, lat = cls.route_index.locate(mile)
+            return lon, lat + off_lat
+
+        rows = [
+            ('Early Rest Area', 'rest area', *at(500)),       # more than the lookback before the 11h limit
+            ('Big Rig Plaza', 'Truck Stop', *at(640)),
+            ('Corner Gas', 'gas_station', *at(985)),
+            ('Far Off Fuel', 'fuel', *at(990, off_lat=0.1)),  # ~7 mi off the road
+            ('Mall', 'shopping', *at(700)),                   # not a kind we index
+        ]
+        cls.csv_path = os.path.join(cls.tmp.name, 'pois.csv')
+        with open(cls.csv_path, 'w') as fh:
+            fh.write('name,kind,longitude,latitude\n')
+            fh.writelines(f'{name},{kind},{lon},{lat}\n' for name, kind, lon, lat in rows)
+        cls.index_path = os.path.join(cls.tmp.name, 'pois.npz')
+        poi.build_index(cls.csv_path, cls.index_path, log=lambda *_: None)
+
+    @classmethod
+    def tearDownClass(cls):
+        poi.reset()
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.index = poi.POIIndex(self.index_path)
+        self.corridor = poi.Corridor(self.index, self.route_index, 2.0, 60.0)
+
+    def test_reads_csv_and_geojson(self):
+        self.assertEqual(len(self.index), 4)
+        geojson_path = os.path.join(self.tmp.name, 'pois.geojson')
+        with open(geojson_path, 'w') as fh:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-90.0, 40.0]}, 'properties': {'amenity': 'fuel', 'name': 'A'}},
+                {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-91.0, 40.0]}, 'properties': {'kind': 'parking'}},
+                {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}, 'properties': {'kind': 'fuel'}},
+            ]}, fh)
+        self.assertEqual([p[2:] for p in poi.read_pois(geojson_path)], [('fuel', 'A'), ('parking', '')])
+
+    def test_corridor_query_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        path = os.path.join(self.tmp.name, 'random.npz')
+        csv_path = os.path.join(self.tmp.name, 'random.csv')
+        lon, lat = rng.uniform(-100.5, -79.5, 3000), rng.uniform(39.8, 40.2, 3000)
+        kinds = rng.choice(poi.KINDS, 3000)
+        with open(csv_path, 'w') as fh:
+            fh.write('lat,lon,kind,name\n')
+            fh.writelines(f'{la},{lo},{k},p{i}\n' for i, (lo, la, k) in enumerate(zip(lon, lat, kinds)))
+        poi.build_index(csv_path, path, log=lambda *_: None)
+        corridor = poi.Corridor(poi.POIIndex(path), self.route_index, 2.0, 60.0)
+
+        per_degree = self.route_index.total_miles / 20.0
+        for start in rng.uniform(0, 980, 40):
+            stop_type = rng.choice(list(poi.SERVES))
+            mile = (lon + 100.0) * per_degree
+            ok = (np.isin(kinds, poi.SERVES[stop_type]) & (np.abs(lat - 40.0) * 69.0 <= 2.0)
+                  & (mile > start) & (mile <= start + 60))
+            found = corridor.last_before(stop_type, start, start + 60)
+            if not ok.any():
+                self.assertIsNone(found)
+                continue
+            expected = np.flatnonzero(ok)[np.argmax(mile[ok])]
+            self.assertEqual(found[1]['name'], f'p{expected}')
+            self.assertAlmostEqual(found[0], mile[expected], delta=0.5)
+
+    def test_stops_snap_to_the_last_poi_before_the_limit(self):
+        plain = generate_eld_logs(self.route, 0)['stops']
+        snapped = generate_eld_logs(self.route, 0, places=self.corridor)['stops']
+        self.assertEqual([(s['type'], round(s['distance_miles'])) for s in plain], [('REST', 660), ('FUEL', 1000)])
+
+        self.assertEqual([(s['type'], s['poi']['name']) for s in snapped], [('REST', 'Big Rig Plaza'), ('FUEL', 'Corner Gas')])
+        self.assertAlmostEqual(snapped[0]['distance_miles'], 640, delta=1)
+        self.assertAlmostEqual(snapped[1]['distance_miles'], 985, delta=1)
+
+    def test_planned_trip_markers_use_poi_coordinates(self):
+        payload = {'start_location': 'A', 'pickup_location': 'B', 'dropoff_location': 'C'}
+        fingerprint = plan_fingerprint(payload)
+        with override_settings(POI_INDEX_PATH=self.index_path), patch('trips.services.routing.get_route', return_value=self.route):
+            response = APIClient().post(reverse('trip-plan'), payload, format='json')
+            self.assertNotEqual(plan_fingerprint(payload), fingerprint)  # a new dataset means new plans
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        fuel = next(m for m in response.data['markers'] if m['type'] == 'FUEL')
+        self.assertEqual(fuel['label'], 'Corner Gas')
+        self.assertEqual(fuel['metadata']['poi'], {'name': 'Corner Gas', 'kind': 'fuel'})
+        self.assertAlmostEqual(fuel['lat'], 40.01)
+
+class SpatialQueryTests(TestCase):
+    def plan(self, name, *waypoints):
+        data = {'start_location': f'{name} start', 'pickup_location': f'{name} pickup', 'dropoff_location': f'{name} dropoff'}
+        trip, _ = save_trip(build_trip(data, get_mock_route(*waypoints)))
+        return trip
+
+    def setUp(self):
+        self.east = self.plan('east', [-100.0, 40.0], [-97.0, 40.0], [-90.0, 40.0])
+        self.south = self.plan('south', [-100.0, 35.0], [-95.0, 35.0], [-90.0, 35.0])
+        self.north = self.plan('north', [-95.0, 30.0], [-95.0, 38.0], [-95.0, 45.0])
+
+    def near(self, **params):
+        response = APIClient().get(reverse('trip-near'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [(row['id'], row['distance_to_point_miles']) for row in response.data['results']]
+
+    def within(self, bbox):
+        response = APIClient().get(reverse('trip-within'), {'bbox': ','.join(map(str, bbox))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return {row['id'] for row in response.data['results']}
+
+    def test_cells_are_written_on_save(self):
+        for trip in (self.east, self.south, self.north):
+            self.assertEqual(
+                sorted(TripRouteCell.objects.filter(trip=trip).values_list('cell', flat=True)),
+                spatial.route_cells(trip.route_geometry),
+            )
+        self.east.delete()
+        self.assertFalse(TripRouteCell.objects.filter(trip_id=self.east.id).exists())
+
+    def test_near_point(self):
+        found = self.near(lat=40.1, lon=-95.5, radius_miles=30)
+        self.assertEqual([trip_id for trip_id, _ in found], [self.east.id, self.north.id])
+        self.assertAlmostEqual(found[0][1], haversine(-95.5, 40.1, -95.5, 40.0), places=1)
+        self.assertEqual(self.near(lat=40.1, lon=-95.5, radius_miles=5), [])
+        self.assertEqual([trip_id for trip_id, _ in self.near(lat=40.1, lon=-95.5, radius_miles=30, limit=1)], [self.east.id])
+
+    def test_within_box(self):
+        self.assertEqual(self.within([-96, 34, -94, 36]), {self.south.id, self.north.id})
+        self.assertEqual(self.within([-91, 41, -89, 42]), set())
+        # No route vertex inside: the east-west segment only passes through
+        self.assertEqual(self.within([-96, 39.5, -95.8, 40.5]), {self.east.id})
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        for n in range(15):
+            waypoints = rng.uniform([-110, 30], [-80, 45], size=(3, 2)).tolist()
+            self.plan(f'random {n}', *waypoints)
+        trips = list(Trip.objects.all())
+        for lon, lat in rng.uniform([-110, 30], [-80, 45], size=(20, 2)):
+            expected = {t.id for t in trips if spatial.distance_to_route(t.route_geometry, lon, lat) <= 40}
+            self.assertEqual({t.id for t, _ in spatial.trips_near(lon, lat, 40, 1000)}, expected)
+
+    def test_limit_stops_refining_at_the_closest_trips(self):
+        rng = np.random.default_rng(5)
+        for n in range(12):
+            start = rng.uniform([-100, 35], [-90, 42])
+            self.plan(f'random {n}', start.tolist(), (start + [1.0, 0.5]).tolist(), (start + [2.0, 0.0]).tolist())
+        trips = list(Trip.objects.all())
+        lon, lat = -95.0, 38.5
+        expected = sorted((spatial.distance_to_route(t.route_geometry, lon, lat), t.id) for t in trips)[:3]
+        with patch.object(spatial, 'REFINE_CHUNK_SIZE', 1), patch.object(spatial, 'distance_to_route', wraps=spatial.distance_to_route) as refine:
+            found = spatial.trips_near(lon, lat, 500, 3)
+        self.assertEqual([(round(d, 6), t.id) for t, d in found], [(round(d, 6), i) for d, i in expected])
+        self.assertLess(refine.call_count, len(trips))
+
+    def test_query_touches_only_candidates(self):
+        routestore.clear_cache()
+        with CaptureQueriesContext(connection) as queries:
+            spatial.trips_near(-95.5, 40.1, 30, 10)
+        self.assertEqual(len(queries), 3)  # cell ranges, candidate rows, then their lines
+        self.assertIn('trips_triproutecell', queries[0]['sql'])
+        self.assertIn('trips_trip', queries[1]['sql'])
+        self.assertIn('trips_routegeometry', queries[2]['sql'])
+        with CaptureQueriesContext(connection) as queries:
+            spatial.trips_near(-95.5, 40.1, 30, 10)
+        self.assertEqual(len(queries), 2)  # hot lanes come from the geometry cache
+
+    def test_backfill_command(self):
+        TripRouteCell.objects.filter(trip=self.south).delete()
+        call_command('index_route_cells', stdout=open(os.devnull, 'w'))
+        self.assertEqual(TripRouteCell.objects.filter(trip=self.south).count(), len(spatial.route_cells(self.south.route_geometry)))
+
+    def test_invalid_queries(self):
+        for params in ({'lat': 40}, {'lat': 'x', 'lon': 1}, {'lat': 40, 'lon': -95, 'radius_miles': 0}, {'lat': 95, 'lon': 0}):
+            self.assertEqual(APIClient().get(reverse('trip-near'), params).status_code, status.HTTP_400_BAD_REQUEST)
+        for bbox in ('1,2,3', '-90,40,-100,41', '-120,20,-60,50'):
+            self.assertEqual(APIClient().get(reverse('trip-within'), {'bbox': bbox}).status_code, status.HTTP_400_BAD_REQUEST)
+
+class LogSheetExportTests(TestCase):
+    DAY = {'day': 1, 'logs': [
+        {'status': 'OFF', 'start': 0, 'end': 8}, {'status': 'ON', 'start': 8, 'end': 9},
+        {'status': 'DRIVING', 'start': 9, 'end': 20}, {'status': 'SB', 'start': 20, 'end': 24},
+    ]}
+
+    def setUp(self):
+        logsheets.clear_cache()
+
+    def plan(self, name, *waypoints):
+        data = {'start_location': f'{name} (start)', 'pickup_location': f'{name} pickup', 'dropoff_location': f'{name} dropoff'}
+        trip, _ = save_trip(build_trip(data, get_mock_route(*waypoints)))
+        return trip
+
+    def export(self, **params):
+        response = APIClient().get(reverse('trip-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        chunks = list(response.streaming_content)
+        return chunks, zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    def test_svg_sheet(self):
+        root = ElementTree.fromstring(logsheets.render_day(self.DAY, 'svg', ['Trip #1: A -> B & C']))
+        texts = [el.text for el in root.iter('{http://www.w3.org/2000/svg}text')]
+        self.assertIn('Trip #1: A -> B & C', texts)
+        self.assertIn('11.00', texts)  # driving total
+        self.assertIn('Total driving: 11.00 h    Total on duty: 12.00 h', texts)
+        duty = [el for el in root.iter('{http://www.w3.org/2000/svg}path') if el.get('stroke-width') == '2.5']
+        # OFF 0-8, ON 8-9, DRIVING 9-20, SB 20-24 on the 24 pt/hour grid
+        self.assertEqual(duty[0].get('d'), 'M150 190L342 190L342 310L366 310L366 270L630 270L630 230L726 230')
+
+    def test_pdf_sheet(self):
+        pdf = logsheets.render_day(self.DAY, 'pdf', ['Trip #1: (A) -> B'])
+        self.assertTrue(pdf.startswith(b'%PDF-1.4') and pdf.endswith(b'%%EOF\n'))
+        self.assertIn(b'(Trip #1: \\(A\\) -> B) Tj', pdf)
+        # Every xref entry points at its object
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        entries = pdf[xref:].split(b'\n')[3:9]
+        for number, entry in enumerate(entries, start=1):
+            self.assertTrue(pdf[int(entry[:10]):].startswith(f'{number} 0 obj'.encode()))
+
+    def test_pages_are_cached(self):
+        with patch('trips.services.logsheets.sheet_parts', wraps=logsheets.sheet_parts) as parts:
+            first = logsheets.render_day(self.DAY, 'svg', ['Trip #1'])
+            self.assertIs(logsheets.render_day(self.DAY, 'svg', ['Trip #1']), first)
+            logsheets.render_day(self.DAY, 'pdf', ['Trip #1'])
+            logsheets.render_day(self.DAY, 'svg', ['Trip #2'])
+        self.assertEqual(parts.call_count, 3)
+
+    def test_export_streams_zip(self):
+        first = self.plan('east', [-100.0, 40.0], [-90.0, 40.0], [-80.0, 40.0])
+        second = self.plan('south', [-100.0, 35.0], [-97.0, 35.0], [-95.0, 35.0])
+        chunks, archive = self.export(type='pdf')
+        self.assertGreaterEqual(len(chunks), 2)  # at least one chunk per trip
+        expected = [f"trip-{trip.id}/day-{day['day']:02d}.pdf" for trip in (first, second) for day in trip.eld_logs]
+        self.assertEqual(archive.namelist(), expected)
+        self.assertIsNone(archive.testzip())
+        self.assertTrue(archive.read(expected[0]).startswith(b'%PDF'))
+
+        _, archive = self.export(ids=str(second.id))
+        self.assertEqual(archive.namelist(), [f"trip-{second.id}/day-{day['day']:02d}.svg" for day in second.eld_logs])
+        ElementTree.fromstring(archive.read(archive.namelist()[0]))
+
+    def test_export_reads_trips_lazily(self):
+        trips = [self.plan(f'trip {n}', [-100.0 + n, 40.0], [-99.5 + n, 40.0], [-99.0 + n, 40.0]) for n in range(3)]
+        pulled = []
+        def source():
+            for trip in trips:
+                pulled.append(trip.id)
+                yield trip
+        stream = logsheets.export_zip(source())
+        next(stream)
+        self.assertEqual(pulled, [trips[0].id])
+        b''.join(stream)
+        self.assertEqual(pulled, [trip.id for trip in trips])
+
+    def test_invalid_export(self):
+        for params in ({'type': 'png'}, {'ids': '1,x'}):
+            self.assertEqual(APIClient().get(reverse('trip-export'), params).status_code, status.HTTP_400_BAD_REQUEST)
+
+class ColdStartTests(TestCase):
+    IMPORTTIME = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     encodings.idna
+import time:      2000 |       5000 |   django.urls
+import time:      3000 |       3000 |     django.urls.resolvers
+import time:       500 |       5500 | config.wsgi
+"""
+
+    def test_parse_importtime(self):
+        rows = coldstart.parse_importtime(self.IMPORTTIME)
+        self.assertEqual(rows[1], ('django.urls', 2000, 5000, 1))
+        self.assertEqual(rows[2][3], 2)
+        self.assertEqual(coldstart.by_package(rows), [('django', 5000), ('config', 500), ('encodings', 120)])
+
+    def test_lazy_module(self):
+        module = lazy_import('trips.services.sweep')
+        self.assertIn('lazy module', repr(module))
+        self.assertIs(module.sweep, sweep.sweep)
+        with patch('trips.services.sweep.scenarios', return_value=['patched']):
+            self.assertEqual(module.scenarios({}), ['patched'])
+
+    def test_trip_detail_does_not_load_numpy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'db.sqlite3')}")
+            setup = (
+                "from trips.models import Trip; from trips.services import snapshots; "
+                "trip = Trip.objects.create(start_location='A', pickup_location='B', dropoff_location='C', "
+                "route_geometry={'type': 'LineString', 'coordinates': [[0.0, 0.0], [1.0, 1.0]]}); "
+                "snapshots.store_snapshot(trip); print(trip.pk)"
+            )
+            subprocess.run([sys.executable, 'manage.py', 'migrate', '-v', '0'], env=env, check=True)
+            pk = subprocess.run([sys.executable, 'manage.py', 'shell', '-c', setup], env=env, check=True,
+                                capture_output=True, text=True).stdout.split()[-1]
+            with patch.dict(os.environ, env):
+                runs = [coldstart._child('config.settings_api', 'index', path)[0]
+                        for path in (f'/api/trips/{pk}/', f'/api/trips/{pk}/?detail=high')]
+        for run in runs:
+            self.assertEqual(run['status'], '200 OK')
+            self.assertNotIn('numpy', run['heavy'])
+
+    def test_api_profile_cold_start(self):
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('importtime', repeat=1, top=3, budget_ms=1, stdout=out)
+        report = out.getvalue()
+        self.assertIn('index with config.settings_api', report)
+        self.assertIn('(200 OK)', report)
+        heavy = next(line for line in report.splitlines() if line.startswith('Heavy modules loaded:'))
+        # Serving the health check must not load the planning stack
+        for name in ('numpy', 'httpx', 'trips.services.planner'):
+            self.assertNotIn(name, heavy)
+
+class RouteGeometryStoreTests(TestCase):
+    def setUp(self):
+        routestore.clear_cache()
+
+    def trip(self, name, geometry):
+        return Trip.objects.create(
+            start_location=name, pickup_location='B', dropoff_location='C',
+            distance_miles=10.0, duration_hours=1.0, route_geometry=geometry,
+        )
+
+    def test_round_trip_is_exact(self):
+        rng = np.random.default_rng(5)
+        lines = [
+            np.round(rng.uniform([-125, 25], [-65, 50], size=(300, 2)), decimals).tolist() for decimals in (5, 6, 7)
+        ]
+        lines.append(rng.uniform([-125, 25, 0], [-65, 50, 3000], size=(50, 3)).tolist())  # raw floats, 3D
+        for coords in lines:
+            geometry = {'type': 'LineString', 'coordinates': coords}
+            digest, data, points = routestore.encode(geometry)
+            self.assertEqual(routestore.decode(data), geometry)
+            self.assertEqual(points, len(coords))
+            self.assertEqual(len(digest), 64)
+        # Anything but a plain LineString is kept as JSON
+        for geometry in ({'type': 'Point', 'coordinates': [1, 2]}, {'type': 'LineString', 'coordinates': [], 'bbox': [0]}):
+            self.assertEqual(routestore.decode(routestore.encode(geometry)[1]), geometry)
+
+    def test_encoding_is_compact(self):
+        coords = [[round(-74.0 + i * 1e-4, 5), round(40.7 + i * 5e-5, 5)] for i in range(2000)]
+        _, data, _ = routestore.encode({'type': 'LineString', 'coordinates': coords})
+        self.assertLess(len(data), len(json.dumps(coords)) / 20)
+
+    def test_same_lane_is_stored_once(self):
+        geometry = {'type': 'LineString', 'coordinates': [[-100.0, 40.0], [-99.5, 40.25], [-99.0, 40.5]]}
+        first = self.trip('A', geometry)
+        second = self.trip('A again', {'type': 'LineString', 'coordinates': [list(c) for c in geometry['coordinates']]})
+        other = self.trip('B', {'type': 'LineString', 'coordinates': [[0.0, 0.0], [1.0, 1.0]]})
+        self.assertEqual(first.geometry_id, second.geometry_id)
+        self.assertNotEqual(first.geometry_id, other.geometry_id)
+        self.assertEqual(RouteGeometry.objects.count(), 2)
+        self.assertIsNone(Trip.objects.get(pk=first.pk).legacy_geometry)
+
+        # Decoded on read, then served from the cache for every trip on the lane
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Trip.objects.get(pk=first.pk).route_geometry, geometry)
+        self.assertEqual(len(queries), 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Trip.objects.get(pk=second.pk).route_geometry, geometry)
+        self.assertEqual(len(queries), 1)
+
+        # Changing the line moves the trip to another row
+        first.route_geometry = other.route_geometry
+        first.save()
+        self.assertEqual(Trip.objects.get(pk=first.pk).geometry_id, other.geometry_id)
+
+    @patch('trips.services.planner.get_route_for_coords')
+    def test_plan_batch_shares_rows(self, mock_route):
+        mock_route.side_effect = get_mock_route
+        lane = {"start_location": "41.87,-87.62", "pickup_location": "38.62,-90.19", "dropoff_location": "35.46,-97.51"}
+        payload = [dict(lane, current_cycle_used=float(cycle)) for cycle in (0, 10, 20)]
+        response = APIClient().post(reverse('trip-plan-batch'), payload, format='json')
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual(RouteGeometry.objects.count(), 1)
+        self.assertIsNotNone(RouteGeometry.objects.get().lod)  # Built while planning, stored with the line
+        self.assertFalse(Trip.objects.filter(geometry__isnull=True).exists())
+
+    def test_snapshots_share_the_lane_line_at_every_level(self):
+        lane = {'type': 'LineString', 'coordinates': [[-97.12345, 35.5], [-96.5, 35.75], [-96.0, 36.0]]}
+        trips = [self.trip(name, lane) for name in ('A', 'B')]
+        store_snapshots(trips, ['full', 'high'])
+        self.assertEqual(RouteGeometry.objects.filter(lod__isnull=False).count(), 1)
+        self.assertEqual(sorted(RenderedRoute.objects.values_list('detail', flat=True)), ['full', 'high'])
+        for trip in trips:
+            for level in ('full', 'high'):
+                stored = TripSnapshot.objects.get(trip=trip, detail=level)
+                self.assertTrue(stored.shared_geometry)
+                self.assertNotIn(b'-97.12345', gzip.decompress(stored.gzip_body))
+
+                url = reverse('trip-detail', args=[trip.pk])
+                expected = render_detail(Trip.objects.get(pk=trip.pk), level)
+                with CaptureQueriesContext(connection) as queries:
+                    response = APIClient().get(url, {'detail': level}, HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(len(queries), 2)  # etag lookup + body with the lane's line
+                self.assertEqual(gzip.decompress(response.content), expected)
+                self.assertEqual(response['ETag'], f'"{hashlib.sha256(expected).hexdigest()}-gzip"')
+                self.assertEqual(APIClient().get(url, {'detail': level}, HTTP_ACCEPT_ENCODING='identity').content, expected)
+
+    def test_prune_command(self):
+        kept = self.trip('kept', {'type': 'LineString', 'coordinates': [[-90.0, 35.0], [-89.0, 35.5]]})
+        gone = self.trip('gone', {'type': 'LineString', 'coordinates': [[-80.0, 35.0], [-79.0, 35.5]]})
+        orphan = gone.geometry_id
+        gone.delete()
+        self.assertEqual(RouteGeometry.objects.count(), 2)
+
+        # Just-stored rows may belong to a batch whose trips are not inserted yet
+        call_command('store_route_geometries', prune=True, stdout=io.StringIO())
+        self.assertEqual(RouteGeometry.objects.count(), 2)
+
+        RouteGeometry.objects.update(used_at=timezone.now() - timedelta(hours=2))
+        out = io.StringIO()
+        call_command('store_route_geometries', prune=True, stdout=out)
+        self.assertIn('Pruned 1 unreferenced geometries', out.getvalue())
+        self.assertEqual(list(RouteGeometry.objects.values_list('digest', flat=True)), [kept.geometry_id])
+        self.assertFalse(RouteGeometry.objects.filter(pk=orphan).exists())
+
+    def test_prune_keeps_a_row_reused_while_pruning(self):
+        lane = {'type': 'LineString', 'coordinates': [[-80.0, 35.0], [-79.0, 35.5]]}
+        self.trip('gone', lane).delete()
+        RouteGeometry.objects.update(used_at=timezone.now() - timedelta(hours=2))
+        replanned = Trip(start_location='again', pickup_location='B', dropoff_location='C', route_geometry=lane)
+        delete = QuerySet.delete
+
+        def reuse_then_delete(queryset):
+            # A plan reuses the orphan after prune picked it, before the delete
+            if queryset.model is RouteGeometry and replanned.geometry_pending:
+                routestore.store_trips([replanned])
+            return delete(queryset)
+
+        with patch.object(QuerySet, 'delete', reuse_then_delete):
+            self.assertEqual(routestore.prune(), 0)
+        replanned.save()
+        self.assertEqual(Trip.objects.get(pk=replanned.pk).route_geometry, lane)
+
+        # Once unused again it goes
+        replanned.delete()
+        RouteGeometry.objects.update(used_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(routestore.prune(), 1)
+
+    def test_backfill_command(self):
+        lane = {'type': 'LineString', 'coordinates': [[-90.0, 35.0], [-89.0, 35.5]]}
+        trips = [self.trip(str(i), lane) for i in range(3)]
+        # Rows saved before the store existed
+        Trip.objects.filter(pk__in=[t.pk for t in trips]).update(geometry=None, legacy_geometry=lane)
+        RouteGeometry.objects.all().delete()
+        routestore.clear_cache()
+
+        out = io.StringIO()
+        call_command('store_route_geometries', batch_size=2, stdout=out)
+        self.assertIn('Moved 3 trips', out.getvalue())
+        self.assertIn('1 geometries for 3 trips', out.getvalue())
+        self.assertFalse(Trip.objects.filter(legacy_geometry__isnull=False).exists())
+        self.assertEqual(Trip.objects.get(pk=trips[0].pk).route_geometry, lane)
+
+        # Not yet moved rows are still readable, and spatial search sees them
+        legacy = self.trip('legacy', None)
+        Trip.objects.filter(pk=legacy.pk).update(legacy_geometry=lane)
+        self.assertEqual(Trip.objects.get(pk=legacy.pk).route_geometry, lane)
+        spatial.backfill(log=lambda line: None)
+        self.assertIn(legacy.pk, {t.id for t, _ in spatial.trips_near(-89.5, 35.25, 5, 10)})
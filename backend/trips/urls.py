@@ -1,9 +1,26 @@
 
 from django.urls import path
-from .views import TripPlanView, TripDetailView, LocationSearchView
+from .views import (
+    TripPlanView, TripPlanBatchView, TripMultiStopPlanView, TripSweepView, TripDetailView, TripLogsView, TripMarkersView, TripGeometryView,
+    TripListView, TripExportView, TripNearView, TripWithinView, LocationSearchView, PlanJobDetailView, AsyncTripPlanView, AsyncLocationSearchView,
+)
 
 urlpatterns = [
+    path('', TripListView.as_view(), name='trip-list'),
     path('plan/', TripPlanView.as_view(), name='trip-plan'),
+    path('plan/batch/', TripPlanBatchView.as_view(), name='trip-plan-batch'),
+    path('plan/multi/', TripMultiStopPlanView.as_view(), name='trip-plan-multi'),
+    path('sweep/', TripSweepView.as_view(), name='trip-sweep'),
+    path('export/', TripExportView.as_view(), name='trip-export'),
+    path('near/', TripNearView.as_view(), name='trip-near'),
+    path('within/', TripWithinView.as_view(), name='trip-within'),
+    path('jobs/<int:pk>/', PlanJobDetailView.as_view(), name='plan-job-detail'),
     path('search/', LocationSearchView.as_view(), name='location-search'),
+    # Async variants for ASGI workers (same request/response shapes)
+    path('async/plan/', AsyncTripPlanView.as_view(), name='trip-plan-async'),
+    path('async/search/', AsyncLocationSearchView.as_view(), name='location-search-async'),
     path('<int:pk>/', TripDetailView.as_view(), name='trip-detail'),
+    path('<int:pk>/logs/', TripLogsView.as_view(), name='trip-logs'),
+    path('<int:pk>/markers/', TripMarkersView.as_view(), name='trip-markers'),
+    path('<int:pk>/geometry/', TripGeometryView.as_view(), name='trip-geometry'),
 ]
@@ -1,13 +1,45 @@
-import requests
+import asyncio
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timezone as dt_timezone
 from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.settings import api_settings
 from django.shortcuts import get_object_or_404
-from .models import Trip
-from .serializers import TripSerializer, TripPlanSerializer
-from .services.routing import get_route, interpolate_along_route
-from .services.eld_engine import generate_eld_logs
+from .models import ROUTE_GEOMETRY_COLUMNS, Trip, PlanJob, TripSnapshot
+from .renderers import NDJSONRenderer
+from .serializers import (
+    TripSerializer, TripSummarySerializer, TripPlanSerializer, MultiStopPlanSerializer, DepartureSweepSerializer,
+    PlanJobSerializer,
+)
+from .lazy import lazy_import
+from .services import geocache, lod_levels, metrics
+from .services.eld_engine import LOAD_UNLOAD
+
+# numpy, requests and httpx come in through these; they load on first use
+np = lazy_import('numpy')
+aors = lazy_import('trips.services.aors')
+jobs = lazy_import('trips.services.jobs')
+logsheets = lazy_import('trips.services.logsheets')
+ors = lazy_import('trips.services.ors')
+planner = lazy_import('trips.services.planner')
+routing = lazy_import('trips.services.routing')
+snapshots = lazy_import('trips.services.snapshots')
+spatial = lazy_import('trips.services.spatial')
+sweep = lazy_import('trips.services.sweep')
 
 class LocationSearchView(APIView):
     def get(self, request):
@@ -19,15 +51,17 @@ class LocationSearchView(APIView):
         if not api_key or "YOUR" in api_key:
             return Response({'error': 'MAP_API_KEY not configured on server'}, status=status.HTTP_400_BAD_REQUEST)
 
-        url = "https://api.openrouteservice.org/geocode/autocomplete"
+        cached = geocache.lookup(geocache.AUTOCOMPLETE, query)
+        if cached is not None:
+            return Response(cached)
+
         params = {
-            "api_key": api_key,
             "text": query,
             "size": 5
         }
         
         try:
-            response = requests.get(url, params=params, timeout=5)
+            response = ors.get(ors.GEOCODE_AUTOCOMPLETE, params=params)
             if response.status_code != 200:
                 # Return the actual error from ORS to help debug
                 try:
@@ -36,30 +70,172 @@ class LocationSearchView(APIView):
                     error_detail = response.text
                 return Response({'error': f'Routing API error: {error_detail}'}, status=response.status_code)
                 
-            data = response.json()
-            suggestions = []
-            for feature in data.get('features', []):
-                suggestions.append({
-                    'label': feature['properties'].get('label', ''),
-                    'coords': feature['geometry'].get('coordinates', [])
-                })
+            suggestions = autocomplete_suggestions(response.json())
+            geocache.store(geocache.AUTOCOMPLETE, query, suggestions)
             return Response(suggestions)
         except Exception as e:
             return Response({'error': f'Geocoding request failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def autocomplete_suggestions(data):
+    return [
+        {'label': feature['properties'].get('label', ''), 'coords': feature['geometry'].get('coordinates', [])}
+        for feature in data.get('features', [])
+    ]
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLocationSearchView(View):
+    """
+    LocationSearchView for ASGI workers: the ORS call awaits on the event
+    loop instead of holding a worker thread.
+    """
+    async def get(self, request):
+        query = request.GET.get('q', '')
+        if not query:
+            return JsonResponse([], safe=False)
+
+        api_key = settings.MAP_API_KEY
+        if not api_key or "YOUR" in api_key:
+            return JsonResponse({'error': 'MAP_API_KEY not configured on server'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cached = await sync_to_async(geocache.lookup)(geocache.AUTOCOMPLETE, query)
+        if cached is not None:
+            return JsonResponse(cached, safe=False)
+
+        try:
+            response = await aors.get(ors.GEOCODE_AUTOCOMPLETE, params={"text": query, "size": 5})
+            if response.status_code != 200:
+                try:
+                    error_detail = response.json()
+                except ValueError:
+                    error_detail = response.text
+                return JsonResponse({'error': f'Routing API error: {error_detail}'}, status=response.status_code)
+            suggestions = autocomplete_suggestions(response.json())
+        except Exception as e:
+            return JsonResponse({'error': f'Geocoding request failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        await sync_to_async(geocache.store)(geocache.AUTOCOMPLETE, query, suggestions)
+        return JsonResponse(suggestions, safe=False)
+
+def wants_async(request):
+    prefer = request.headers.get('Prefer', '')
+    return 'respond-async' in prefer or request.GET.get('async') in ('1', 'true')
+
+# 422 body for an Idempotency-Key reused with a different request, whether
+# found up front or after losing the insert race (planner.save_trip)
+IDEMPOTENCY_CONFLICT = {'error': 'Idempotency-Key was already used for a different trip request'}
+
+def wants_ndjson(request):
+    return NDJSONRenderer.media_type in request.headers.get('Accept', '')
+
+def ndjson(event, **fields):
+    return json.dumps(dict(event=event, **fields)).encode('utf-8') + b'\n'
+
+def route_event(trip):
+    return ndjson(
+        'route',
+        distance_miles=trip.distance_miles,
+        duration_hours=trip.duration_hours,
+        route_source=trip.route_source,
+        fallbacks=trip.fallbacks or [],
+        route_geometry=trip.route_geometry,
+    )
+
+def plan_events(data, route_data, idempotency_key=None):
+    """
+    NDJSON lines for a fresh plan: the route, then markers and days as the
+    ELD engine produces them, then the saved trip's id. The trip is only
+    persisted once the simulation has finished.
+    """
+    yield ndjson(
+        'route',
+        distance_miles=route_data['distance_miles'],
+        duration_hours=route_data['duration_hours'],
+        route_source=route_data.get('source'),
+        fallbacks=route_data.get('fallbacks') or [],
+        route_geometry=route_data['geometry'],
+    )
+    try:
+        for kind, payload in planner.stream_trip(data, route_data, idempotency_key=idempotency_key):
+            if kind == 'trip':
+                trip, created = planner.save_trip(payload)
+            else:
+                yield ndjson(kind, **{kind: payload})
+    except planner.IdempotencyConflict:
+        yield ndjson('error', **IDEMPOTENCY_CONFLICT)
+        return
+    except Exception as e:
+        print(f"TRIP PLAN STREAM ERROR: {e}")
+        yield ndjson('error', error=f"Internal Calculation Error: {str(e)}")
+        return
+    yield ndjson('trip', id=trip.id, replayed=not created)
+
+def trip_events(trip):
+    # A stored trip in the same shape as plan_events
+    yield route_event(trip)
+    for marker in trip.markers or []:
+        yield ndjson('marker', marker=marker)
+    for day in trip.eld_logs or []:
+        yield ndjson('day', day=day)
+    yield ndjson('trip', id=trip.id, replayed=True)
+
+async def _aiterate(iterator):
+    # Pull a sync generator one item at a time from the ASGI event loop;
+    # Django would otherwise read a sync iterator to the end before sending.
+    # The generator runs on a thread of its own (not the thread all sync
+    # code of the worker shares), the same one throughout so its queryset
+    # iterator keeps one database connection.
+    loop = asyncio.get_running_loop()
+    done = object()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            while True:
+                item = await loop.run_in_executor(executor, next, iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            await loop.run_in_executor(executor, connections.close_all)
+
+def streaming_body(request, iterator):
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return _aiterate(iterator)
+    return iterator
+
+def ndjson_response(request, events, code=status.HTTP_200_OK, headers=None):
+    events = streaming_body(request, events)
+    headers = {**(headers or {}), 'X-Accel-Buffering': 'no'}  # Ask proxies not to buffer the stream
+    return StreamingHttpResponse(events, status=code, content_type=NDJSONRenderer.media_type, headers=headers)
+
 class TripPlanView(APIView):
     authentication_classes = []
     permission_classes = []
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
 
     def post(self, request):
         print(f"TRIP PLAN REQUEST: {request.data}")
         serializer = TripPlanSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
+
+            # 0. Identical request (or retried Idempotency-Key) -> existing trip
+            fingerprint = planner.plan_fingerprint(data)
+            idempotency_key = request.headers.get('Idempotency-Key', '').strip()[:255] or None
+            try:
+                existing = planner.find_existing(fingerprint, idempotency_key)
+            except planner.IdempotencyConflict:
+                return Response(IDEMPOTENCY_CONFLICT, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if existing is not None:
+                if wants_ndjson(request):
+                    return ndjson_response(request, trip_events(existing), headers={'Idempotent-Replayed': 'true'})
+                return Response(TripSerializer(existing).data, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+
+            if wants_async(request):
+                job = jobs.enqueue(data)
+                body = PlanJobSerializer(job, context={'request': request}).data
+                return Response(body, status=status.HTTP_202_ACCEPTED, headers={'Location': body['status_url']})
             
             # 1. Routing Svc
             try:
-                route_data = get_route(
+                route_data = routing.get_route(
                     data['start_location'], 
                     data['pickup_location'],
                     data['dropoff_location']
@@ -70,55 +246,453 @@ class TripPlanView(APIView):
                 traceback.print_exc()
                 return Response({'error': f"Internal Calculation Error: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # 2. ELD Logic
-            eld_result = generate_eld_logs(
-                route_data,
-                data.get('current_cycle_used', 0.0)
-            )
-            logs = eld_result['logs']
-            stops_meta = eld_result['stops']
-            
-            # 3. Process Markers
-            markers = []
-            
-            # Add Start, Pickup, Dropoff
-            markers.append({'type': 'START', 'lat': route_data['start_coords'][1], 'lon': route_data['start_coords'][0], 'label': 'Start'})
-            pass_pickup_dist = route_data.get('segment1_miles', 0)
-            markers.append({'type': 'PICKUP', 'lat': route_data['pickup_coords'][1], 'lon': route_data['pickup_coords'][0], 'label': 'Pickup'})
-            markers.append({'type': 'DROPOFF', 'lat': route_data['dropoff_coords'][1], 'lon': route_data['dropoff_coords'][0], 'label': 'Dropoff'})
-            
-            # Interpolate stops
-            geometry = route_data['geometry']
-            for stop in stops_meta:
-                coords = interpolate_along_route(geometry, stop['distance_miles'])
-                markers.append({
-                    'type': stop['type'],
-                    'lat': coords[1],
-                    'lon': coords[0],
-                    'metadata': {'distance_miles': stop['distance_miles']}
-                })
-
-            # 4. Create Trip
-            trip = Trip.objects.create(
-                start_location=data['start_location'],
-                pickup_location=data['pickup_location'],
-                dropoff_location=data['dropoff_location'],
-                current_cycle_used=data.get('current_cycle_used', 0.0),
-                distance_miles=route_data['distance_miles'],
-                duration_hours=route_data['duration_hours'],
-                route_geometry=route_data['geometry'],
-                eld_logs=logs,
-                markers=markers
-            )
+            # 2. ELD Logic, markers (streamed day by day when asked for NDJSON)
+            if wants_ndjson(request):
+                return ndjson_response(request, plan_events(data, route_data, idempotency_key), code=status.HTTP_201_CREATED)
+            trip = planner.build_trip(data, route_data, idempotency_key=idempotency_key)
+
+            # 3. Create Trip (and its pre-rendered detail response); a concurrent
+            # duplicate that won the insert is returned instead
+            try:
+                trip, created = planner.save_trip(trip)
+            except planner.IdempotencyConflict:
+                return Response(IDEMPOTENCY_CONFLICT, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
             
-            return Response(TripSerializer(trip).data, status=status.HTTP_201_CREATED)
+            with metrics.timed('serialize'):
+                body = TripSerializer(trip).data
+            if not created:
+                return Response(body, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+            return Response(body, status=status.HTTP_201_CREATED)
         print(f"SERIALIZER VALIDATION FAIL: {serializer.errors}")
         return Response({'error': 'Validation Failed', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+def serialize_trip(trip):
+    with metrics.timed('serialize'):
+        return TripSerializer(trip).data
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncTripPlanView(View):
+    """
+    TripPlanView for ASGI workers. The three addresses are geocoded
+    concurrently through the async ORS client and the CPU-bound ELD /
+    marker / LOD step runs in a worker thread, so one process keeps many
+    plans in flight while they wait on the network.
+    """
+    async def post(self, request):
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = TripPlanSerializer(data=payload)
+        if not serializer.is_valid():
+            return JsonResponse({'error': 'Validation Failed', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()[:255] or None
+        try:
+            existing = await sync_to_async(planner.find_existing)(planner.plan_fingerprint(data), idempotency_key)
+        except planner.IdempotencyConflict:
+            return JsonResponse(IDEMPOTENCY_CONFLICT, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if existing is not None:
+            body = await sync_to_async(serialize_trip)(existing)
+            return JsonResponse(body, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+
+        if wants_async(request):
+            job = await sync_to_async(jobs.enqueue)(data)
+            body = PlanJobSerializer(job, context={'request': request}).data
+            return JsonResponse(body, status=status.HTTP_202_ACCEPTED, headers={'Location': body['status_url']})
+
+        try:
+            route_data = await routing.aget_route(data['start_location'], data['pickup_location'], data['dropoff_location'])
+        except Exception as e:
+            print(f"TRIP PLAN FATAL ERROR: {e}")
+            return JsonResponse({'error': f"Internal Calculation Error: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        trip = await sync_to_async(planner.build_trip, thread_sensitive=False)(data, route_data, idempotency_key=idempotency_key)
+        try:
+            trip, created = await sync_to_async(planner.save_trip)(trip)
+        except planner.IdempotencyConflict:
+            return JsonResponse(IDEMPOTENCY_CONFLICT, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        body = await sync_to_async(serialize_trip)(trip)
+        if not created:
+            return JsonResponse(body, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+        return JsonResponse(body, status=status.HTTP_201_CREATED)
+
+class TripMultiStopPlanView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        serializer = MultiStopPlanSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': 'Validation Failed', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()[:255] or None
+        try:
+            existing = planner.find_existing(planner.multi_stop_fingerprint(data), idempotency_key)
+        except planner.IdempotencyConflict:
+            return Response(IDEMPOTENCY_CONFLICT, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if existing is not None:
+            return Response(TripSerializer(existing).data, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            trip = planner.plan_multi_stop(data, idempotency_key=idempotency_key)
+        except Exception as e:
+            print(f"MULTI-STOP PLAN ERROR: {e}")
+            return Response({'error': f"Internal Calculation Error: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            trip, created = planner.save_trip(trip)
+        except planner.IdempotencyConflict:
+            return Response(IDEMPOTENCY_CONFLICT, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        with metrics.timed('serialize'):
+            body = TripSerializer(trip).data
+        if not created:
+            return Response(body, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+        return Response(body, status=status.HTTP_201_CREATED)
+
 class TripDetailView(APIView):
     authentication_classes = []
     permission_classes = []
+    fields = None  # Fixed fieldset for the sub-resource views below
     
     def get(self, request, pk):
-        trip = get_object_or_404(Trip, pk=pk)
-        return Response(TripSerializer(trip).data)
+        if self.fields is None and set(request.query_params) <= {'detail'}:
+            level = lod_levels.select_level(request.query_params.get('detail'))
+            if level is not None:
+                return snapshot_response(request, pk, level)
+
+        fields = self.fields or parse_fields(request.query_params.get('fields'))
+        if fields is None:
+            return Response({'error': f"Unknown field; use any of: {', '.join(trip_fields())}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            level = lod_levels.select_level(
+                request.query_params.get('detail'),
+                float(request.query_params['tolerance']) if 'tolerance' in request.query_params else None
+            )
+        except ValueError:
+            level = None
+        if level is None:
+            return Response({'error': f"Unknown detail level; use one of: {', '.join(geometry_levels())}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        columns = model_fields_for(fields, level != lod_levels.FULL)
+        trips = Trip.objects.only(*columns)
+        if 'geometry__lod' in columns:
+            trips = trips.select_related('geometry')  # The lane's LOD levels in the same query
+        trip = get_object_or_404(trips, pk=pk)
+        return Response(snapshots.detail_data(trip, fields, level))
+
+def snapshot_response(request, pk, level):
+    """
+    Serve the trip at a ?detail= level from its pre-compressed snapshot with
+    a strong ETag. A matching If-None-Match gets a 304 without reading the body.
+    """
+    stored = TripSnapshot.objects.filter(trip_id=pk, detail=level)
+    found = stored.values_list('etag', 'shared_geometry').first()
+    if found is None:
+        # Trips from before snapshots existed, and levels not built when the
+        # trip was saved, are rendered once, on demand.
+        snapshot = snapshots.store_snapshots([get_object_or_404(Trip, pk=pk)], [level])[0]
+        found = snapshot.etag, snapshot.shared_geometry
+    digest, shared = found
+
+    encoding = snapshots.choose_encoding(request.headers.get('Accept-Encoding'))
+    headers = {
+        'ETag': snapshots.etag_for(digest, encoding),
+        'Cache-Control': f'public, max-age={settings.TRIP_CACHE_MAX_AGE}, immutable',
+        'Vary': 'Accept-Encoding',
+    }
+    if snapshots.etag_matches(request.headers.get('If-None-Match'), digest):
+        return HttpResponseNotModified(headers=headers)
+
+    body, content_encoding = snapshots.stored_body(stored, shared, encoding)
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    return HttpResponse(body, content_type='application/json', headers=headers)
+
+class TripLogsView(TripDetailView):
+    fields = ('id', 'eld_logs')
+
+class TripMarkersView(TripDetailView):
+    fields = ('id', 'markers')
+
+class TripGeometryView(TripDetailView):
+    fields = ('id', 'route_geometry')
+
+def trip_fields():
+    return list(TripSerializer().fields)
+
+def parse_fields(param):
+    """
+    ?fields=a,b,c -> list of serializer fields (always including id).
+    Returns all fields when absent and None when a name is unknown.
+    """
+    available = trip_fields()
+    if not param:
+        return available
+    requested = [name.strip() for name in param.split(',') if name.strip()]
+    if any(name not in available for name in requested):
+        return None
+    return ['id'] + [name for name in requested if name != 'id']
+
+def model_fields_for(fields, simplified):
+    # Columns to load with .only(): a simplified geometry is read from the
+    # lane's LOD levels, so the full route geometry never leaves the database.
+    columns = set(fields)
+    if 'route_geometry' in columns:
+        columns.discard('route_geometry')
+        columns.update(ROUTE_GEOMETRY_COLUMNS)
+    if simplified and (columns & set(ROUTE_GEOMETRY_COLUMNS) or 'markers' in columns):
+        columns.difference_update(ROUTE_GEOMETRY_COLUMNS)
+        columns.update(('geometry', 'geometry__lod'))
+    return columns
+
+def geometry_levels():
+    return [lod_levels.FULL] + [name for name, _ in lod_levels.LOD_LEVELS]
+
+class TripPlanBatchView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        items = request.data.get('trips') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Expected a non-empty list of trip plans'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.PLAN_BATCH_MAX_ITEMS:
+            return Response({'error': f'Batch too large (max {settings.PLAN_BATCH_MAX_ITEMS} trips)'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = TripPlanSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'error': 'Validation Failed', 'details': serializer.errors}
+
+        planned = planner.plan_batch([data for _, data in valid])
+        for (index, _), outcome in zip(valid, planned):
+            if isinstance(outcome, Exception):
+                results[index] = {'index': index, 'error': f"Internal Calculation Error: {str(outcome)}"}
+            else:
+                results[index] = {
+                    'index': index,
+                    'id': outcome.id,
+                    'distance_miles': outcome.distance_miles,
+                    'duration_hours': outcome.duration_hours,
+                }
+
+        created = sum(1 for r in results if 'id' in r)
+        if created == len(items):
+            code = status.HTTP_201_CREATED
+        elif created:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'failed': len(items) - created, 'results': results}, status=code)
+
+class TripSweepView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        serializer = DepartureSweepSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': 'Validation Failed', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        if 'legs' in data:
+            legs = [(leg['miles'], leg['dwell_minutes']) for leg in data['legs']]
+        else:
+            try:
+                route_data = routing.get_route(data['start_location'], data['pickup_location'], data['dropoff_location'])
+            except Exception as e:
+                return Response({'error': f"Internal Calculation Error: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+            legs = [(route_data['segment1_miles'], LOAD_UNLOAD), (route_data['segment2_miles'], LOAD_UNLOAD)]
+
+        # Every departure hour x every cycle value, simulated in one batch
+        hours, cycles = np.meshgrid(data['departure_hours'], data['cycle_used'], indexing='ij')
+        with metrics.timed('sweep'):
+            result = sweep.sweep(legs, hours, cycles)
+        rows = sweep.scenarios(result)
+
+        earliest = int(np.argmin(result['arrival_minute']))
+        shortest = int(np.argmin(result['arrival_minute'] - result['departure_minute']))
+        return Response({
+            'legs': [{'miles': round(miles, 2), 'dwell_minutes': dwell} for miles, dwell in legs],
+            'scenarios': rows,
+            'earliest_arrival': rows[earliest],
+            'shortest_trip': rows[shortest],
+        })
+
+class PlanJobDetailView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, pk):
+        job = get_object_or_404(PlanJob.objects.select_related('trip'), pk=pk)
+        return Response(PlanJobSerializer(job, context={'request': request}).data)
+
+class TripListView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            limit = min(max(int(params.get('limit', settings.TRIP_LIST_PAGE_SIZE)), 1), settings.TRIP_LIST_MAX_PAGE_SIZE)
+            qs = filter_trips(Trip.objects.all(), params)
+            if params.get('cursor'):
+                created_at, last_id = decode_cursor(params['cursor'])
+                # Keyset: strictly after the last row of the previous page
+                qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id))
+        except (TypeError, ValueError) as e:
+            return Response({'error': f'Invalid query: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        summary_fields = TripSummarySerializer.Meta.fields
+        rows = list(qs.only(*summary_fields).order_by('-created_at', '-id')[:limit + 1])
+        page, has_more = rows[:limit], len(rows) > limit
+
+        next_cursor = encode_cursor(page[-1]) if has_more else None
+        next_url = None
+        if next_cursor:
+            query = params.copy()
+            query['cursor'] = next_cursor
+            next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+
+        return Response({
+            'results': TripSummarySerializer(page, many=True).data,
+            'next_cursor': next_cursor,
+            'next': next_url,
+        })
+
+class TripExportView(APIView):
+    """
+    GET /api/trips/export/?type=svg|pdf : a ZIP of log sheets, one file per
+    driver-day (trip-<id>/day-NN.<type>), for the trips matching ?ids=1,2,3
+    and/or the list filters. Streamed while trips are read in chunks, so
+    memory stays flat however many trips match.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        params = request.query_params
+        fmt = params.get('type', 'svg')
+        if fmt not in logsheets.FORMATS:
+            return Response({'error': f"type must be one of: {', '.join(logsheets.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            qs = filter_trips(Trip.objects.exclude(eld_logs__isnull=True), params)
+            if params.get('ids'):
+                qs = qs.filter(id__in=[int(pk) for pk in params['ids'].split(',') if pk.strip()])
+        except (TypeError, ValueError) as e:
+            return Response({'error': f'Invalid query: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        trips = qs.only(
+            'id', 'start_location', 'pickup_location', 'dropoff_location', 'distance_miles', 'created_at', 'eld_logs'
+        ).order_by('id').iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return StreamingHttpResponse(
+            streaming_body(request, logsheets.export_zip(trips, fmt)),
+            content_type='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename="log-sheets-{fmt}.zip"',
+                'X-Accel-Buffering': 'no',
+            },
+        )
+
+def spatial_limit(params):
+    return min(max(int(params.get('limit', settings.TRIP_LIST_PAGE_SIZE)), 1), settings.TRIP_LIST_MAX_PAGE_SIZE)
+
+class TripNearView(APIView):
+    """
+    GET /api/trips/near/?lat=&lon=&radius_miles= : trips whose route passes
+    within radius_miles of the point, closest first.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            lat, lon = float(params['lat']), float(params['lon'])
+            radius = float(params.get('radius_miles', 20))
+            limit = spatial_limit(params)
+        except (KeyError, TypeError, ValueError) as e:
+            return Response({'error': f'Invalid query: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({'error': 'Invalid query: lat/lon out of range'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius <= settings.SPATIAL_MAX_RADIUS_MILES:
+            return Response({'error': f'radius_miles must be in (0, {settings.SPATIAL_MAX_RADIUS_MILES:g}]'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with metrics.timed('spatial'):
+            found = spatial.trips_near(lon, lat, radius, limit, fields=TripSummarySerializer.Meta.fields)
+        results = []
+        for trip, distance in found:
+            row = TripSummarySerializer(trip).data
+            row['distance_to_point_miles'] = round(distance, 2)
+            results.append(row)
+        return Response({'results': results})
+
+class TripWithinView(APIView):
+    """
+    GET /api/trips/within/?bbox=min_lon,min_lat,max_lon,max_lat : newest
+    trips whose route passes through the box.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in params['bbox'].split(','))
+            limit = spatial_limit(params)
+        except (KeyError, TypeError, ValueError) as e:
+            return Response({'error': f'Invalid query: bbox must be min_lon,min_lat,max_lon,max_lat ({e})'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+            return Response({'error': 'Invalid query: bbox corners out of range or out of order'}, status=status.HTTP_400_BAD_REQUEST)
+        if max(max_lon - min_lon, max_lat - min_lat) > settings.SPATIAL_MAX_BOX_DEGREES:
+            return Response({'error': f'bbox may span at most {settings.SPATIAL_MAX_BOX_DEGREES:g} degrees'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with metrics.timed('spatial'):
+            trips = spatial.trips_within(min_lon, min_lat, max_lon, max_lat, limit, fields=TripSummarySerializer.Meta.fields)
+        return Response({'results': TripSummarySerializer(trips, many=True).data})
+
+def filter_trips(qs, params):
+    for field in ('start_location', 'pickup_location', 'dropoff_location'):
+        if params.get(field):
+            qs = qs.filter(**{field: params[field]})
+
+    for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+        if params.get(param):
+            qs = qs.filter(**{lookup: parse_timestamp(params[param])})
+
+    if params.get('min_distance'):
+        qs = qs.filter(distance_miles__gte=float(params['min_distance']))
+    if params.get('max_distance'):
+        qs = qs.filter(distance_miles__lte=float(params['max_distance']))
+    return qs
+
+def parse_timestamp(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"not a date or datetime: {value!r}")
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+def encode_cursor(trip):
+    raw = json.dumps([trip.created_at.isoformat(), trip.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, last_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(last_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError('malformed cursor') from e
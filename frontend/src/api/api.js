@@ -16,8 +16,9 @@ export const planTrip = async (tripData) => {
     return response.data;
 };
 
-export const getTrip = async (id) => {
-    const response = await api.get(`/trips/${id}/`);
+export const getTrip = async (id, detail = 'high') => {
+    // detail: full | high | medium | low | overview (simplified route geometry)
+    const response = await api.get(`/trips/${id}/`, { params: { detail } });
     return response.data;
 };
 
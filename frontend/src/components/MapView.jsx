@@ -38,7 +38,8 @@ const ICONS = {
     'PICKUP': createIcon(MapPin, '#16a34a'),
     'DROPOFF': createIcon(Flag, '#dc2626'),
     'FUEL': createIcon(Fuel, '#ea580c'),
-    'REST': createIcon(Bed, '#9333ea')
+    'REST': createIcon(Bed, '#9333ea'),
+    'RESTART': createIcon(Bed, '#4c1d95')
 };
 
 const SetBounds = ({ coords }) => {